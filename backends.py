@@ -0,0 +1,183 @@
+"""
+backends.py — пул Ollama-бэкендов
+=================================
+Несколько GPU-машин с Ollama используются одновременно:
+
+* состояние проверяется запросом `GET /api/tags`;
+* каждый запрос уходит на бэкенд с наименьшим числом запросов «в полёте»;
+* бэкенд, на котором упал запрос, исключается на `eject_seconds`, а запрос
+  повторяется на другом; фоновая проверка возвращает его, когда он ожил;
+* если для бэкенда задано восстановление (`recover`, например перезапуск
+  SSH-туннеля) и оно удалось, бэкенд не исключается, а запрос повторяется
+  на нём же;
+* по каждому бэкенду копится статистика: запросы, ошибки, токены, время.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional, TypeVar
+
+from transport import check_health
+
+T = TypeVar("T")
+
+
+class BackendError(RuntimeError):
+    """Сбой транспорта/сервера: бэкенд исключается, запрос повторяется на другом."""
+
+
+@dataclass
+class Backend:
+    url: str
+    outstanding: int = 0
+    ejected_until: float = 0.0
+    requests: int = 0
+    failures: int = 0
+    eval_tokens: int = 0
+    busy_seconds: float = 0.0
+    last_error: Optional[str] = field(default=None, repr=False)
+
+    def available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+
+class BackendPool:
+    """Балансировка по наименьшей загрузке с временным исключением сбойных бэкендов."""
+
+    def __init__(self, urls: list[str], eject_seconds: float = 60.0,
+                 health_interval: float = 15.0, max_attempts: Optional[int] = None,
+                 recover: Optional[Callable[[str, float], bool]] = None):
+        if not urls:
+            raise ValueError("Пул бэкендов пуст")
+        self.backends = [Backend(url) for url in urls]
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.max_attempts = max_attempts or max(2, len(urls))
+        # recover(url, started) → True, если после начала запроса бэкенд вернули в строй (туннель поднят заново)
+        self.recover = recover
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+
+    # ── здоровье ───────────────────────────────────────────────────────────
+    def check_all(self) -> None:
+        """Проверяет все бэкенды и исключает недоступные."""
+        for backend in self.backends:
+            ok = check_health(backend.url)
+            with self._lock:
+                backend.ejected_until = 0.0 if ok else time.monotonic() + self.eject_seconds
+            print(f"{'🟢' if ok else '🔴'} {backend.url}")
+
+    def healthy_urls(self) -> list[str]:
+        now = time.monotonic()
+        with self._lock:
+            return [b.url for b in self.backends if b.available(now)]
+
+    def start_health_checks(self) -> None:
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, name="backend-health", daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            now = time.monotonic()
+            with self._lock:
+                ejected = [b for b in self.backends if not b.available(now)]
+            for backend in ejected:
+                if check_health(backend.url):
+                    with self._lock:
+                        backend.ejected_until = 0.0
+                    print(f"🟢 Бэкенд снова доступен: {backend.url}")
+
+    def close(self) -> None:
+        self._stop.set()
+
+    # ── маршрутизация ──────────────────────────────────────────────────────
+    def acquire(self, exclude: Optional[set[str]] = None) -> Backend:
+        exclude = exclude or set()
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b.available(now) and b.url not in exclude]
+            if not candidates:
+                # все исключены — пробуем тот, чей таймаут истекает раньше всех
+                candidates = sorted(
+                    (b for b in self.backends if b.url not in exclude), key=lambda b: b.ejected_until
+                )[:1]
+            if not candidates:
+                raise BackendError("Нет доступных LLM-бэкендов")
+            backend = min(candidates, key=lambda b: (b.outstanding, b.requests))
+            backend.outstanding += 1
+            return backend
+
+    def release(self, backend: Backend, elapsed: float, error: Optional[Exception] = None,
+                stats: Optional[dict[str, Any]] = None) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.busy_seconds += elapsed
+            if error is not None:
+                backend.failures += 1
+                backend.last_error = str(error)
+                backend.ejected_until = time.monotonic() + self.eject_seconds
+            elif stats:
+                backend.eval_tokens += int(stats.get("eval_count") or 0)
+
+    def call(self, fn: Callable[[str], T]) -> tuple[T, str]:
+        """Выполняет `fn(url)` на наименее загруженном бэкенде.
+
+        При `BackendError` бэкенд исключается, вызов повторяется на другом.
+        Возвращает (результат, url обслужившего бэкенда).
+        """
+        tried: set[str] = set()
+        last_error: Optional[Exception] = None
+        for _ in range(self.max_attempts):
+            try:
+                backend = self.acquire(tried)
+            except BackendError:
+                break
+            started = time.monotonic()
+            try:
+                result = fn(backend.url)
+            except BackendError as e:
+                self.release(backend, time.monotonic() - started, error=e)
+                last_error = e
+                if self.recover is not None and self.recover(backend.url, started):
+                    with self._lock:
+                        backend.ejected_until = 0.0
+                    print(f"🔁 Бэкенд {backend.url} восстановлен, повторяем запрос: {e}")
+                    continue
+                print(f"⚠️ Бэкенд {backend.url} исключён на {self.eject_seconds:.0f} с: {e}")
+                tried.add(backend.url)
+                continue
+            except Exception:
+                self.release(backend, time.monotonic() - started)
+                raise
+            stats = result.get("stats") if isinstance(result, dict) else None
+            self.release(backend, time.monotonic() - started, stats=stats)
+            return result, backend.url
+        raise BackendError(f"Все попытки на бэкендах исчерпаны: {last_error}")
+
+    # ── отчёт ──────────────────────────────────────────────────────────────
+    def report(self) -> list[dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "url": b.url,
+                    "requests": b.requests,
+                    "failures": b.failures,
+                    "eval_tokens": b.eval_tokens,
+                    "busy_seconds": round(b.busy_seconds, 2),
+                    "tokens_per_second": round(b.eval_tokens / b.busy_seconds, 1) if b.busy_seconds else 0.0,
+                }
+                for b in self.backends
+            ]
+
+    def print_report(self) -> None:
+        print("📊 Бэкенды:")
+        for row in self.report():
+            print(
+                f"   {row['url']}: запросов {row['requests']}, ошибок {row['failures']}, "
+                f"токенов {row['eval_tokens']}, {row['tokens_per_second']} ток/с"
+            )
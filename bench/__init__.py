@@ -0,0 +1 @@
+"""Бенчмарк конвейера анализа чатов без GPU и MySQL."""
@@ -0,0 +1,53 @@
+"""
+Запуск `client_chat_processor.main()` под замером (вызывается из run_bench).
+
+Оборачивает `process_chat`, чтобы собрать задержку каждого чата, и пишет
+в JSON-файл задержки, общее время и пиковый RSS процесса.
+"""
+from __future__ import annotations
+
+import json
+import resource
+import sys
+import threading
+import time
+from pathlib import Path
+
+import client_chat_processor as ccp
+
+
+def main() -> None:
+    out_path = Path(sys.argv[1])
+    latencies: list[float] = []
+    lock = threading.Lock()
+    process_chat = ccp.process_chat
+
+    def timed_process_chat(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return process_chat(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+
+    ccp.process_chat = timed_process_chat
+    started = time.perf_counter()
+    exit_code = 0
+    try:
+        ccp.main()
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else 1
+    finally:
+        wall = time.perf_counter() - started
+        out_path.write_text(json.dumps({
+            "latencies": latencies,
+            "wall_seconds": wall,
+            # ru_maxrss в Linux — в килобайтах
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "exit_code": exit_code,
+        }), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
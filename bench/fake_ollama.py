@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+bench/fake_ollama.py — заглушка Ollama для бенчмарков
+=====================================================
+Отвечает на `GET /api/tags` и потоковый `POST /api/generate` в формате
+NDJSON, как настоящий Ollama: куски `response` с заданной скоростью и
+финальный кусок `done` со счётчиками `eval_count`, `eval_duration` и т.д.
+Поток идёт chunked-кодированием по HTTP/1.1 keep-alive, так что соединение
+после полного ответа переиспользуется, как у настоящего Ollama.
+На пачку чатов (`<chat id="N">`) отвечает `{"results": [...]}`; `--pack-drop`
+выкидывает часть результатов, чтобы проверить отдельные запросы.
+`--sloppy-model` отвечает доле запросов к этой модели несходящейся
+`total_sum` — для проверки каскада моделей. `POST /api/embed` отвечает
+эмбеддингами «мешка слов» (hashing trick): тексты с общими словами похожи.
+
+    python3 -m bench.fake_ollama --port 11435 --ttft 0.3 --tps 40 --fail-rate 0.02
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class FakeOllamaConfig:
+    ttft: float = 0.2          # задержка до первого токена, с
+    tps: float = 50.0          # токенов в секунду
+    fail_rate: float = 0.0     # доля запросов, отвечающих 500
+    chars_per_token: int = 4
+    seed: int = 0
+    pack_drop: float = 0.0     # доля чатов пачки, для которых результат не возвращается
+    sloppy_model: str = ""     # модель, которая иногда ошибается в total_sum
+    sloppy_rate: float = 0.0
+
+
+EMBED_DIM = 384
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+_PACKED_CHAT = re.compile(r'<chat id="(\d+)">\n(.*?)\n</chat>', re.DOTALL)
+
+
+def fake_result(prompt: str) -> dict:
+    """Детерминированный «ответ модели» по хэшу промпта."""
+    digest = int(hashlib.sha1(prompt.encode("utf-8")).hexdigest(), 16)
+    has_order = digest % 3 != 0
+    price = 1000 + digest % 9000
+    return {
+        "has_order": has_order,
+        "parameters": [
+            {"item": "маска", "material": "PLA", "color": "черный", "size": "160мм", "quantity": 1, "price": price}
+        ] if has_order else [],
+        "complaint": digest % 7 == 0,
+        "total_sum": price if has_order else None,
+        "summary": "Синтетический ответ заглушки Ollama.",
+    }
+
+
+def fake_embedding(text: str, dim: int = EMBED_DIM) -> list[float]:
+    """Детерминированный эмбеддинг: слова раскладываются по измерениям по хэшу."""
+    vector = [0.0] * dim
+    for word in _WORD.findall(text.lower()):
+        digest = int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16)
+        vector[digest % dim] += 1.0 if digest & 1 << 64 else -1.0
+    return vector
+
+
+def make_handler(cfg: FakeOllamaConfig, rng: random.Random, rng_lock: threading.Lock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):  # noqa: D401
+            pass
+
+        def _send_json(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):  # noqa: N802
+            if self.path.startswith("/api/tags"):
+                self._send_json(200, {"models": [{"name": "fake"}]})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):  # noqa: N802
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if self.path.startswith("/api/embed"):
+                texts = body.get("input", "")
+                texts = [texts] if isinstance(texts, str) else texts
+                self._send_json(200, {"model": body.get("model"), "embeddings": [fake_embedding(t) for t in texts]})
+                return
+            if not self.path.startswith("/api/generate"):
+                self._send_json(404, {"error": "not found"})
+                return
+            with rng_lock:
+                failed = rng.random() < cfg.fail_rate
+            if failed:
+                self._send_json(500, {"error": "synthetic failure"})
+                return
+
+            prompt = body.get("prompt", "")
+            if not prompt:  # прогрев модели
+                self._send_json(200, {"model": body.get("model"), "response": "", "done": True})
+                return
+
+            with rng_lock:
+                sloppy = body.get("model") == cfg.sloppy_model and rng.random() < cfg.sloppy_rate
+
+            def result(text: str) -> dict:
+                answer = fake_result(text)
+                if sloppy and answer["total_sum"]:
+                    answer["total_sum"] *= 3
+                return answer
+
+            packed = _PACKED_CHAT.findall(prompt)
+            if packed:
+                with rng_lock:
+                    kept = [(n, chat) for n, chat in packed if rng.random() >= cfg.pack_drop]
+                answer = {"results": [{"id": int(n), **result(chat)} for n, chat in kept]}
+            else:
+                answer = result(prompt)
+            text = json.dumps(answer, ensure_ascii=False)
+            tokens = [text[i:i + cfg.chars_per_token] for i in range(0, len(text), cfg.chars_per_token)]
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            started = time.monotonic()
+            try:
+                time.sleep(cfg.ttft)
+                gen_started = time.monotonic()
+                for token in tokens:
+                    self._send_chunk((json.dumps({"response": token, "done": False}, ensure_ascii=False) + "\n").encode())
+                    if cfg.tps:
+                        time.sleep(1 / cfg.tps)
+                now = time.monotonic()
+                final = {
+                    "response": "",
+                    "done": True,
+                    "total_duration": int((now - started) * 1e9),
+                    "load_duration": 0,
+                    "prompt_eval_count": max(1, len(prompt) // cfg.chars_per_token),
+                    "prompt_eval_duration": int(cfg.ttft * 1e9),
+                    "eval_count": len(tokens),
+                    "eval_duration": int((now - gen_started) * 1e9),
+                }
+                self._send_chunk((json.dumps(final) + "\n").encode())
+                self._send_chunk(b"")
+            except (BrokenPipeError, ConnectionResetError):
+                # клиент закрыл поток после завершённого JSON
+                self.close_connection = True
+
+    return Handler
+
+
+def serve(port: int = 0, cfg: FakeOllamaConfig | None = None) -> ThreadingHTTPServer:
+    """Запускает сервер в фоновом потоке. Порт 0 — выбрать свободный (см. `server_port`)."""
+    cfg = cfg or FakeOllamaConfig()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(cfg, random.Random(cfg.seed), threading.Lock()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-ollama", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушка Ollama для бенчмарков")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tps", type=float, default=50.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pack-drop", type=float, default=0.0)
+    parser.add_argument("--sloppy-model", default="")
+    parser.add_argument("--sloppy-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    server = serve(args.port, FakeOllamaConfig(args.ttft, args.tps, args.fail_rate, seed=args.seed,
+                                               pack_drop=args.pack_drop, sloppy_model=args.sloppy_model,
+                                               sloppy_rate=args.sloppy_rate))
+    print(f"🧪 Заглушка Ollama: http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+bench/gen_export.py — синтетический Telegram-экспорт
+====================================================
+Формат совпадает с `result.json` Telegram Desktop: `{"chats": {"list": [...]}}`.
+
+    python3 -m bench.gen_export --chats 2000 --messages 40 --out data/bench.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+from datetime import datetime, timedelta
+from pathlib import Path
+
+_CLIENT_LINES = [
+    "Здравствуйте, сколько будет стоить маска из PLA?",
+    "Размер примерно 160мм на 250мм, цвет черный",
+    "А можно в белом PETG?",
+    "Хорошо, оформляем, нужно 2 штуки",
+    "Когда будет готово?",
+    "Маска пришла, но размер больше, чем договаривались",
+    "Спасибо!",
+    "https://example.com/photo/123",
+]
+_MANAGER_LINES = [
+    "Добрый день! Пришлите, пожалуйста, размеры.",
+    "Стоимость {price} руб. за штуку",
+    "Печать займёт 3 дня",
+    "Оплатить можно переводом по номеру карты",
+    "Отправили СДЭК, трек-номер пришлём",
+    "Извините, переделаем бесплатно",
+]
+
+
+def generate_export(chats: int, messages: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, 9, 0, 0)
+    owner_id = 1
+    chat_list = []
+    for c in range(chats):
+        chat_id = 1000 + c
+        name = f"Клиент {c}"
+        when = start + timedelta(hours=rng.randint(0, 24 * 180))
+        msgs = []
+        for m in range(messages):
+            when += timedelta(minutes=rng.randint(1, 90))
+            from_client = m % 2 == 0
+            line = rng.choice(_CLIENT_LINES if from_client else _MANAGER_LINES)
+            msgs.append({
+                "id": m + 1,
+                "type": "message",
+                "date": when.strftime("%Y-%m-%dT%H:%M:%S"),
+                "from": name if from_client else "Менеджер",
+                "from_id": f"user{chat_id}" if from_client else f"user{owner_id}",
+                "text": line.format(price=rng.randint(10, 90) * 100),
+            })
+        chat_list.append({"name": name, "type": "personal_chat", "id": chat_id, "messages": msgs})
+    return {
+        "about": "Synthetic export for benchmarks",
+        "personal_information": {"user_id": owner_id},
+        "chats": {"about": "", "list": chat_list},
+    }
+
+
+def write_export(path: Path, chats: int, messages: int, seed: int = 0) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(generate_export(chats, messages, seed), ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Синтетический Telegram-экспорт")
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", type=Path, default=Path("data/bench.json"))
+    args = parser.parse_args()
+    write_export(args.out, args.chats, args.messages, args.seed)
+    print(f"📝 Экспорт записан: {args.out} ({args.chats} чатов × {args.messages} сообщений)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+bench/run_bench.py — сквозной бенчмарк конвейера
+================================================
+Поднимает заглушки Ollama, генерирует синтетический экспорт, запускает
+`client_chat_processor.main()` в отдельном процессе с SQLite вместо MySQL
+и выключенным кэшем LLM, затем печатает:
+
+* чатов в секунду;
+* p50/p95/p99 задержки одного чата;
+* пиковый RSS процесса.
+
+Результат сохраняется в `bench/results/` и сравнивается с последним
+прогоном с теми же параметрами — так видны регрессии.
+
+    python3 -m bench.run_bench --chats 500 --messages 30 --concurrency 8 --backends 2
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from bench.fake_ollama import FakeOllamaConfig, serve
+from bench.gen_export import write_export
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+# Насколько можно ухудшиться относительно прошлого прогона, прежде чем ругаться
+REGRESSION_THRESHOLD = 0.10
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def run_once(params: dict[str, Any], keep: bool = False) -> dict[str, Any]:
+    workdir = Path(tempfile.mkdtemp(prefix="chat_bench_"))
+    export = write_export(workdir / "export.json", params["chats"], params["messages"], params["seed"])
+    servers = [
+        serve(0, FakeOllamaConfig(ttft=params["ttft"], tps=params["tps"],
+                                  fail_rate=params["fail_rate"], seed=params["seed"] + i))
+        for i in range(params["backends"])
+    ]
+    metrics_path = workdir / "bench_child.json"
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_ROOT), os.environ.get("PYTHONPATH")])),
+        "CHAT_FILE": str(export),
+        "OUTPUT_DIR": str(workdir / "output"),
+        "HISTORY_DB": str(workdir / "output" / "history.sqlite"),
+        "LLM_HOST": "",
+        "LLM_HOSTS": ",".join(f"http://127.0.0.1:{s.server_port}" for s in servers),
+        "SSH_HOST": "",
+        "SSH_HOSTS": "",
+        "LLM_CONCURRENCY": str(params["concurrency"]),
+        "LLM_CACHE": "off",
+        "DB_BACKEND": "sqlite",
+        "DB_SQLITE_PATH": str(workdir / "output" / "results.sqlite"),
+    }
+    (workdir / "output").mkdir()
+    log_path = workdir / "run.log"
+    try:
+        with log_path.open("w", encoding="utf-8") as log:
+            subprocess.run(
+                [sys.executable, "-m", "bench._child", str(metrics_path)],
+                cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=False,
+            )
+        child = json.loads(metrics_path.read_text(encoding="utf-8"))
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    latencies = child["latencies"]
+    wall = child["wall_seconds"]
+    result = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "params": params,
+        "exit_code": child["exit_code"],
+        "chats": len(latencies),
+        "wall_seconds": round(wall, 3),
+        "chats_per_second": round(len(latencies) / wall, 3) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p95": round(percentile(latencies, 0.95), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        "peak_rss_mb": round(child["peak_rss_mb"], 1),
+    }
+    if keep:
+        result["workdir"] = str(workdir)
+        print(f"📁 Рабочая папка: {workdir} (лог: {log_path.name})")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def previous_result(params: dict[str, Any]) -> Optional[dict[str, Any]]:
+    if not RESULTS_DIR.exists():
+        return None
+    for path in sorted(RESULTS_DIR.glob("*.json"), reverse=True):
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError):
+            continue
+        if data.get("params") == params:
+            return data
+    return None
+
+
+def compare(current: dict[str, Any], previous: dict[str, Any]) -> list[str]:
+    """Список регрессий относительно прошлого прогона."""
+    problems = []
+    if previous["chats_per_second"] and current["chats_per_second"] < previous["chats_per_second"] * (1 - REGRESSION_THRESHOLD):
+        problems.append(f"пропускная способность {previous['chats_per_second']} → {current['chats_per_second']} чат/с")
+    for key in ("latency_p95", "latency_p99", "peak_rss_mb"):
+        if previous[key] and current[key] > previous[key] * (1 + REGRESSION_THRESHOLD):
+            problems.append(f"{key} {previous[key]} → {current[key]}")
+    return problems
+
+
+def save_result(result: dict[str, Any]) -> Path:
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    path = RESULTS_DIR / f"{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    path.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк client_chat_processor")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--backends", type=int, default=1)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--tps", type=float, default=200.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keep", action="store_true", help="оставить рабочую папку с логом прогона")
+    parser.add_argument("--no-save", action="store_true", help="не сохранять результат")
+    args = parser.parse_args()
+
+    params = {
+        "chats": args.chats,
+        "messages": args.messages,
+        "concurrency": args.concurrency,
+        "backends": args.backends,
+        "ttft": args.ttft,
+        "tps": args.tps,
+        "fail_rate": args.fail_rate,
+        "seed": args.seed,
+    }
+    result = run_once(params, keep=args.keep)
+
+    print(f"🏁 Чатов: {result['chats']} за {result['wall_seconds']} с — {result['chats_per_second']} чат/с")
+    print(f"   Задержка чата: p50 {result['latency_p50']} с, p95 {result['latency_p95']} с, p99 {result['latency_p99']} с")
+    print(f"   Пиковый RSS: {result['peak_rss_mb']} МБ")
+    if result["exit_code"]:
+        print(f"⚠️ Процесс завершился с кодом {result['exit_code']}")
+
+    previous = previous_result(params)
+    if previous:
+        problems = compare(result, previous)
+        if problems:
+            print(f"⚠️ Регрессия относительно {previous['timestamp']}: " + "; ".join(problems))
+        else:
+            print(f"✅ Без регрессий относительно {previous['timestamp']}")
+
+    if not args.no_save:
+        print(f"💾 Результат: {save_result(result)}")
+    if previous and compare(result, previous):
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+chunking.py — map‑reduce для длинных чатов
+==========================================
+Длинный диалог режется на перекрывающиеся окна по границам сообщений,
+каждое окно анализируется отдельно, а частичные JSON сливаются в один
+результат тем же набором полей (`has_order`, `parameters`, `total_sum`,
+`complaint`, `summary`).
+"""
+from __future__ import annotations
+
+import json
+from typing import Any
+
+from coerce import items_total, sums_match, to_number
+
+# Грубая оценка для смешанного русского/английского текста
+CHARS_PER_TOKEN = 3
+# Токены, оставляемые под инструкцию и ответ модели
+RESERVED_TOKENS = 1536
+
+
+def window_chars_for_ctx(num_ctx: int, reserved_tokens: int = RESERVED_TOKENS) -> int:
+    """Сколько символов диалога помещается в контекст модели вместе с инструкцией."""
+    return max(1_000, (num_ctx - reserved_tokens) * CHARS_PER_TOKEN)
+
+
+def split_windows(messages: list[str], max_chars: int, overlap: int = 3) -> list[list[str]]:
+    """Делит сообщения на окна не длиннее `max_chars` (с учётом переводов строк).
+
+    Соседние окна делят `overlap` последних сообщений, чтобы не терять
+    контекст на стыке. Слишком длинное сообщение режется на куски.
+    """
+    pieces: list[str] = []
+    for msg in messages:
+        while len(msg) > max_chars:
+            pieces.append(msg[:max_chars])
+            msg = msg[max_chars:]
+        pieces.append(msg)
+
+    windows: list[list[str]] = []
+    start = 0
+    while start < len(pieces):
+        size = 0
+        end = start
+        while end < len(pieces) and size + len(pieces[end]) <= max_chars:
+            size += len(pieces[end]) + 1
+            end += 1
+        windows.append(pieces[start:end])
+        if end >= len(pieces):
+            break
+        # перекрытие берём такое, чтобы следующее окно вместило хотя бы одно новое сообщение
+        nxt = max(start + 1, end - overlap)
+        while nxt < end and sum(len(p) + 1 for p in pieces[nxt:end + 1]) - 1 > max_chars:
+            nxt += 1
+        start = nxt
+    return windows
+
+
+def _item_key(item: Any) -> str:
+    return json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+
+def _dicts(items: list[Any]) -> list[dict]:
+    return [item for item in items if isinstance(item, dict)]
+
+
+def reconcile_total(reported: list[tuple[float, Any]], parameters: list[Any], line_prices: bool) -> Any:
+    """Итоговая сумма длинного чата по суммам окон и объединённым позициям.
+
+    Каждое окно видит только свою часть заказа, поэтому последняя или любая
+    одна названная сумма занижает итог. Берётся наибольшая названная сумма;
+    если она не сходится с позициями и сумма позиций больше — сумма позиций
+    (`price` как стоимость строки, если так считали окна, иначе `price * quantity`).
+    """
+    if not reported:
+        return None
+    best, raw = max(reported, key=lambda item: item[0])
+    sums = items_total(_dicts(parameters)) if parameters else None
+    if sums is None or any(sums_match(best, s) for s in sums):
+        return raw
+    items = sums[1] if line_prices else sums[0]
+    return round(items, 2) if items > best else raw
+
+
+def merge_partials(partials: list[dict]) -> dict:
+    """Reduce‑шаг: сливает результаты окон в порядке следования в диалоге.
+
+    * `has_order` — есть ли заказ хоть в одном окне;
+    * `parameters` — объединение позиций без дублей из перекрытий;
+    * `total_sum` — сверяется с позициями всех окон (`reconcile_total`);
+    * `complaint` — жалоба хоть в одном окне (тексты жалоб склеиваются);
+    * `summary` — резюме окон по порядку.
+    """
+    merged: dict[str, Any] = {
+        "has_order": False,
+        "parameters": [],
+        "complaint": False,
+        "total_sum": None,
+        "summary": "",
+    }
+    seen: set[str] = set()
+    complaints: list[str] = []
+    summaries: list[str] = []
+    reported: list[tuple[float, Any]] = []
+    line_prices = False
+
+    for part in partials:
+        merged["has_order"] = merged["has_order"] or bool(part.get("has_order"))
+
+        params = part.get("parameters") or []
+        if isinstance(params, dict):
+            params = [params]
+        for item in params:
+            key = _item_key(item)
+            if key not in seen:
+                seen.add(key)
+                merged["parameters"].append(item)
+
+        total = to_number(part.get("total_sum"))
+        if total:
+            reported.append((total, part.get("total_sum")))
+            # окно, чья сумма сошлась только с суммой price, записало в price стоимость строки
+            own = items_total(_dicts(params)) if params else None
+            if own is not None and sums_match(total, own[1]) and not sums_match(total, own[0]):
+                line_prices = True
+
+        complaint = part.get("complaint")
+        if isinstance(complaint, str) and complaint.strip():
+            if complaint.strip() not in complaints:
+                complaints.append(complaint.strip())
+        elif complaint:
+            merged["complaint"] = True
+
+        summary = part.get("summary")
+        if isinstance(summary, str) and summary.strip() and summary.strip() not in summaries:
+            summaries.append(summary.strip())
+
+        for key, value in part.items():
+            merged.setdefault(key, value)
+
+    merged["total_sum"] = reconcile_total(reported, merged["parameters"], line_prices)
+    if complaints:
+        merged["complaint"] = " ".join(complaints)
+    merged["summary"] = " ".join(summaries)
+    return merged
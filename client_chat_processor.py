@@ -9,20 +9,38 @@ client_chat_processor.py — v0.4.1 (zero‑arg, bug‑fix)
 from __future__ import annotations
 import re
 
-from db import insert_json_result
+from db import DbConfig, close as close_db, insert_json_result
+from backends import BackendError, BackendPool
+from compact import client_senders, compact_messages
+from chunking import CHARS_PER_TOKEN, merge_partials, split_windows, window_chars_for_ctx
+from dataset import ResultDataset
+from embeddings import EmbeddingIndex, IndexBuffer, ollama_embed
+from history_store import HistoryStore
+from job_queue import JobQueue, make_owner
+from json_stream import JsonObjectScanner
+from llm_cache import LLMCache, cache_key
+from metrics import metrics
+from packing import ChatPacker
+from prefilter import PREFILTER_MODEL, PREFILTER_VERSION, score_chat, skipped_result
+from telegram_export import export_owner, iter_chat_entries
+import transport
+from validation import validate_result
+import glob
+import itertools
 import json
+import multiprocessing
 import os
-import signal
-import subprocess
 import sys
+import threading
 import time
 import uuid
-from contextlib import contextmanager
-from dataclasses import dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import asdict, dataclass, field
 from datetime import datetime, timezone
 
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
 from datetime import datetime
 import requests
 import hashlib
@@ -33,16 +51,30 @@ def compute_text_hash(text: str) -> str:
 # ────────────────────────────────────────────────────────────────────────────────
 # 🔧 Конфигурация
 # ────────────────────────────────────────────────────────────────────────────────
+def _split_env(name: str) -> list[str]:
+    return [item.strip() for item in os.getenv(name, "").split(",") if item.strip()]
+
+
+def _optional_path(value: str) -> Optional[Path]:
+    return Path(value) if value else None
+
+
 @dataclass
 class EnvConfig:
     """Читаем все настройки из env‑переменных."""
 
+    # файл экспорта, каталог (все *.json внутри) или glob-маска `exports/*/result.json`
     chat_file: Path = Path(os.getenv("CHAT_FILE", "data/chat.json"))
+    # процессов для разбора нескольких файлов экспорта
+    ingest_workers: int = max(1, int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1)))
     output_dir: Path = Path(os.getenv("OUTPUT_DIR", "output"))
+    history_db: Path = Path(os.getenv("HISTORY_DB", "output/history.sqlite"))
 
     # LLM connection (direct or via SSH)
     llm_host: Optional[str] = os.getenv("LLM_HOST")
     llm_model: str = os.getenv("LLM_MODEL", "gemma3n")
+    # каскад от быстрой модели к крупной: ответ, не прошедший проверки, уходит следующей
+    llm_models: list[str] = field(default_factory=lambda: _split_env("LLM_MODELS"))
     api_key: Optional[str] = os.getenv("LLM_API_KEY")
 
     # SSH tunnel settings (used when llm_host is None)
@@ -53,127 +85,396 @@ class EnvConfig:
     local_port: int = int(os.getenv("LOCAL_PORT", 11434))
     ssh_pass: Optional[str] = os.getenv("SSH_PASS")
 
+    # Пул бэкендов: LLM_HOSTS — URL через запятую, SSH_HOSTS — [user@]host[:port] через запятую
+    llm_hosts: list[str] = field(default_factory=lambda: _split_env("LLM_HOSTS"))
+    ssh_hosts: list[str] = field(default_factory=lambda: _split_env("SSH_HOSTS"))
+    backend_eject_seconds: float = float(os.getenv("BACKEND_EJECT_SECONDS", 60))
+
+    # Сколько чатов одновременно держим «в полёте» у LLM
+    llm_concurrency: int = max(1, int(os.getenv("LLM_CONCURRENCY", 1)))
+
+    # Контекст модели: по нему длинные чаты режутся на окна (map‑reduce)
+    llm_num_ctx: int = int(os.getenv("LLM_NUM_CTX", 8192))
+    chunk_overlap: int = int(os.getenv("CHUNK_OVERLAP", 3))
+
+    # Предфильтр: чаты без признаков заказа/жалобы не отправляются в LLM (PREFILTER=0 — слать всё)
+    prefilter: bool = os.getenv("PREFILTER", "1") not in ("0", "false", "no")
+    prefilter_min_score: float = float(os.getenv("PREFILTER_MIN_SCORE", 2))
+    prefilter_min_messages: int = int(os.getenv("PREFILTER_MIN_MESSAGES", 2))
+
+    # Сжатие промпта: метки К/М, без дублей, приветствий и длинных ссылок (0 — сырой текст)
+    prompt_compact: bool = os.getenv("PROMPT_COMPACT", "1") not in ("0", "false", "no")
+    # from_id менеджеров через запятую — если клиента не удаётся определить по id/имени чата
+    manager_ids: list[str] = field(default_factory=lambda: _split_env("MANAGER_IDS"))
+
+    # Упаковка коротких чатов в один запрос (PACK_MAX_CHATS<=1 — выключить)
+    pack_max_chats: int = int(os.getenv("PACK_MAX_CHATS", 8))
+    pack_chat_chars: int = int(os.getenv("PACK_CHAT_CHARS", 1500))   # какой чат считается коротким
+    pack_linger: float = float(os.getenv("PACK_LINGER", 0.5))        # сколько ждать соседей по пачке, с
+
+    # Персистентная очередь задач (пусто — обрабатывать экспорт напрямую, без очереди)
+    job_queue: Optional[Path] = _optional_path(os.getenv("JOB_QUEUE", ""))
+    job_queue_enqueue: bool = os.getenv("JOB_QUEUE_ENQUEUE", "1") not in ("0", "false", "no")
+    job_lease_seconds: float = float(os.getenv("JOB_LEASE_SECONDS", 600))
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    job_backoff_seconds: float = float(os.getenv("JOB_BACKOFF_SECONDS", 30))
+
+    # Инкрементальный режим: повторно отправлять только сообщения после водяного знака
+    incremental: bool = os.getenv("INCREMENTAL", "1") not in ("0", "false", "no")
+
+    # Параметры генерации и structured output
+    llm_structured: bool = os.getenv("LLM_STRUCTURED", "1") not in ("0", "false", "no")
+    llm_temperature: float = float(os.getenv("LLM_TEMPERATURE", 0))
+    llm_num_predict: int = int(os.getenv("LLM_NUM_PREDICT", 1024))
+    llm_keep_alive: Optional[str] = os.getenv("LLM_KEEP_ALIVE", "30m") or None
+    # Печатать ли токены ответа по мере генерации
+    llm_verbose: bool = os.getenv("LLM_VERBOSE", "0") not in ("0", "false", "no")
+
+    # Кэш ответов LLM: on | refresh | off
+    llm_cache: str = os.getenv("LLM_CACHE", "on")
+    llm_cache_path: Path = Path(os.getenv("LLM_CACHE_PATH", "output/llm_cache.sqlite"))
+    llm_cache_max_entries: int = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 200_000))
+    llm_cache_max_age_days: float = float(os.getenv("LLM_CACHE_MAX_AGE_DAYS", 90))
+
+    # Замеры этапов: события в JSONL и Prometheus textfile (пустое значение — выключить)
+    metrics_jsonl: Optional[Path] = _optional_path(os.getenv("METRICS_JSONL", "output/metrics.jsonl"))
+    metrics_prom: Optional[Path] = _optional_path(os.getenv("METRICS_PROM", "output/metrics.prom"))
+
+    # Parquet-датасет результатов для отчётов (пустое значение — выключить)
+    results_dataset: Optional[Path] = _optional_path(os.getenv("RESULTS_DATASET", "output/dataset"))
+
+    # Индекс эмбеддингов для поиска похожих чатов (пустое значение — выключен)
+    embed_index: Optional[Path] = _optional_path(os.getenv("EMBED_INDEX", ""))
+    embed_model: str = os.getenv("EMBED_MODEL", "nomic-embed-text")
+
+    @property
+    def cascade(self) -> list[str]:
+        """Модели по порядку ступеней; без LLM_MODELS — одна LLM_MODEL."""
+        return self.llm_models or [self.llm_model]
+
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 🔌 SSH‑туннель
 # ────────────────────────────────────────────────────────────────────────────────
-class SshTunnel:
-    def __init__(self, cfg: EnvConfig):
-        self.cfg = cfg
-        self.proc: subprocess.Popen | None = None
-
-    def __enter__(self) -> str:  # noqa: D401
-        target = f"{self.cfg.ssh_user}@{self.cfg.ssh_host}"
-        cmd = [
-            "ssh",
-            "-o",
-            "StrictHostKeyChecking=no",
-            "-p",
-            str(self.cfg.ssh_port),
-            "-L",
-            f"{self.cfg.local_port}:localhost:{self.cfg.remote_port}",
-            target,
-            "-N",
-        ]
-        if self.cfg.ssh_pass:
-            cmd = ["sshpass", "-p", self.cfg.ssh_pass] + cmd
-        self.proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            preexec_fn=os.setsid if os.name != "nt" else None,
-            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0,
+class SshTunnel(transport.SshTunnel):
+    """Туннель с параметрами из EnvConfig; сам проброс — в transport.py."""
+
+    def __init__(
+        self,
+        cfg: EnvConfig,
+        host: Optional[str] = None,
+        user: Optional[str] = None,
+        ssh_port: Optional[int] = None,
+        local_port: Optional[int] = None,
+    ):
+        super().__init__(
+            host or cfg.ssh_host,
+            user or cfg.ssh_user,
+            ssh_port or cfg.ssh_port,
+            local_port or cfg.local_port,
+            cfg.remote_port,
+            cfg.ssh_pass,
         )
-        time.sleep(1)  # даём туннелю подняться
-        return f"http://localhost:{self.cfg.local_port}"
+        self.cfg = cfg
 
-    def __exit__(self, exc_type, exc, tb):  # noqa: D401
-        if self.proc and self.proc.poll() is None:
-            try:
-                if os.name == "nt":
-                    self.proc.send_signal(signal.CTRL_BREAK_EVENT)
-                else:
-                    os.killpg(self.proc.pid, signal.SIGTERM)
-            except Exception:  # pylint: disable=broad-except
-                pass
-            self.proc.wait(timeout=5)
+    @classmethod
+    def from_target(cls, cfg: EnvConfig, target: str, local_port: int) -> "SshTunnel":
+        """Туннель по строке `[user@]host[:port]` из SSH_HOSTS."""
+        user, _, host = target.rpartition("@")
+        host, _, port = host.partition(":")
+        return cls(cfg, host=host, user=user or None, ssh_port=int(port) if port else None, local_port=local_port)
 
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 🧩 Вызов LLM
 # ────────────────────────────────────────────────────────────────────────────────
 
-def call_llm(prompt: str, host: str, model: str, api_key: str | None = None) -> Dict[str, Any]:
-    url = f"{host.rstrip('/')}/api/generate"
+# JSON‑схема ответа для `format` Ollama (structured outputs)
+RESULT_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "has_order": {"type": "boolean"},
+        "parameters": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "item": {"type": "string"},
+                    "material": {"type": "string"},
+                    "color": {"type": "string"},
+                    "size": {"type": ["string", "object"]},
+                    "quantity": {"type": ["number", "null"]},
+                    "price": {"type": ["number", "null"]},
+                },
+            },
+        },
+        "complaint": {"type": ["boolean", "string"]},
+        "total_sum": {"type": ["number", "null"]},
+        "summary": {"type": "string"},
+    },
+    "required": ["has_order", "parameters", "complaint", "total_sum", "summary"],
+}
+
+# Ответ на пачку чатов: массив результатов с номером чата в `id`.
+# Массив обёрнут в объект, чтобы ранняя остановка ждала его целиком.
+PACK_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                **RESULT_SCHEMA,
+                "properties": {"id": {"type": "integer"}, **RESULT_SCHEMA["properties"]},
+                "required": ["id", *RESULT_SCHEMA["required"]],
+            },
+        },
+    },
+    "required": ["results"],
+}
+
+
+# Сколько кусков после закрытого JSON ждём финального `done`: успел — поток
+# дочитан и соединение вернулось в пул, нет — обрываем генерацию пояснений
+EARLY_STOP_GRACE_CHUNKS = 4
+
+# Поля финального куска Ollama, которые сохраняем как статистику генерации
+OLLAMA_STAT_KEYS = (
+    "total_duration",
+    "load_duration",
+    "prompt_eval_count",
+    "prompt_eval_duration",
+    "eval_count",
+    "eval_duration",
+)
+
+
+def build_payload(
+    model: str,
+    prompt: str,
+    *,
+    schema: Optional[Dict[str, Any]] = None,
+    options: Optional[Dict[str, Any]] = None,
+    keep_alive: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Тело запроса `/api/generate`; пустые параметры не отправляются."""
+    payload: Dict[str, Any] = {"model": model, "prompt": prompt}
+    if schema:
+        payload["format"] = schema
+    if options:
+        payload["options"] = options
+    if keep_alive:
+        payload["keep_alive"] = keep_alive
+    return payload
+
+
+def _headers(api_key: str | None) -> Dict[str, str]:
     headers: Dict[str, str] = {"Content-Type": "application/json"}
     if api_key:
-        headers["Authorization"] = f"Bearer {api_key}"    
-    payload = {"model": model, "prompt": prompt}
+        headers["Authorization"] = f"Bearer {api_key}"
+    return headers
+
+
+def call_llm(
+    prompt: str,
+    host: str,
+    model: str,
+    api_key: str | None = None,
+    *,
+    schema: Optional[Dict[str, Any]] = None,
+    options: Optional[Dict[str, Any]] = None,
+    keep_alive: Optional[str] = None,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> Dict[str, Any]:
+    """Потоковый запрос к Ollama.
+
+    Поток закрывается, как только в ответе завершён корректный JSON-объект
+    (или сервер прислал `done`). `on_token` получает каждый кусок ответа.
+    В `stats` — счётчики Ollama из финального куска (`eval_count`,
+    `eval_duration`, …); при раннем обрыве — собственная оценка.
+    """
+    url = f"{host.rstrip('/')}/api/generate"
+    payload = build_payload(model, prompt, schema=schema, options=options, keep_alive=keep_alive)
 
+    requested = time.monotonic()
     try:
-        resp = requests.post(url, json=payload, headers=headers, stream=True, timeout=180)
+        resp = transport.session().post(url, json=payload, headers=_headers(api_key), stream=True, timeout=180)
         resp.raise_for_status()
     except requests.RequestException as e:
-        raise RuntimeError(f"LLM request failed: {e}") from e
+        if transport.is_request_error(e):
+            # 400/404: неверная модель или тело запроса — на других бэкендах будет то же самое
+            e.response.close()
+            raise requests.HTTPError(f"LLM request rejected: {e}; {e.response.text[:500]}",
+                                     response=e.response) from e
+        raise BackendError(f"LLM request failed: {e}") from e
 
     chunks = []
-    print("📡 Поток данных от LLM:")
-    for line in resp.iter_lines(decode_unicode=True):
-        if not line.strip():
-            continue
-        try:
-            obj = json.loads(line)
+    scanner = JsonObjectScanner()
+    stats: Dict[str, Any] = {}
+    done_seen = early_stop = False
+    started = time.monotonic()
+    first_token: Optional[float] = None
+    closed_at: Optional[int] = None
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError:
+                print("❌ Ошибка парсинга NDJSON строки:", line)
+                raise
             chunk = obj.get("response", "")
             chunks.append(chunk)
-            print("🧩", repr(chunk))
-        except json.JSONDecodeError as e:
-            print("❌ Ошибка парсинга NDJSON строки:", line)
-            raise
-
-    result = "".join(chunks).strip()
-    # 🧠 Робастный парсинг
-    if isinstance(result, dict):
-        parsed = result
+            if first_token is None and chunk:
+                first_token = time.monotonic()
+                metrics.observe("llm_first_token", first_token - requested)
+            if on_token is not None:
+                on_token(chunk)
+            if obj.get("done"):
+                # счётчиков может не быть (старая Ollama, прокси) — ответ от этого не хуже
+                done_seen = True
+                stats = {k: obj[k] for k in OLLAMA_STAT_KEYS if k in obj}
+                # дочитываем поток до конца: только так соединение вернётся в пул
+                continue
+            if scanner.result is None:
+                scanner.feed(chunk)
+            elif len(chunks) - closed_at >= EARLY_STOP_GRACE_CHUNKS:
+                # объект закрыт, а модель продолжает пояснять — обрываем генерацию
+                stats = {
+                    "eval_count": len(chunks),
+                    "eval_duration": int((time.monotonic() - started) * 1e9),
+                    "early_stop": True,
+                }
+                early_stop = True
+                break
+            if scanner.result is not None and closed_at is None:
+                closed_at = len(chunks)
+    except requests.RequestException as e:
+        raise BackendError(f"LLM stream failed: {e}") from e
+    finally:
+        # при раннем обрыве соединение закрывается — так Ollama прекращает генерацию
+        resp.close()
+    if not done_seen and not early_stop:
+        # ни `done`, ни ранней остановки: поток оборвался (упал туннель или сервер)
+        raise BackendError("LLM stream ended before done")
+    if first_token is not None:
+        metrics.observe("llm_generation", time.monotonic() - first_token)
+
+    if scanner.result is not None:
+        # в ответе оставляем только сам объект, без хвоста пояснений
+        parsed = scanner.result
+        result = json.dumps(parsed, ensure_ascii=False)
     else:
-        # Попытка извлечь JSON-блок из строки
-        match = re.search(r"\{.*\}", result, re.DOTALL)
-        if not match:
-            raise ValueError("Не удалось найти JSON-объект в ответе LLM")
-        cleaned = match.group(0)
-        parsed = json.loads(cleaned)
+        result = "".join(chunks).strip()
+        parsed = parse_llm_json(result)
+    return {"response": result, "parsed": parsed, "stats": stats}
 
-    return {"response": result, "parsed": parsed}
 
+def print_token(chunk: str) -> None:
+    """Колбэк прогресса для `call_llm`: печатает токены как есть."""
+    print(chunk, end="", flush=True)
+
+
+def warm_up_model(host: str, model: str, keep_alive: Optional[str], api_key: str | None = None) -> None:
+    """Загружает модель в память заранее: пустой промпт без генерации."""
+    url = f"{host.rstrip('/')}/api/generate"
+    payload = build_payload(model, "", keep_alive=keep_alive)
+    payload["stream"] = False
+    try:
+        resp = transport.session().post(url, json=payload, headers=_headers(api_key), timeout=300)
+        resp.raise_for_status()
+        print(f"🔥 Модель {model} загружена (keep_alive={keep_alive or 'по умолчанию'})")
+    except requests.RequestException as e:
+        print(f"⚠️ Не удалось прогреть модель {model}: {e}")
 
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 📝 Prompt
 # ────────────────────────────────────────────────────────────────────────────────
 
-def prepare_prompt(chat_text: str, max_chars: int = 15_000) -> str:
+# Меняется при любой правке инструкции: результаты старой версии не считаются готовыми
+PROMPT_VERSION = "2"
+# Версия промпта, которым получены записи старого history.jsonl (до сжатия чатов)
+LEGACY_PROMPT_VERSION = "1"
+
+
+SYSTEM_PROMPT = (
+    "Ты — аналитик клиентской переписки.\n"
+    "На входе тебе даётся диалог (формат Telegram).\n"
+    "Твоя задача — извлечь из него структурированную информацию:\n\n"
+    "- был ли заказ (`has_order`)\n"
+    "- параметры изделий (материал, цвет, размер, стоимость, количество)\n"
+    "- наличие жалоб или рекламаций (`complaint`)\n"
+    "- итоговая сумма заказа (`total_sum`)\n"
+    "- краткое резюме чата (`summary`)\n\n"
+    "Если информация отсутствует, явно укажи это (например, `has_order: false`).\n"
+    "Ответ верни строго в формате JSON.\n\n"
+    "Реплики помечены «К:» (клиент) и «М:» (менеджер); ссылки сокращены до домена.\n"
+    "Вводной диалог находится между тегами <chat> ... </chat>"
+)
+
+
+def prepare_prompt(chat_text: str, max_chars: int = 15_000, part: tuple[int, int] | None = None) -> str:
+    """Промпт для одного чата. Обрезается текст диалога, а не закрывающий тег.
+
+    `part=(i, n)` помечает, что это i‑й фрагмент из n длинного диалога.
+    """
+    sys_msg = SYSTEM_PROMPT
+    if part is not None:
+        sys_msg += (
+            f"\n\nЭто фрагмент {part[0]} из {part[1]} длинного диалога. "
+            "Анализируй только то, что есть в этом фрагменте."
+        )
+    head = f"<system>\n{sys_msg}\n</system>\n<chat>\n"
+    tail = "\n</chat>"
+    budget = max(0, max_chars - len(head) - len(tail))
+    return head + chat_text[:budget] + tail
+
+
+def prepare_update_prompt(previous: dict, new_text: str, max_chars: int = 15_000) -> str:
+    """Промпт для дообработки чата: прошлый результат + только новые сообщения."""
     sys_msg = (
-        "Ты — аналитик клиентской переписки.\n"
-        "На входе тебе даётся диалог (формат Telegram).\n"
-        "Твоя задача — извлечь из него структурированную информацию:\n\n"
-        "- был ли заказ (`has_order`)\n"
-        "- параметры изделий (материал, цвет, размер, стоимость, количество)\n"
-        "- наличие жалоб или рекламаций (`complaint`)\n"
-        "- итоговая сумма заказа (`total_sum`)\n"
-        "- краткое резюме чата (`summary`)\n\n"
-        "Если информация отсутствует, явно укажи это (например, `has_order: false`).\n"
-        "Ответ верни строго в формате JSON.\n\n"
-        "Вводной диалог находится между тегами <chat> ... </chat>"
+        SYSTEM_PROMPT
+        + "\n\nДиалог уже анализировался: прежний результат дан между тегами "
+        "<previous> ... </previous>. В <chat> — только сообщения, пришедшие после него. "
+        "Верни обновлённый результат целиком (все поля), учитывая и прежний результат, и новые сообщения."
     )
-    return (f"<system>\n{sys_msg}\n</system>\n<chat>\n{chat_text}\n</chat>")[:max_chars]
+    head = (
+        f"<system>\n{sys_msg}\n</system>\n"
+        f"<previous>\n{json.dumps(previous, ensure_ascii=False)}\n</previous>\n<chat>\n"
+    )
+    tail = "\n</chat>"
+    budget = max(0, max_chars - len(head) - len(tail))
+    return head + new_text[:budget] + tail
+
+
+def prepare_pack_prompt(chat_texts: list[str]) -> str:
+    """Промпт для пачки коротких чатов; чаты нумеруются с 1 в `<chat id="N">`."""
     sys_msg = (
-        "Ты — аналитический ассистент. Из переписки клиента определи:"\
-        "\n1. Есть ли заказ и его параметры (материал, размеры, цвет)."\
-        "\n2. Цену, если она фигурирует."\
-        "\n3. Жалобы/рекламации."\
-        "\n\nВерни результат в JSON со схемой: "\
-        "{'has_order': bool, 'order': {...}|null, 'complaint': str|null, 'summary': str}.\n"
+        SYSTEM_PROMPT
+        + f"\n\nВ этом запросе {len(chat_texts)} независимых диалогов, каждый между тегами "
+        '<chat id="N"> ... </chat>. Анализируй каждый отдельно и верни JSON-объект '
+        '{"results": [...]} — по одному результату на каждый диалог, с номером диалога в поле `id`.'
     )
-    return (f"<system>\n{sys_msg}\n</system>\n<chat>\n{chat_text}\n</chat>")[:max_chars]
+    chats = "\n".join(f'<chat id="{n}">\n{text}\n</chat>' for n, text in enumerate(chat_texts, 1))
+    return f"<system>\n{sys_msg}\n</system>\n{chats}"
+
+
+def parse_pack_response(response: str, count: int) -> Dict[int, dict]:
+    """Результаты пачки по номеру чата. Пропущенные и битые элементы не попадают в словарь."""
+    data = parse_llm_json(response)
+    results: Dict[int, dict] = {}
+    for item in data.get("results") or []:
+        if not isinstance(item, dict):
+            continue
+        try:
+            n = int(item.pop("id"))
+        except (KeyError, TypeError, ValueError):
+            continue
+        item = fix_keys(item)
+        if 1 <= n <= count and n not in results and all(k in item for k in RESULT_SCHEMA["required"]):
+            results[n] = item
+    return results
 
 
 # ────────────────────────────────────────────────────────────────────────────────
@@ -227,8 +528,7 @@ def load_chat(path: Path) -> str:
 
 
 def save_result(output_dir: Path, name: str, response: str, host: str, model: str):
-    json_part = extract_json_from_response(response)
-    parsed = fix_keys(json.loads(json_part))
+    parsed = fix_keys(parse_llm_json(response))
 
     out_path = output_dir / f"{name}_analysis.json"
     out_path.write_text(json.dumps(parsed, ensure_ascii=False, indent=2), encoding="utf-8")
@@ -241,6 +541,29 @@ def extract_json_from_response(text: str) -> str:
         text = text.split("```", 1)[0]
     return text.strip()
 
+
+def parse_llm_json(text: str) -> dict:
+    """Разбор ответа модели.
+
+    При structured output ответ — чистый JSON и разбирается сразу; иначе
+    снимаем ```json‑обёртку и в крайнем случае ищем первый `{` … последний `}`.
+    """
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        parsed = None
+    if parsed is None:
+        try:
+            parsed = json.loads(extract_json_from_response(text))
+        except json.JSONDecodeError:
+            start, end = text.find("{"), text.rfind("}")
+            if start == -1 or end <= start:
+                raise ValueError("Не удалось найти JSON-объект в ответе LLM")
+            parsed = json.loads(text[start:end + 1])
+    if not isinstance(parsed, dict):
+        raise ValueError("Ответ LLM — не JSON-объект")
+    return parsed
+
 def fix_keys(d: dict) -> dict:
     """Исправляет опечатки в ключах LLM-ответа."""
     replacements = {
@@ -260,146 +583,837 @@ def slugify(value) -> str:
 
 
 
-def load_all_chats(path: Path) -> list[tuple[str, list[str]]]:
-    raw = json.loads(path.read_text(encoding="utf-8"))
+@dataclass
+class ChatRecord:
+    """Один чат экспорта: тексты сообщений и их id/даты (для водяных знаков)."""
+
+    name: str
+    messages: list[str]
+    chat_id: Optional[str] = None
+    message_ids: list[Optional[int]] = field(default_factory=list)
+    message_dates: list[Optional[str]] = field(default_factory=list)
+    message_senders: list[Optional[str]] = field(default_factory=list)
+    # все файлы экспорта, где встретился этот чат (после дедупликации их может быть несколько)
+    source_files: list[str] = field(default_factory=list)
+    # владелец экспорта (`user:<personal_information.user_id>`); id чата уникален только в его пределах
+    owner: Optional[str] = None
+
+    @property
+    def source_file(self) -> Optional[str]:
+        return "; ".join(self.source_files) or None
+
+    @property
+    def key(self) -> str:
+        """Стабильный ключ чата между выгрузками: владелец экспорта и id Telegram (иначе имя).
+
+        Один и тот же id встречается в экспортах разных аккаунтов, поэтому
+        ключ включает владельца. У списка чатов без `personal_information`
+        владельца нет — ключ только id: путь к файлу в ключ не входит, чтобы
+        переименование или перенос экспорта не терял водяные знаки. Цена —
+        списки чатов из разных аккаунтов с одинаковым id делят один водяной
+        знак и задачу очереди; для нескольких аккаунтов нужен полный архив.
+        """
+        local = f"id:{self.chat_id}" if self.chat_id is not None else f"name:{self.name}"
+        return f"{self.owner}#{local}" if self.owner else local
+
+    @property
+    def last_date(self) -> Optional[str]:
+        """Дата последнего сообщения с датой (ISO из экспорта); по ней месяц в датасете."""
+        return next((d for d in reversed(self.message_dates) if d), None)
+
+    def new_indices(self, last_id: Optional[int], last_date: Optional[str]) -> Optional[list[int]]:
+        """Номера сообщений после водяного знака; None — если сравнить не по чему."""
+        if last_id is not None and self.message_ids and all(i is not None for i in self.message_ids):
+            return [n for n, i in enumerate(self.message_ids) if i > last_id]
+        if last_date and self.message_dates and all(self.message_dates):
+            return [n for n, d in enumerate(self.message_dates) if d > last_date]
+        return None
+
+    def messages_after(self, last_id: Optional[int], last_date: Optional[str]) -> Optional[list[str]]:
+        """Сообщения после водяного знака; None — если сравнить не по чему."""
+        indices = self.new_indices(last_id, last_date)
+        return None if indices is None else [self.messages[n] for n in indices]
+
+
+def _message_text(msg: dict) -> Optional[str]:
+    txt = msg.get("text")
+    if isinstance(txt, str):
+        return txt
+    if isinstance(txt, list):
+        return "".join(part if isinstance(part, str) else part.get("text", "") for part in txt)
+    return None
+
+
+def extract_messages(entry: dict) -> list[str]:
+    """Тексты сообщений одного чата Telegram-экспорта (без служебных)."""
+    return to_chat_record(entry, "").messages
+
+
+def to_chat_record(entry: dict, default_name: str) -> ChatRecord:
+    chat_id = entry.get("id")
+    record = ChatRecord(
+        name=entry.get("name") or default_name,
+        messages=[],
+        chat_id=str(chat_id) if chat_id is not None else None,
+    )
+    for msg in entry["messages"]:
+        if msg.get("type") != "message":
+            continue
+        text = _message_text(msg)
+        if text is None:
+            continue
+        record.messages.append(text)
+        msg_id = msg.get("id")
+        record.message_ids.append(msg_id if isinstance(msg_id, int) else None)
+        record.message_dates.append(msg.get("date"))
+        record.message_senders.append(msg.get("from_id") or msg.get("from"))
+    return record
+
+
+def _owner_key(path: Path) -> Optional[str]:
+    user_id = export_owner(path)
+    return f"user:{user_id}" if user_id is not None else None
+
+
+def iter_chat_records(path: Path) -> Iterator[ChatRecord]:
+    """Потоково отдаёт чаты по одному — файл целиком не читается."""
+    owner = _owner_key(path)
+    entries = iter_chat_entries(path)
+    for i in itertools.count():
+        with metrics.span("load_chat"):
+            entry = next(entries, None)
+            chat = None if entry is None else to_chat_record(entry, f"chat_{i+1}")
+        if chat is None:
+            return
+        chat.source_files.append(str(path))
+        chat.owner = owner
+        yield chat
+
+
+def chat_files(spec: Path) -> list[Path]:
+    """CHAT_FILE → файлы экспорта: сам файл, *.json в каталоге (рекурсивно) или файлы по glob-маске."""
+    if spec.is_dir():
+        return sorted(p for p in spec.rglob("*.json") if p.is_file())
+    if any(c in str(spec) for c in "*?["):
+        return sorted(Path(p) for p in glob.glob(str(spec), recursive=True) if Path(p).is_file())
+    return [spec] if spec.is_file() else []
+
+
+def _hash_export(path: str) -> tuple[list[str], Optional[str]]:
+    """Первый проход в процессе-обработчике: `(хэши чатов файла по порядку, ошибка)`.
+
+    В родителя уходят только хэши, а не чаты — память не растёт с размером
+    экспортов. Файл, который не разбирается как экспорт, возвращает ошибку,
+    а не роняет весь пул. Без `metrics` и `print` — в дочернем процессе они не нужны.
+    """
+    try:
+        return [compute_text_hash("\n".join(to_chat_record(entry, "").messages))
+                for entry in iter_chat_entries(Path(path))], None
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return [], str(e)
+
+
+def iter_unique_chats(files: list[Path], workers: int = 1) -> Iterator[ChatRecord]:
+    """Чаты из всех файлов экспорта, каждый уникальный (по хэшу текста) — один раз.
+
+    Один файл читается потоково, как раньше. Несколько — в два прохода:
+    пул процессов считает хэши чатов каждого файла, по ним выбирается первое
+    вхождение каждого чата и все его источники; затем файлы читаются потоково
+    ещё раз и отдаются только первые вхождения. В памяти — хэши и номера
+    чатов, а не сами чаты; у чата из нескольких экспортов в `source_files`
+    сразу все источники.
+    """
+    if len(files) == 1:
+        yield from iter_chat_records(files[0])
+        return
+
+    paths = [str(p) for p in files]
+    first: dict[str, tuple[int, int]] = {}
+    # доп. источники только у дубликатов: (файл, номер чата) первого вхождения → файлы
+    sources: dict[tuple[int, int], list[str]] = {}
+    total = 0
+    with metrics.span("load_files", files=len(files)):
+        # spawn, а не fork: у процесса уже есть фоновые потоки (запись в БД, health-check)
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(files))), mp_context=ctx) as pool:
+            for file_no, (hashes, error) in enumerate(pool.map(_hash_export, paths)):
+                if error is not None:
+                    print(f"⚠️ {paths[file_no]} пропущен — не похож на экспорт Telegram: {error}")
+                    metrics.count("skipped_files")
+                    continue
+                total += len(hashes)
+                for pos, chat_hash in enumerate(hashes):
+                    origin = first.setdefault(chat_hash, (file_no, pos))
+                    if origin != (file_no, pos):
+                        extra = sources.setdefault(origin, [])
+                        if paths[file_no] != paths[origin[0]] and paths[file_no] not in extra:
+                            extra.append(paths[file_no])
+    keep: dict[int, set[int]] = {}
+    for file_no, pos in first.values():
+        keep.setdefault(file_no, set()).add(pos)
+    unique = len(first)
+    del first
+    duplicates = total - unique
+    metrics.count("duplicate_chats", duplicates)
+    print(f"📚 Файлов экспорта: {len(files)}, чатов: {total}, уникальных: {unique} (дубликатов {duplicates})")
+
+    for file_no, path in enumerate(files):
+        wanted = keep.get(file_no)
+        if not wanted:
+            continue
+        for pos, chat in enumerate(iter_chat_records(path)):
+            if pos in wanted:
+                chat.source_files.extend(sources.get((file_no, pos), ()))
+                yield chat
+
+
+def chat_job(idx: int, chat: ChatRecord) -> tuple[str, int, str, dict]:
+    """Задача для очереди: `(ключ чата, номер, хэш, чат целиком)`."""
+    return chat.key, idx, compute_text_hash("\n".join(chat.messages)), asdict(chat)
 
-    # 💡 поддержа Telegram-архива
-    if isinstance(raw, dict) and "chats" in raw and "list" in raw["chats"]:
-        raw = raw["chats"]["list"]
 
-    if not (isinstance(raw, list) and all("messages" in d for d in raw)):
-        raise ValueError("Файл не содержит список чатов с ключом 'messages'")
+def iter_queue(queue: JobQueue, owner: str, poll_seconds: float = 1.0) -> Iterator[tuple[int, ChatRecord]]:
+    """Забирает задачи из очереди, пока в ней есть что делать (включая отложенные повторы)."""
+    while True:
+        job = queue.claim(owner)
+        if job is not None:
+            _, idx, payload = job
+            yield idx, ChatRecord(**payload)
+            continue
+        wait = queue.next_wakeup()
+        if wait is None:
+            return
+        time.sleep(min(max(wait, 0.2), poll_seconds))
+
 
-    chats = []
-    for i, entry in enumerate(raw):
-        name = entry.get("name") or f"chat_{i+1}"
-        msgs = []
-        for msg in entry["messages"]:
-            if msg.get("type") == "message":
-                txt = msg.get("text")
-                if isinstance(txt, str):
-                    msgs.append(txt)
-                elif isinstance(txt, list):
-                    flat = "".join(part if isinstance(part, str) else part.get("text", "") for part in txt)
-                    msgs.append(flat)
-        chats.append((name, msgs))
-    return chats
+def load_all_chats(path: Path) -> Iterator[tuple[str, list[str]]]:
+    """Потоково отдаёт `(name, messages)` по одному чату — файл целиком не читается."""
+    for chat in iter_chat_records(path):
+        yield chat.name, chat.messages
 
 def robust_json_parse(value):
     if isinstance(value, dict):
         return value
     if not isinstance(value, str):
         raise TypeError("Ожидалась строка или словарь")
+    return parse_llm_json(value)
 
-    match = re.search(r"{.*}", value, re.DOTALL)
-    if not match:
-        raise ValueError("Не удалось найти JSON-объект в строке")
+# ────────────────────────────────────────────────────────────────────────────────
+# 🧵 Обработка чатов
+# ────────────────────────────────────────────────────────────────────────────────
 
-    return json.loads(match.group(0))
+# save_result / insert_json_result / history.append вызываются из нескольких
+# потоков: запись результата, строки в БД и истории должна идти вместе.
+_write_lock = threading.Lock()
 
-def append_history(entry: dict, path: Path = Path("output/history.jsonl")) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with path.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+# Общий лимит одновременных запросов к LLM (чаты + окна длинных чатов)
+_llm_slots = threading.BoundedSemaphore(1)
 
+# Parquet-датасет результатов (None — выключен или нет pyarrow)
+_dataset: Optional[ResultDataset] = None
 
-def load_history_hashes(path: Path = Path("output/history.jsonl")) -> set[str]:
-    if not path.exists():
-        return set()
-    hashes = set()
-    for line in path.read_text(encoding="utf-8").splitlines():
+# Упаковка коротких чатов в общий запрос (None — выключена)
+_packer: Optional[ChatPacker] = None
+
+# Индекс эмбеддингов проанализированных чатов (None — выключен или нет numpy)
+_embeddings: Optional[IndexBuffer] = None
+# Оценка длины ответа на один чат в пачке — под неё оставляется место в контексте
+PACK_RESULT_TOKENS = 200
+# потолок потоков при упаковке: каждый ждущий чат держит поток и его текст в памяти
+PACK_MAX_WORKERS = 64
+
+
+def llm_options(cfg: EnvConfig) -> Dict[str, Any]:
+    return {
+        "num_ctx": cfg.llm_num_ctx,
+        "temperature": cfg.llm_temperature,
+        "num_predict": cfg.llm_num_predict,
+    }
+
+
+# Значение поля `host` для ответов, взятых из кэша
+CACHE_HOST = "cache"
+
+
+def cached_call_llm(cache: LLMCache, prompt: str, backends: BackendPool, cfg: EnvConfig,
+                    schema: Dict[str, Any] = RESULT_SCHEMA, num_predict: Optional[int] = None,
+                    model: Optional[str] = None) -> Dict[str, Any]:
+    """`call_llm` за кэшем: одинаковый (модель, промпт, параметры) не уходит в LLM повторно.
+
+    Запрос уходит на наименее загруженный бэкенд пула; в `host` ответа —
+    URL бэкенда, который его обслужил. Модель по умолчанию — первая ступень каскада.
+    """
+    model = model or cfg.cascade[0]
+    schema = schema if cfg.llm_structured else None
+    options = llm_options(cfg)
+    if num_predict is not None:
+        options["num_predict"] = num_predict
+    key = cache_key(model, prompt, {"options": options, "format": schema})
+    hit = cache.get(key)
+    if hit is not None:
+        metrics.count("llm_cache_hits")
+        return {**hit, "host": CACHE_HOST}
+    with metrics.span("call_llm"):
+        llm_data, host = backends.call(lambda url: call_llm(
+            prompt, url, model, cfg.api_key,
+            schema=schema, options=options, keep_alive=cfg.llm_keep_alive,
+            on_token=print_token if cfg.llm_verbose else None,
+        ))
+    llm_data["host"] = host
+    if cfg.llm_verbose:
+        print()
+    _report_stats(llm_data.get("stats") or {})
+    metrics.observe_llm(llm_data.get("stats") or {}, len(prompt))
+    cache.put(key, model, llm_data["response"], llm_data["parsed"])
+    return llm_data
+
+
+def embed_texts(texts: list[str], cfg: EnvConfig, backends: BackendPool) -> list[list[float]]:
+    # эмбеддинги идут на те же GPU, что и анализ, — в общем лимите LLM_CONCURRENCY
+    with _llm_slots:
+        with metrics.span("embed", texts=len(texts)):
+            vectors, _ = backends.call(lambda url: ollama_embed(url, cfg.embed_model, texts, cfg.api_key))
+    return vectors
+
+
+def _report_stats(stats: Dict[str, Any]) -> None:
+    count, duration = stats.get("eval_count"), stats.get("eval_duration")
+    if not count or not duration:
+        return
+    seconds = duration / 1e9
+    note = " (ранняя остановка)" if stats.get("early_stop") else ""
+    print(f"⏱️  {count} токенов за {seconds:.1f} с — {count / seconds:.1f} ток/с{note}")
+
+
+def prompt_lines(chat: ChatRecord, cfg: EnvConfig, indices: Optional[list[int]] = None) -> list[str]:
+    """Строки чата для промпта: все или только `indices`, сжатые при PROMPT_COMPACT."""
+    messages = chat.messages if indices is None else [chat.messages[n] for n in indices]
+    if not cfg.prompt_compact:
+        return messages
+    senders = chat.message_senders if indices is None else [chat.message_senders[n] for n in indices]
+    started = time.perf_counter()
+    clients = client_senders(chat.message_senders, chat.chat_id, chat.name, cfg.manager_ids)
+    lines, stats = compact_messages(messages, senders, clients)
+    metrics.observe("compact", time.perf_counter() - started,
+                    chars_before=stats.chars_before, chars_after=stats.chars_after)
+    metrics.count("compact_chars_before", stats.chars_before)
+    metrics.count("compact_chars_after", stats.chars_after)
+    return lines
+
+
+def pack_cache_key(text: str, cfg: EnvConfig) -> str:
+    """Ключ кэша для результата одного чата из пачки — не зависит от соседей по ней."""
+    schema = PACK_SCHEMA if cfg.llm_structured else None
+    return cache_key(cfg.cascade[0], prepare_pack_prompt([text]),
+                     {"options": llm_options(cfg), "format": schema, "pack_member": True})
+
+
+def analyze_pack(chat_texts: list[str], cfg: EnvConfig, backends: BackendPool,
+                 cache: LLMCache) -> tuple[Dict[int, dict], str]:
+    """Один запрос на пачку коротких чатов (см. packing.py)."""
+    prompt = prepare_pack_prompt(chat_texts)
+    with _llm_slots:
+        llm_data = cached_call_llm(cache, prompt, backends, cfg, schema=PACK_SCHEMA,
+                                   num_predict=cfg.llm_num_predict * len(chat_texts))
+    with metrics.span("json_parse"):
+        results = parse_pack_response(llm_data["response"], len(chat_texts))
+    # состав пачки от прогона к прогону разный — кэшируем и каждый чат отдельно
+    for n, result in results.items():
+        cache.put(pack_cache_key(chat_texts[n - 1], cfg), cfg.cascade[0],
+                  json.dumps(result, ensure_ascii=False), result)
+    metrics.count("pack_requests")
+    metrics.count("packed_chats", len(chat_texts))
+    return results, llm_data["host"]
+
+
+def analyze_text(
+    messages: list[str], cfg: EnvConfig, backends: BackendPool, cache: LLMCache, model: Optional[str] = None
+) -> tuple[str, dict, str]:
+    """Отправляет чат в LLM. Возвращает (сырой ответ, разобранный JSON, бэкенд).
+
+    Чат длиннее контекста модели делится на перекрывающиеся окна, окна
+    анализируются параллельно, частичные результаты сливаются `merge_partials`.
+    """
+    chat_text = "\n".join(messages)
+    window_chars = window_chars_for_ctx(cfg.llm_num_ctx)
+    prompt_chars = cfg.llm_num_ctx * CHARS_PER_TOKEN
+
+    chat_key = metrics.current_chat
+
+    def run(prompt: str) -> tuple[str, dict, str]:
+        with metrics.bind(chat_key):
+            with _llm_slots:
+                llm_data = cached_call_llm(cache, prompt, backends, cfg, model=model)
+            with metrics.span("json_parse"):
+                parsed = robust_json_parse(llm_data["response"])
+        return llm_data["response"], parsed, llm_data["host"]
+
+    if len(chat_text) <= window_chars:
+        with metrics.span("prepare_prompt"):
+            prompt = prepare_prompt(chat_text, max_chars=prompt_chars)
+        return run(prompt)
+
+    windows = split_windows(messages, window_chars, cfg.chunk_overlap)
+    total = len(windows)
+    print(f"✂️  Длинный чат ({len(chat_text)} символов) разбит на {total} окон")
+    with metrics.span("prepare_prompt", windows=total):
+        prompts = [
+            prepare_prompt("\n".join(w), max_chars=prompt_chars, part=(i, total))
+            for i, w in enumerate(windows, 1)
+        ]
+    with ThreadPoolExecutor(max_workers=min(total, cfg.llm_concurrency), thread_name_prefix="window") as pool:
+        results = list(pool.map(run, prompts))
+    merged = merge_partials([fix_keys(parsed) for _, parsed, _ in results])
+    hosts = ",".join(sorted({host for _, _, host in results}))
+    return json.dumps(merged, ensure_ascii=False), merged, hosts
+
+
+def run_cascade(
+    chat_name: str,
+    cfg: EnvConfig,
+    attempt: Callable[[str], tuple[str, dict, str]],
+    first: Optional[tuple[str, dict, str]] = None,
+) -> tuple[str, dict, str, str]:
+    """Прогоняет чат по ступеням каскада, пока ответ не пройдёт `validate_result`.
+
+    `attempt(model)` возвращает (сырой ответ, разобранный JSON, бэкенд);
+    `first` — уже полученный ответ первой ступени (из пачки). Ответ последней
+    ступени принимается в любом случае. Возвращает (ответ, JSON, бэкенд, модель).
+    """
+    models = cfg.cascade
+    if len(models) == 1:
+        return (*(first or attempt(models[0])), models[0])
+    for tier, model in enumerate(models, 1):
+        metrics.count(f"cascade_tier{tier}_attempts")
         try:
-            entry = json.loads(line)
-            if "chat_hash" in entry:
-                hashes.add(entry["chat_hash"])
-        except Exception:
-            continue
-    return hashes
+            response, parsed, host = first if tier == 1 and first is not None else attempt(model)
+            problems = validate_result(parsed)
+        except ValueError as e:
+            # неразобранный JSON — тоже повод отдать чат модели покрупнее
+            if tier == len(models):
+                raise
+            response = parsed = host = None
+            problems = [str(e)]
+        if not problems:
+            metrics.count(f"cascade_tier{tier}_accepted")
+            return response, parsed, host, model
+        if tier == len(models):
+            metrics.count("cascade_unresolved")
+            print(f"⚠️ {chat_name}: ответ {model} не прошёл проверки ({'; '.join(problems)}), сохраняем как есть")
+            return response, parsed, host, model
+        print(f"🪜 {chat_name}: {model} → {models[tier]}: {'; '.join(problems)}")
+    raise AssertionError("недостижимо")
+
+
+def process_chat(
+    idx: int,
+    chat: ChatRecord,
+    cfg: EnvConfig,
+    backends: BackendPool,
+    history: HistoryStore,
+    cache: LLMCache,
+) -> Optional[Path]:
+    """`_process_chat` под замером: все этапы чата пишутся с его ключом."""
+    with metrics.bind(chat.key):
+        with metrics.span("chat_total"):
+            out = _process_chat(idx, chat, cfg, backends, history, cache)
+    metrics.write_prometheus(force=False)
+    return out
+
+
+def _process_chat(
+    idx: int,
+    chat: ChatRecord,
+    cfg: EnvConfig,
+    backends: BackendPool,
+    history: HistoryStore,
+    cache: LLMCache,
+) -> Optional[Path]:
+    """Анализирует один чат и сохраняет результат. Возвращает путь к JSON или None при пропуске.
+
+    Если для чата есть водяной знак той же модели и версии промпта, в LLM
+    уходят только новые сообщения вместе с прежним результатом; обновлённый
+    результат перезаписывает прежний JSON и строку в БД.
+    """
+    chat_name = chat.name
+    messages = chat.messages
+    chat_text = "\n".join(messages)
+    chat_hash = compute_text_hash(chat_text)
+
+    if any(history.contains(chat_hash, m, PROMPT_VERSION) for m in cfg.cascade) or (
+        cfg.prefilter and history.contains(chat_hash, PREFILTER_MODEL, PREFILTER_VERSION)
+    ):
+        print(f"⏭️  Пропускаем (не изменился): {chat_name}")
+        return None
+
+    watermark = history.get_watermark(chat.key) if cfg.incremental else None
+    # чат, отсеянный предфильтром, при повторной оценке сохраняет свой id и файл
+    earlier = watermark if watermark and watermark["model"] == PREFILTER_MODEL else None
+    if watermark and (watermark["model"] not in cfg.cascade or watermark["prompt_version"] != PROMPT_VERSION):
+        watermark = None
+    new_indices = None
+    if watermark:
+        new_indices = chat.new_indices(watermark["last_message_id"], watermark["last_date"])
+        if new_indices == []:
+            print(f"⏭️  Пропускаем (нет новых сообщений): {chat_name}")
+            return None
+    new_lines = prompt_lines(chat, cfg, new_indices) if new_indices else None
+    if new_lines == []:
+        # пришли только приветствия/эмодзи — результат прежний, сдвигаем водяной знак
+        with _write_lock:
+            history.set_watermark(
+                chat.key,
+                last_message_id=chat.message_ids[-1] if chat.message_ids else None,
+                last_date=chat.message_dates[-1] if chat.message_dates else None,
+                record_id=watermark["record_id"],
+                output=watermark["output"],
+                result=watermark["result"],
+                model=watermark["model"],
+                prompt_version=PROMPT_VERSION,
+                updated_at=datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            )
+        print(f"⏭️  Пропускаем (в новых сообщениях нет содержания): {chat_name}")
+        return None
+
+    # уже проанализированный моделью чат предфильтром не отсекаем
+    verdict = None
+    if cfg.prefilter and not watermark:
+        with metrics.span("prefilter"):
+            verdict = score_chat(messages, chat.message_senders,
+                                 cfg.prefilter_min_score, cfg.prefilter_min_messages)
+        metrics.count("prefilter_passed" if verdict.passed else "prefilter_skipped")
+
+    known = watermark or earlier
+    record_id = known["record_id"] if known else str(uuid.uuid4())
+    default_stub = Path(known["output"]).name.removesuffix("_analysis.json") if known else f"{idx}_{slugify(chat_name)}"
+    prompt_version = PROMPT_VERSION
+    try:
+        window_chars = window_chars_for_ctx(cfg.llm_num_ctx)
+        if verdict is not None and not verdict.passed:
+            print(f"🧹 Предфильтр: {chat_name} — {verdict.reason}")
+            parsed = skipped_result(verdict)
+            response = json.dumps(parsed, ensure_ascii=False)
+            host_url = model = PREFILTER_MODEL
+            prompt_version = PREFILTER_VERSION
+            filename_stub = default_stub
+        elif new_lines and len("\n".join(new_lines)) <= window_chars:
+            print(f"🔁 Дообработка {chat_name}: новых сообщений {len(new_indices)}")
+            with metrics.span("prepare_prompt"):
+                prompt = prepare_update_prompt(
+                    watermark["result"], "\n".join(new_lines), max_chars=cfg.llm_num_ctx * CHARS_PER_TOKEN
+                )
+
+            def update(model: str) -> tuple[str, dict, str]:
+                with _llm_slots:
+                    llm_data = cached_call_llm(cache, prompt, backends, cfg, model=model)
+                with metrics.span("json_parse"):
+                    return llm_data["response"], robust_json_parse(llm_data["response"]), llm_data["host"]
+
+            response, parsed, host_url, model = run_cascade(chat_name, cfg, update)
+            filename_stub = default_stub
+        else:
+            # если после сжатия ничего не осталось — пусть модель увидит исходный текст
+            lines = prompt_lines(chat, cfg) or messages
+            packed = None
+            text = "\n".join(lines)
+            if _packer is not None and len(text) <= cfg.pack_chat_chars and _packer.fits(text):
+                hit = cache.get(pack_cache_key(text, cfg))
+                if hit is not None:
+                    metrics.count("llm_cache_hits")
+                    packed = hit["parsed"], CACHE_HOST
+                else:
+                    packed = _packer.analyze(text)
+                if packed is None:
+                    metrics.count("pack_fallbacks")
+                    print(f"↩️  {chat_name}: нет результата в пачке, отдельный запрос")
+            first = None
+            if packed is not None:
+                parsed, host_url = packed
+                first = json.dumps(parsed, ensure_ascii=False), parsed, host_url
+            response, parsed, host_url, model = run_cascade(
+                chat_name, cfg, lambda m: analyze_text(lines, cfg, backends, cache, model=m), first
+            )
+            filename_stub = default_stub
+
+        created_at = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        result_data = {
+            "id": record_id,
+            "source_file": chat.source_file or str(cfg.chat_file),
+            "created_at": created_at,
+            "last_message_at": chat.last_date,
+            "host": host_url,
+            "model": model,
+            "result": parsed,
+            "success": True,
+            "error": None,
+            "chat_hash": chat_hash,
+        }
+        with _write_lock:
+            with metrics.span("save_result"):
+                out, saved = save_result(cfg.output_dir, filename_stub, response, host_url, model)
+            with metrics.span("insert_json_result"):
+                insert_json_result(result_data)
+            if _dataset is not None:
+                with metrics.span("dataset_append"):
+                    _dataset.append(result_data)
+            with metrics.span("append_history"):
+                history.append({
+                    "timestamp": created_at,
+                    "chat_file": chat.source_file or str(cfg.chat_file),
+                    "output": str(out),
+                    "model": model,
+                    "host": host_url,
+                    "success": True,
+                    "chat_hash": chat_hash,
+                }, prompt_version)
+                history.set_watermark(
+                    chat.key,
+                    last_message_id=chat.message_ids[-1] if chat.message_ids else None,
+                    last_date=chat.message_dates[-1] if chat.message_dates else None,
+                    record_id=record_id,
+                    output=str(out),
+                    result=saved,
+                    model=model,
+                    prompt_version=prompt_version,
+                    updated_at=created_at,
+                )
+        print(f"✅ Сохранено: {out.name}")
+        if _embeddings is not None and model != PREFILTER_MODEL and isinstance(parsed, dict):
+            _embeddings.add(chat_hash, record_id, chat_name, str(parsed.get("summary") or ""), chat_text)
+        return out
+    except Exception as e:
+        print(f"❌ Ошибка чата {chat_name}: {e}")
+        error_data = {
+            "id": str(uuid.uuid4()),
+            "source_file": chat.source_file or str(cfg.chat_file),
+            "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            "host": ",".join(b.url for b in backends.backends),
+            "model": ",".join(cfg.cascade),
+            "result": {},
+            "success": False,
+            "error": str(e),
+            "chat_hash": chat_hash,
+        }
+        with _write_lock:
+            insert_json_result(error_data)
+        raise
+
+
+def run_chats(chats: Iterable[tuple[int, ChatRecord]], worker, concurrency: int) -> None:
+    """Прогоняет чаты через `worker(idx, chat)` в пуле потоков.
+
+    В очереди держим не больше `2 * concurrency` задач, чтобы не забегать
+    далеко вперёд источника чатов. Запросы к LLM дополнительно ограничены
+    `_llm_slots`, так что потоков может быть больше (ждущие пачку — не в LLM).
+    """
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="chat")
+    try:
+        pending: set = set()
+        for idx, chat in chats:
+            if len(pending) >= 2 * concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    fut.result()
+            pending.add(pool.submit(worker, idx, chat))
+        for fut in pending:
+            fut.result()
+    except BaseException:
+        # Ctrl-C и ошибки: новые чаты не начинаем, начатые дописываем (повторный Ctrl-C — прервать)
+        print("⏹️  Остановка: ждём чаты, которые уже в работе")
+        pool.shutdown(wait=True, cancel_futures=True)
+        raise
+    pool.shutdown()
 
 
 # ────────────────────────────────────────────────────────────────────────────────
 # 🚀 Main
 # ────────────────────────────────────────────────────────────────────────────────
 
+def backend_urls(cfg: EnvConfig, stack: ExitStack) -> tuple[list[str], dict[str, SshTunnel]]:
+    """Собирает URL бэкендов; SSH-туннели открываются в `stack`.
+
+    LLM_HOST и LLM_HOSTS — прямые адреса, SSH_HOSTS — туннели (локальные
+    порты с LOCAL_PORT по порядку). Одиночный SSH_HOST, как и раньше,
+    используется, только если прямых адресов нет. Возвращает URL и
+    туннели по URL — для их перезапуска при обрыве.
+    """
+    urls = ([cfg.llm_host] if cfg.llm_host else []) + list(cfg.llm_hosts)
+    targets = list(cfg.ssh_hosts)
+    if not urls and not targets and cfg.ssh_host:
+        targets.append(cfg.ssh_host)
+    tunnels: dict[str, SshTunnel] = {}
+    for i, target in enumerate(targets):
+        tunnel = SshTunnel.from_target(cfg, target, cfg.local_port + i)
+        url = stack.enter_context(tunnel)
+        tunnels[url] = tunnel
+        urls.append(url)
+    if not urls:
+        raise ValueError("Не указан ни LLM_HOST/LLM_HOSTS, ни SSH_HOST/SSH_HOSTS")
+    return urls, tunnels
+
+
 def main() -> None:
-    done_hashes = load_history_hashes   ()
+    global _llm_slots, _dataset, _packer, _embeddings
     cfg = EnvConfig()
-
-    if not cfg.chat_file.exists():
-        print("❌ Укажите существующий файл в CHAT_FILE", file=sys.stderr)
+    try:
+        # БД подключается лениво, при первой записи — настройки проверяем до анализа чатов
+        DbConfig().validate()
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+    _llm_slots = threading.BoundedSemaphore(cfg.llm_concurrency)
+    if cfg.results_dataset is not None:
+        try:
+            _dataset = ResultDataset(cfg.results_dataset)
+        except ImportError:
+            print("⚠️ pyarrow не установлен — Parquet-датасет результатов не пишется")
+    history = HistoryStore(cfg.history_db)
+    imported = history.import_legacy_once(cfg.history_db.with_name("history.jsonl"), LEGACY_PROMPT_VERSION)
+    if imported is not None:
+        print(f"📥 Импортирована история из history.jsonl: {imported} записей")
+    cache = LLMCache(
+        cfg.llm_cache_path,
+        mode=cfg.llm_cache,
+        max_entries=cfg.llm_cache_max_entries,
+        max_age_days=cfg.llm_cache_max_age_days,
+    )
+    cache.evict()
+    metrics.configure(cfg.metrics_jsonl, cfg.metrics_prom)
+
+    queue = owner = None
+    if cfg.job_queue is not None:
+        queue = JobQueue(cfg.job_queue, lease_seconds=cfg.job_lease_seconds,
+                         max_attempts=cfg.job_max_attempts, backoff_base=cfg.job_backoff_seconds)
+        owner = make_owner()
+    files = chat_files(cfg.chat_file)
+    if (queue is None or cfg.job_queue_enqueue) and not files:
+        print("❌ Укажите в CHAT_FILE существующий файл, каталог или маску с файлами экспорта", file=sys.stderr)
         sys.exit(1)
 
-    if cfg.llm_host:
-        host_cm = contextmanager(lambda: (yield cfg.llm_host))()
-    else:
-        if not cfg.ssh_host:
-            print("❌ Не указан ни LLM_HOST, ни SSH_HOST", file=sys.stderr)
+    # соединений в полёте к одному бэкенду не больше LLM_CONCURRENCY, плюс проверки здоровья
+    transport.configure(cfg.llm_concurrency + 2)
+    with ExitStack() as stack:
+        try:
+            urls, tunnels = backend_urls(cfg, stack)
+        except (ValueError, RuntimeError) as e:
+            print(f"❌ {e}", file=sys.stderr)
             sys.exit(1)
-        host_cm = SshTunnel(cfg)
 
-    with host_cm as host_url:
+        def recover(url: str, started: float) -> bool:
+            tunnel = tunnels.get(url)
+            return tunnel is not None and tunnel.recover(started)
+
+        backends = BackendPool(urls, eject_seconds=cfg.backend_eject_seconds, recover=recover)
+        stack.callback(backends.close)
+        if cfg.embed_index is not None:
+            try:
+                index = EmbeddingIndex(cfg.embed_index, cfg.embed_model)
+            except ImportError:
+                print("⚠️ numpy не установлен — индекс эмбеддингов не строится")
+            except ValueError as e:
+                print(f"⚠️ Индекс эмбеддингов выключен: {e}")
+            else:
+                _embeddings = IndexBuffer(index, lambda texts: embed_texts(texts, cfg, backends))
         try:
-            all_chats = load_all_chats(cfg.chat_file)
-            for idx, (chat_name, messages) in enumerate(all_chats, 1):
-                try:
-                    chat_text = "\n".join(messages)
-                    chat_hash = compute_text_hash(chat_text)
-
-                    if chat_hash in done_hashes:
-                        print(f"⏭️  Пропускаем (не изменился): {chat_name}")
-                        continue
-
-                    prompt = prepare_prompt(chat_text)
-                    llm_data = call_llm(prompt, host_url, cfg.llm_model)
-                    parsed = robust_json_parse(llm_data["response"])
-
-                    filename_stub = f"{idx}_{slugify(chat_name)}"
-                    out, _ = save_result(cfg.output_dir, filename_stub, llm_data["response"], host_url, cfg.llm_model)
-
-                    result_data = {
-                        "id": str(uuid.uuid4()),
-                        "source_file": str(cfg.chat_file),
-                        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                        "host": host_url,
-                        "model": cfg.llm_model,
-                        "result": parsed,
-                        "success": True,
-                        "error": None,
-                        "chat_hash": chat_hash,
-                    }
-                    insert_json_result(result_data)
-
-                    append_history({
-                        "timestamp": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                        "chat_file": str(cfg.chat_file),
-                        "output": str(out),
-                        "model": cfg.llm_model,
-                        "host": host_url,
-                        "success": True,
-                        "chat_hash": chat_hash,
-                    })
-                    print(f"✅ Сохранено: {out.name}")
-                except Exception as e:
-                    print(f"❌ Ошибка чата {chat_name}: {e}")
-                    error_data = {
-                        "id": str(uuid.uuid4()),
-                        "source_file": str(cfg.chat_file),
-                        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                        "host": host_url,
-                        "model": cfg.llm_model,
-                        "result": {},
-                        "success": False,
-                        "error": str(e),
-                        "chat_hash": chat_hash,
-                    }
-                    insert_json_result(error_data)
+            backends.check_all()
+            backends.start_health_checks()
+            for url in backends.healthy_urls():
+                for model in cfg.cascade:
+                    warm_up_model(url, model, cfg.llm_keep_alive, cfg.api_key)
+            print(f"🧵 Параллельных запросов к LLM: {cfg.llm_concurrency}, бэкендов: {len(urls)}")
+
+            if queue is None:
+                all_chats = enumerate(iter_unique_chats(files, cfg.ingest_workers), 1)
+
+                def worker(idx: int, chat: ChatRecord) -> Optional[Path]:
+                    try:
+                        return process_chat(idx, chat, cfg, backends, history, cache)
+                    except Exception:  # pylint: disable=broad-except
+                        return None  # ошибка уже записана в БД
+            else:
+                if cfg.job_queue_enqueue:
+                    chats = iter_unique_chats(files, cfg.ingest_workers)
+                    jobs = (chat_job(idx, chat) for idx, chat in enumerate(chats, 1))
+                    print(f"📥 Поставлено в очередь: {queue.enqueue(jobs)}")
+                print(f"📋 Очередь {cfg.job_queue}: {queue.counts()}, обработчик {owner}")
+                queue.start_heartbeat(owner)
+                all_chats = iter_queue(queue, owner)
+
+                def worker(idx: int, chat: ChatRecord) -> Optional[Path]:
+                    try:
+                        out = process_chat(idx, chat, cfg, backends, history, cache)
+                    except Exception as e:  # pylint: disable=broad-except
+                        status = queue.fail(chat.key, owner, str(e))
+                        if status == "dead":
+                            print(f"💀 {chat.name}: попытки исчерпаны, задача помечена dead")
+                        return None
+                    queue.complete(chat.key, owner)
+                    return out
+
+            workers = cfg.llm_concurrency
+            if cfg.pack_max_chats > 1:
+                _packer = ChatPacker(
+                    lambda texts: analyze_pack(texts, cfg, backends, cache),
+                    max_chars=window_chars_for_ctx(cfg.llm_num_ctx),
+                    max_chats=cfg.pack_max_chats,
+                    linger=cfg.pack_linger,
+                    result_chars=PACK_RESULT_TOKENS * CHARS_PER_TOKEN,
+                )
+                # потоки, ждущие соседей по пачке, не занимают слот LLM;
+                # на каждый слот — по пачке, но не больше PACK_MAX_WORKERS потоков всего
+                workers = max(workers, min(workers * cfg.pack_max_chats, PACK_MAX_WORKERS))
+            run_chats(all_chats, worker, workers)
+            if len(urls) > 1:
+                backends.print_report()
+            counters = metrics.snapshot()["counters"]
+            if counters.get("pack_requests"):
+                print(f"📦 Пачки: запросов {counters['pack_requests']:g}, чатов в них {counters['packed_chats']:g}, "
+                      f"ушло отдельным запросом {counters.get('pack_fallbacks', 0):g}")
+            before, after = counters.get("compact_chars_before", 0), counters.get("compact_chars_after", 0)
+            if before:
+                print(f"🗜️  Сжатие промптов: символов {before:g} → {after:g} ({after / before - 1:+.1%}), "
+                      f"сэкономлено ~{(before - after) / CHARS_PER_TOKEN:.0f} токенов")
+            scored = counters.get("prefilter_passed", 0) + counters.get("prefilter_skipped", 0)
+            if scored:
+                skipped = counters.get("prefilter_skipped", 0)
+                print(f"🧹 Предфильтр: пропущено {skipped:g} из {scored:g} чатов ({skipped / scored:.1%})")
+            if len(cfg.cascade) > 1 and counters.get("cascade_tier1_attempts"):
+                print("🪜 Каскад моделей (принято / дошло до ступени):")
+                for tier, model in enumerate(cfg.cascade, 1):
+                    attempts = counters.get(f"cascade_tier{tier}_attempts", 0)
+                    accepted = counters.get(f"cascade_tier{tier}_accepted", 0)
+                    rate = f"{accepted / attempts:.1%}" if attempts else "—"
+                    print(f"   {tier}. {model}: {accepted:g} / {attempts:g} ({rate})")
+                if counters.get("cascade_unresolved"):
+                    print(f"   ⚠️ не прошли проверки и на последней ступени: {counters['cascade_unresolved']:g}")
 
         except Exception as e:
             print(f"❌ Общая ошибка: {e}", file=sys.stderr)
             sys.exit(1)
+        finally:
+            if queue is not None:
+                released = queue.release(owner)
+                if released:
+                    print(f"↩️  Возвращено в очередь незавершённых задач: {released}")
+                print(f"📋 Очередь: {queue.counts()}")
+                queue.close()
+            close_db()
+            if _dataset is not None:
+                _dataset.close()
+            if _embeddings is not None:
+                _embeddings.close()
+                print(f"🧭 Индекс эмбеддингов: добавлено {_embeddings.added}, всего {_embeddings.index.count}"
+                      + (f", не посчитано {_embeddings.failed}" if _embeddings.failed else ""))
+            history.close()
+            stats = cache.stats()
+            cache.close()
+            if stats["mode"] != "off":
+                print(f"💾 Кэш LLM: попаданий {stats['hits']}, промахов {stats['misses']}")
+            print("⏱️  Этапы:")
+            print(metrics.summary_table())
+            metrics.close()
 
 
 
 if __name__ == "__main__":
     main()
-
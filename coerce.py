@@ -0,0 +1,56 @@
+"""
+coerce.py — приведение значений из ответа модели
+================================================
+Модель не всегда соблюдает типы схемы: сумма приходит строкой
+`"1 500 ₽"`, жалоба — текстом вместо boolean. Здесь общие правила
+разбора и сверки сумм, которыми пользуются проверка ответа
+(`validation.py`), слияние окон (`chunking.py`) и Parquet-датасет
+(`dataset.py`).
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Optional
+
+_NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+_FALSE_STRINGS = {"", "false", "no", "нет", "0", "none", "null"}
+
+# Допустимое расхождение двух сумм: 2 % или 1 единица валюты
+SUM_TOLERANCE = 0.02
+
+
+def to_number(value: Any) -> Optional[float]:
+    """Число из ответа модели: 1500, "1 500 ₽", "2,5" → float; иначе None."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _NUMBER.search(str(value).replace(" ", "").replace(" ", ""))
+    return float(m.group().replace(",", ".")) if m else None
+
+
+def to_bool(value: Any) -> Optional[bool]:
+    """complaint бывает строкой с описанием жалобы — непустая строка считается True."""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float)):
+        return bool(value)
+    return str(value).strip().lower() not in _FALSE_STRINGS
+
+
+def items_total(parameters: list[dict]) -> Optional[tuple[float, float]]:
+    """(сумма price * quantity, сумма price) по позициям; None — если цена есть не у всех."""
+    by_quantity = by_price = 0.0
+    for p in parameters:
+        price = to_number(p.get("price"))
+        if price is None:
+            return None
+        quantity = to_number(p.get("quantity"))
+        by_quantity += price * (quantity if quantity is not None else 1.0)
+        by_price += price
+    return by_quantity, by_price
+
+
+def sums_match(a: float, b: float) -> bool:
+    """Суммы совпадают с точностью до SUM_TOLERANCE (округления модели не считаются ошибкой)."""
+    return abs(a - b) <= max(1.0, SUM_TOLERANCE * max(abs(a), abs(b)))
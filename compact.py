@@ -0,0 +1,104 @@
+"""
+compact.py — сжатие текста чата перед промптом
+==============================================
+Сырой экспорт тратит токены на то, что модели не нужно. Перед
+`prepare_prompt` сообщения:
+
+* получают короткие метки говорящего — `К:` (клиент) и `М:` (менеджер)
+  по полю `from_id`/`from` экспорта; подряд идущие реплики одного
+  говорящего склеиваются в одну строку;
+* теряют пустые, «только эмодзи» и служебные строки, чистые приветствия
+  и благодарности;
+* повторы остаются только в первом вхождении: длинные (автоответы,
+  шаблоны) — по всему чату, короткие — если идут подряд;
+* ссылки заменяются на домен: `[ссылка avito.ru]`.
+
+Хэш чата считается по исходным сообщениям, поэтому сжатие не влияет на
+историю и водяные знаки.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+CLIENT_TAG = "К"
+MANAGER_TAG = "М"
+
+_URL = re.compile(r"https?://(?:www\.)?([^/\s?#]+)\S*|\bwww\.([^/\s?#]+)\S*", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+# ни одной буквы или цифры: эмодзи, стикеры-подписи, «...», «+»
+_NO_CONTENT = re.compile(r"^[\W_]*$", re.UNICODE)
+# короче — не шаблон, а реплика вроде «да», которая может повторяться по делу
+BOILERPLATE_MIN_CHARS = 20
+# склеенная строка не длиннее этого — иначе окна длинного чата режутся хуже
+MAX_LINE_CHARS = 1000
+_SMALL_TALK = re.compile(
+    r"^(?:здравствуйте|здрасьте|добрый (?:день|вечер|утро)|доброе утро|привет|приветствую|hello|hi|"
+    r"спасибо(?: большое| огромное)?|благодарю|до свидания|всего доброго|хорошего дня)[\s!.,)]*$",
+    re.IGNORECASE,
+)
+
+
+@dataclass
+class CompactStats:
+    chars_before: int
+    chars_after: int
+    messages_before: int
+    lines_after: int
+
+    @property
+    def chars_saved(self) -> int:
+        return self.chars_before - self.chars_after
+
+
+def shorten_urls(text: str) -> str:
+    return _URL.sub(lambda m: f"[ссылка {(m.group(1) or m.group(2)).lower()}]", text)
+
+
+def client_senders(senders: Iterable[Optional[str]], chat_id: Optional[str], chat_name: str,
+                   manager_ids: Iterable[str] = ()) -> set[str]:
+    """Кто в чате клиент.
+
+    В личном чате Telegram id чата совпадает с id собеседника (`from_id`
+    = `user<id>`), а имя чата — с его именем. Если не совпало ни то, ни
+    другое, клиентом считается первый написавший, кроме известных менеджеров.
+    """
+    managers = set(manager_ids)
+    present = [s for s in senders if s and s not in managers]
+    clients = {s for s in present if (chat_id is not None and s == f"user{chat_id}") or s == chat_name}
+    if not clients and present:
+        clients = {present[0]}
+    return clients
+
+
+def compact_messages(messages: list[str], senders: list[Optional[str]],
+                     clients: set[str]) -> tuple[list[str], CompactStats]:
+    """Сжимает реплики чата. Возвращает строки для промпта и статистику."""
+    lines: list[str] = []
+    seen: set[tuple[str, str]] = set()
+    last_tag: Optional[str] = None
+    last_key: Optional[tuple[str, str]] = None
+    for text, sender in zip(messages, senders or [None] * len(messages)):
+        text = _SPACES.sub(" ", shorten_urls(text)).strip()
+        if not text or _NO_CONTENT.match(text) or _SMALL_TALK.match(text):
+            continue
+        tag = CLIENT_TAG if sender in clients else MANAGER_TAG if sender else None
+        key = (tag or "", text.casefold())
+        if key in seen or key == last_key:
+            continue
+        last_key = key
+        if len(text) >= BOILERPLATE_MIN_CHARS:
+            seen.add(key)
+        if lines and tag == last_tag and len(lines[-1]) + len(text) < MAX_LINE_CHARS:
+            lines[-1] += f" / {text}"
+        else:
+            lines.append(f"{tag}: {text}" if tag else text)
+        last_tag = tag
+    stats = CompactStats(
+        chars_before=len("\n".join(messages)),
+        chars_after=len("\n".join(lines)),
+        messages_before=len(messages),
+        lines_after=len(lines),
+    )
+    return lines, stats
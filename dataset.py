@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+dataset.py — колоночный датасет результатов (Parquet)
+=====================================================
+Помимо `*_analysis.json` и `chat_sessions_json` результаты пишутся в
+Parquet-датасет с разбиением по месяцу последнего сообщения чата
+(`month=YYYY-MM`; без дат сообщений — по месяцу анализа):
+
+* `chats/`      — строка на результат: модель, has_order, complaint, total_sum, summary;
+* `parameters/` — позиции заказа из `parameters`, по строке на позицию.
+
+Файлы неизменяемы: каждая пачка — новый `part-*.parquet`, повторный анализ
+чата добавляет новую версию (с ключом `version`), а отчёт берёт последнюю по `created_at`.
+`compact` сливает мелкие части и выкидывает устаревшие версии.
+Отчёт считается векторно средствами pyarrow, без разбора JSON в Python.
+
+Нужен `pyarrow` (необязательная зависимость: без него запись отключается).
+
+    python3 dataset.py report [output/dataset] [--top 10]
+    python3 dataset.py compact [output/dataset]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import uuid
+from pathlib import Path
+from typing import Any, Optional
+
+from coerce import to_bool, to_number
+from prefilter import PREFILTER_MODEL
+
+DEFAULT_ROOT = Path("output/dataset")
+
+
+def _pa():
+    import pyarrow as pa
+    return pa
+
+
+def chats_schema():
+    pa = _pa()
+    return pa.schema([
+        ("id", pa.string()),
+        ("chat_hash", pa.string()),
+        ("created_at", pa.timestamp("s")),
+        # ключ версии: связывает строку chats с её позициями в parameters
+        ("version", pa.string()),
+        # дата последнего сообщения чата: по ней месяц, а не по времени анализа
+        ("last_message_at", pa.timestamp("s")),
+        ("source_file", pa.string()),
+        ("host", pa.string()),
+        ("model", pa.string()),
+        ("has_order", pa.bool_()),
+        ("complaint", pa.bool_()),
+        ("total_sum", pa.float64()),
+        ("items", pa.int32()),
+        ("summary", pa.string()),
+    ])
+
+
+def parameters_schema():
+    pa = _pa()
+    return pa.schema([
+        ("id", pa.string()),
+        ("created_at", pa.timestamp("s")),
+        ("version", pa.string()),
+        ("last_message_at", pa.timestamp("s")),
+        ("model", pa.string()),
+        ("item", pa.string()),
+        ("material", pa.string()),
+        ("color", pa.string()),
+        ("size", pa.string()),
+        ("quantity", pa.float64()),
+        ("price", pa.float64()),
+    ])
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🔧 Приведение ответа модели к колонкам
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def _timestamp(value: Any):
+    """Дата сообщения Telegram (`2024-03-01T12:30:00`) → datetime без таймзоны; иначе None."""
+    from datetime import datetime
+
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=None)
+
+
+def flatten_result(record: dict) -> tuple[dict, list[dict]]:
+    """Запись `chat_sessions_json` → (строка chats, строки parameters)."""
+    from datetime import datetime
+
+    result = record.get("result") or {}
+    items = result.get("parameters") or []
+    if not isinstance(items, list):
+        items = [items]
+    created_at = datetime.strptime(record["created_at"], "%Y-%m-%d %H:%M:%S")
+    last_message_at = _timestamp(record.get("last_message_at"))
+    version = uuid.uuid4().hex
+    chat = {
+        "id": record["id"],
+        "chat_hash": record.get("chat_hash"),
+        "created_at": created_at,
+        "version": version,
+        "last_message_at": last_message_at,
+        "source_file": record.get("source_file"),
+        "host": record.get("host"),
+        "model": record.get("model"),
+        "has_order": to_bool(result.get("has_order")),
+        "complaint": to_bool(result.get("complaint")),
+        "total_sum": to_number(result.get("total_sum")),
+        "items": len(items),
+        "summary": _text(result.get("summary")),
+    }
+    params = [
+        {
+            "id": record["id"],
+            "created_at": created_at,
+            "version": version,
+            "last_message_at": last_message_at,
+            "model": record.get("model"),
+            "item": _text(p.get("item")),
+            "material": _text(p.get("material")),
+            "color": _text(p.get("color")),
+            "size": _text(p.get("size")),
+            "quantity": to_number(p.get("quantity")),
+            "price": to_number(p.get("price")),
+        }
+        for p in items
+        if isinstance(p, dict)
+    ]
+    return chat, params
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 💾 Запись
+class ResultDataset:
+    """Буфер результатов с пакетной записью Parquet-частей. Потокобезопасен."""
+
+    def __init__(self, root: Path = DEFAULT_ROOT, batch_rows: int = 5000):
+        _pa()  # ImportError сразу, а не при первой записи
+        self.root = root
+        self.batch_rows = batch_rows
+        self._lock = threading.Lock()
+        self._chats: list[dict] = []
+        self._params: list[dict] = []
+        self.written = 0
+
+    def append(self, record: dict) -> None:
+        chat, params = flatten_result(record)
+        with self._lock:
+            self._chats.append(chat)
+            self._params.extend(params)
+            if len(self._chats) >= self.batch_rows:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        self.flush()
+
+    def _flush_locked(self) -> None:
+        if not self._chats:
+            return
+        part = uuid.uuid4().hex
+        _write_partitioned(self.root / "chats", _with_month(self._chats, chats_schema()), chats_schema(), part)
+        if self._params:
+            params = _with_month(self._params, parameters_schema())
+            _write_partitioned(self.root / "parameters", params, parameters_schema(), part)
+        self.written += len(self._chats)
+        self._chats, self._params = [], []
+
+
+def _write_partitioned(base: Path, table, schema, part: str) -> None:
+    """Пишет таблицу с колонкой `month` по файлу на месяц: base/month=YYYY-MM/part-*.parquet."""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    for month in pc.unique(table["month"]).to_pylist():
+        directory = base / f"month={month}"
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f".part-{part}.parquet.tmp"
+        rows = table.filter(pc.equal(table["month"], month)).select(schema.names).cast(schema)
+        pq.write_table(rows, tmp, compression="zstd")
+        tmp.rename(directory / f"part-{part}.parquet")
+
+
+def _with_month(rows: list[dict], schema):
+    pa = _pa()
+    for row in rows:
+        row["month"] = (row["last_message_at"] or row["created_at"]).strftime("%Y-%m")
+    return pa.Table.from_pylist(rows, schema=schema.append(pa.field("month", pa.string())))
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 📊 Чтение и отчёт
+def read_table(root: Path, name: str):
+    import pyarrow.dataset as ds
+
+    pa = _pa()
+    path = root / name
+    if not path.exists():
+        return None
+    # схема явно: в частях, записанных до появления колонки, она читается как null
+    schema = {"chats": chats_schema, "parameters": parameters_schema}[name]().append(pa.field("month", pa.string()))
+    return ds.dataset(str(path), format="parquet", partitioning="hive", schema=schema,
+                      exclude_invalid_files=True).to_table()
+
+
+def latest_versions(chats, params=None):
+    """Оставляет последнюю по created_at версию каждого чата (и её позиции)."""
+    import pyarrow.compute as pc
+
+    pa = _pa()
+    chats = chats.append_column("__row", pa.array(range(chats.num_rows), pa.int64()))
+    newest = chats.group_by("id").aggregate([("created_at", "max")])
+    chats = chats.join(newest, keys=["id"], join_type="inner")
+    chats = chats.filter(pc.equal(chats["created_at"], chats["created_at_max"]))
+    # одинаковый created_at у двух версий — берём записанную позже
+    keep = chats.group_by("id").aggregate([("__row", "max")])["__row_max"]
+    chats = chats.filter(pc.is_in(chats["__row"], value_set=keep)).drop_columns(["__row", "created_at_max"])
+    if params is None:
+        return chats, None
+    # позиции — по ключу версии: две версии за одну секунду имеют одинаковый created_at
+    chat_keys = chats.select(["id"]).append_column("__version", _version_key(chats))
+    params = (
+        params.append_column("__version", _version_key(params))
+        .join(chat_keys, keys=["id", "__version"], join_type="left semi")
+        .drop_columns(["__version"])
+    )
+    return chats, params
+
+
+def _version_key(table):
+    """`version`, а в частях, записанных до появления колонки, — `created_at` строкой."""
+    import pyarrow.compute as pc
+
+    return pc.coalesce(table["version"], pc.cast(table["created_at"], _pa().string()))
+
+
+def build_report(root: Path, top: int = 10) -> dict[str, Any]:
+    import pyarrow.compute as pc
+
+    chats = read_table(root, "chats")
+    if chats is None or chats.num_rows == 0:
+        return {}
+    chats, params = latest_versions(chats, read_table(root, "parameters"))
+    # отсеянные предфильтром чаты LLM не видела — в доли и счётчики моделей они не идут
+    prefiltered = pc.fill_null(pc.equal(chats["model"], PREFILTER_MODEL), False)
+    skipped = pc.sum(pc.cast(prefiltered, "int64")).as_py() or 0
+    chats = chats.filter(pc.invert(prefiltered))
+
+    orders = chats.filter(pc.fill_null(chats["has_order"], False))
+    by_month = (
+        orders.group_by("month")
+        .aggregate([("total_sum", "sum"), ("id", "count")])
+        .sort_by("month")
+    )
+    by_model = (
+        chats.append_column("complaint_i", pc.cast(pc.fill_null(chats["complaint"], False), "int8"))
+        .group_by("model")
+        .aggregate([("complaint_i", "mean"), ("id", "count")])
+        .sort_by([("id_count", "descending")])
+    )
+    report: dict[str, Any] = {
+        "chats": chats.num_rows,
+        "prefiltered": skipped,
+        "orders": orders.num_rows,
+        "revenue": pc.sum(orders["total_sum"]).as_py() or 0.0,
+        "total_sum_by_month": by_month.to_pylist(),
+        "complaint_rate_by_model": by_model.to_pylist(),
+        "top_material_color": [],
+    }
+    if params is not None and params.num_rows:
+        top_pairs = (
+            params.append_column("quantity_1", pc.fill_null(params["quantity"], 1.0))
+            .group_by(["material", "color"])
+            .aggregate([("quantity_1", "sum"), ("id", "count_distinct")])
+            .sort_by([("id_count_distinct", "descending"), ("quantity_1_sum", "descending")])
+            .slice(0, top)
+        )
+        report["top_material_color"] = top_pairs.to_pylist()
+    return report
+
+
+def print_report(report: dict[str, Any]) -> None:
+    if not report:
+        print("⚠️ Датасет пуст")
+        return
+    print(f"📊 Чатов: {report['chats']}, заказов: {report['orders']}, сумма: {report['revenue']:.0f}")
+    if report["prefiltered"]:
+        print(f"🧹 Отсеяно предфильтром (без LLM): {report['prefiltered']}")
+    print("\n🗓️  Сумма заказов по месяцам:")
+    for row in report["total_sum_by_month"]:
+        print(f"   {row['month']}: {row['id_count']} заказов, {row['total_sum_sum'] or 0:.0f}")
+    print("\n🤖 Доля жалоб по моделям:")
+    for row in report["complaint_rate_by_model"]:
+        print(f"   {row['model']}: {row['complaint_i_mean'] or 0:.1%} из {row['id_count']}")
+    if report["top_material_color"]:
+        print("\n🎨 Чаще всего заказывают (материал / цвет):")
+        for row in report["top_material_color"]:
+            print(f"   {row['material'] or '—'} / {row['color'] or '—'}: "
+                  f"{row['id_count_distinct']} заказов, {row['quantity_1_sum']:.0f} шт.")
+
+
+def compact(root: Path) -> int:
+    """Сливает части каждого месяца в один файл, оставляя последние версии чатов.
+
+    Возвращает число удалённых устаревших версий.
+    """
+    chats = read_table(root, "chats")
+    if chats is None:
+        return 0
+    params = read_table(root, "parameters")
+    before = chats.num_rows
+    chats, params = latest_versions(chats, params)
+    part = uuid.uuid4().hex
+    old_files = [p for name in ("chats", "parameters") for p in (root / name).rglob("part-*.parquet")]
+    _write_partitioned(root / "chats", chats, chats_schema(), part)
+    if params is not None:
+        _write_partitioned(root / "parameters", params, parameters_schema(), part)
+    for path in old_files:
+        path.unlink()
+    return before - chats.num_rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Parquet-датасет результатов анализа")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_report = sub.add_parser("report", help="сводные показатели по датасету")
+    p_report.add_argument("root", nargs="?", type=Path, default=DEFAULT_ROOT)
+    p_report.add_argument("--top", type=int, default=10)
+    p_report.add_argument("--json", action="store_true", help="вывести отчёт как JSON")
+    p_compact = sub.add_parser("compact", help="слить части и убрать устаревшие версии")
+    p_compact.add_argument("root", nargs="?", type=Path, default=DEFAULT_ROOT)
+    args = parser.parse_args()
+
+    if args.cmd == "report":
+        report = build_report(args.root, args.top)
+        if args.json:
+            print(json.dumps(report, ensure_ascii=False, indent=2, default=str))
+        else:
+            print_report(report)
+    else:
+        print(f"🧹 Удалено устаревших версий: {compact(args.root)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,86 @@
-import mysql.connector
-from mysql.connector import pooling
+"""
+db.py — запись результатов анализа в БД
+=======================================
+`insert_json_result` не ходит в базу сам: строка кладётся в ограниченную
+очередь, а фоновый поток пишет накопленное одной транзакцией через
+`executemany` — по достижении `DB_BATCH_SIZE` строк или раз в
+`DB_FLUSH_INTERVAL` секунд. Строка с уже существующим `id` обновляется —
+так инкрементальный анализ заменяет прежний результат чата.
+
+Сбои записи:
+* БД недоступна — пачка повторяется с нарастающей задержкой;
+* БД отклонила данные (слишком длинное значение, неверный тип) — пачка
+  пишется половинами, пока плохие строки не останутся поодиночке; они
+  уходят в dead-letter файл (`DB_DEAD_LETTER`, JSONL с текстом ошибки),
+  остальные записываются;
+* при завершении (`close()` или выход из процесса) очередь дописывается до
+  конца; если БД так и не ответила, остаток тоже уходит в dead-letter.
+
+Бэкенды: `DB_BACKEND=mysql` (по умолчанию) или `DB_BACKEND=sqlite` для
+локальной работы без MySQL-сервера (`DB_SQLITE_PATH`).
+"""
+from __future__ import annotations
+
+import atexit
 import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from metrics import metrics
+
+
+def _env(name: str, default: str):
+    return field(default_factory=lambda: os.getenv(name, default))
+
+
+def _env_int(name: str, default: int):
+    return field(default_factory=lambda: int(os.getenv(name, default)))
+
+
+def _env_float(name: str, default: float):
+    return field(default_factory=lambda: float(os.getenv(name, default)))
+
+
+@dataclass
+class DbConfig:
+    """Настройки БД; env-переменные читаются при создании объекта, а не при импорте."""
+
+    backend: str = _env("DB_BACKEND", "mysql")
+
+    host: str = _env("DB_HOST", "localhost")
+    user: str = _env("DB_USER", "daily")
+    # пароль только из окружения; для mysql обязателен (см. validate)
+    password: str = _env("DB_PASSWORD", "")
+    database: str = _env("DB_NAME", "aaa3dplus")
+    port: int = _env_int("DB_PORT", 3306)
+    pool_size: int = _env_int("DB_POOL_SIZE", 5)
+
+    sqlite_path: str = _env("DB_SQLITE_PATH", "output/results.sqlite")
 
-db_config = {
-    "host": "localhost",
-    "user": "daily",
-    "password": "zemhfKAM7&k\"G?P",
-    "database": "aaa3dplus",
-    "port": 3306,
-}
-
-pool = pooling.MySQLConnectionPool(pool_name="mypool", pool_size=5, **db_config)
-
-def get_connection():
-    return pool.get_connection()
-
-def insert_json_result(session: dict):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO chat_sessions_json
-        (id, source_file, created_at, host, model, result_json, success, error)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-    """, (
+    batch_size: int = _env_int("DB_BATCH_SIZE", 50)
+    flush_interval: float = _env_float("DB_FLUSH_INTERVAL", 2.0)
+    queue_size: int = _env_int("DB_QUEUE_SIZE", 1000)
+    # строки, которые БД отклонила (или не приняла до завершения), — JSONL с ошибкой
+    dead_letter_path: str = _env("DB_DEAD_LETTER", "output/db_dead_letter.jsonl")
+
+    def validate(self) -> None:
+        """ValueError с понятным текстом, если с такими настройками к БД не подключиться."""
+        if self.backend not in ("mysql", "sqlite"):
+            raise ValueError(f"Неизвестный DB_BACKEND: {self.backend}")
+        if self.backend == "mysql" and not self.password:
+            raise ValueError("Не задан DB_PASSWORD (обязателен при DB_BACKEND=mysql)")
+
+
+_COLUMNS = ("id", "source_file", "created_at", "host", "model", "result_json", "success", "error")
+
+
+def _session_to_row(session: dict) -> tuple:
+    return (
         session["id"],
         session["source_file"],
         session["created_at"],
@@ -31,7 +89,267 @@ def insert_json_result(session: dict):
         json.dumps(session["result"], ensure_ascii=False),
         session["success"],
         session.get("error"),
-    ))
-    conn.commit()
-    cursor.close()
-    conn.close()
+    )
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🗄️ Бэкенды
+# ────────────────────────────────────────────────────────────────────────────────
+
+class MySQLBackend:
+    def __init__(self, cfg: DbConfig):
+        from mysql.connector import pooling
+
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name="mypool",
+            pool_size=cfg.pool_size,
+            host=cfg.host,
+            user=cfg.user,
+            password=cfg.password,
+            database=cfg.database,
+            port=cfg.port,
+        )
+
+    def get_connection(self):
+        return self.pool.get_connection()
+
+    @staticmethod
+    def is_row_error(exc: Exception) -> bool:
+        """Ошибка из-за данных строки (а не соединения) — повтор той же строки не поможет."""
+        from mysql.connector import errors
+
+        if isinstance(exc, errors.ProgrammingError):
+            # errno -1 — значение не удалось подставить в запрос; серверные (нет доступа, нет таблицы) — не про строку
+            return exc.errno == -1
+        return isinstance(exc, (errors.DataError, errors.IntegrityError, TypeError, ValueError))
+
+    def write_many(self, rows: list[tuple]) -> None:
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(f"""
+                INSERT INTO chat_sessions_json
+                ({", ".join(_COLUMNS)})
+                VALUES ({", ".join(["%s"] * len(_COLUMNS))}) AS new
+                ON DUPLICATE KEY UPDATE {", ".join(f"{c}=new.{c}" for c in _COLUMNS[1:])}
+            """, rows)
+            conn.commit()
+            cursor.close()
+        except Exception:
+            # откат на оборванном соединении сам падает — наружу идёт исходная ошибка,
+            # по ней BatchWriter решает, повторять ли пачку
+            try:
+                conn.rollback()
+            except Exception:  # pylint: disable=broad-except
+                pass
+            raise
+        finally:
+            conn.close()
+
+
+class SQLiteBackend:
+    def __init__(self, cfg: DbConfig):
+        path = cfg.sqlite_path
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS chat_sessions_json (
+                id          TEXT PRIMARY KEY,
+                source_file TEXT,
+                created_at  TEXT,
+                host        TEXT,
+                model       TEXT,
+                result_json TEXT,
+                success     INTEGER,
+                error       TEXT
+            )
+        """)
+
+    @staticmethod
+    def is_row_error(exc: Exception) -> bool:
+        # OperationalError (database is locked, диск) — временный сбой, его повторяем
+        return isinstance(exc, (sqlite3.DataError, sqlite3.IntegrityError, sqlite3.InterfaceError,
+                                sqlite3.ProgrammingError, TypeError, ValueError))
+
+    def write_many(self, rows: list[tuple]) -> None:
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO chat_sessions_json ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                rows,
+            )
+
+
+def make_backend(cfg: DbConfig):
+    cfg.validate()
+    if cfg.backend == "sqlite":
+        return SQLiteBackend(cfg)
+    return MySQLBackend(cfg)
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 📨 Фоновая запись пачками
+# ────────────────────────────────────────────────────────────────────────────────
+
+_STOP = object()
+
+
+class BatchWriter:
+    """Фоновый поток, который пишет строки пачками в одной транзакции."""
+
+    def __init__(self, backend, batch_size: int = 50, flush_interval: float = 2.0,
+                 queue_size: int = 1000, max_retry_delay: float = 30.0,
+                 dead_letter_path: Optional[str] = None, stop_attempts: int = 5):
+        self.backend = backend
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_retry_delay = max_retry_delay
+        self.dead_letter_path = dead_letter_path
+        # сколько раз повторять пачку при завершении, прежде чем отправить её в dead-letter
+        self.stop_attempts = stop_attempts
+        self.written = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, session: dict) -> None:
+        """Ставит строку в очередь; блокируется, если очередь заполнена."""
+        self._queue.put(_session_to_row(session))
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Дописывает очередь и останавливает поток."""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        batch: list[tuple] = []
+        stopping = False
+        retry_delay = first_delay = min(1.0, self.max_retry_delay)
+        attempts = 0
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            while not stopping and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if stopping:
+                # при остановке забираем всё, что успели положить
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+
+            if batch:
+                batch, error = self._write(batch)
+                if error is None:
+                    retry_delay = first_delay
+                    attempts = 0
+                else:
+                    self.failed_batches += 1
+                    attempts += 1
+                    if stopping and attempts >= self.stop_attempts:
+                        print(f"❌ БД недоступна, {len(batch)} строк не записано: {error}")
+                        self._dead_letter(batch, error)
+                        return
+                    print(f"❌ Ошибка записи в БД ({len(batch)} строк), повтор через {retry_delay:.0f} с: {error}")
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, self.max_retry_delay)
+                    continue
+
+            if stopping:
+                return
+
+    def _write(self, batch: list[tuple]) -> tuple[list[tuple], Optional[Exception]]:
+        """Пишет пачку. Возвращает (незаписанные строки, ошибка БД) — их нужно повторить.
+
+        Если БД отклонила данные, пачка делится пополам, пока плохие строки
+        не окажутся поодиночке; их забирает dead-letter, остальные пишутся.
+        """
+        pieces = [batch]
+        while pieces:
+            rows = pieces.pop()
+            try:
+                with metrics.span("db_flush", rows=len(rows)):
+                    self.backend.write_many(rows)
+            except Exception as e:  # pylint: disable=broad-except
+                if not self.backend.is_row_error(e):
+                    # соединение или сервер: всё ещё не записанное повторим целиком
+                    return rows + [row for piece in reversed(pieces) for row in piece], e
+                if len(rows) == 1:
+                    print(f"⚠️ БД отклонила строку {rows[0][0]}: {e}")
+                    self._dead_letter(rows, e)
+                    continue
+                middle = len(rows) // 2
+                pieces += [rows[middle:], rows[:middle]]
+                continue
+            self.written += len(rows)
+        return [], None
+
+    def _dead_letter(self, rows: list[tuple], error: Exception) -> None:
+        """Дописывает строки в dead-letter JSONL, чтобы их можно было разобрать и загрузить позже."""
+        self.dead_lettered += len(rows)
+        metrics.count("db_dead_letter", len(rows))
+        if not self.dead_letter_path:
+            return
+        os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+        failed_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({"failed_at": failed_at, "error": str(error), "row": dict(zip(_COLUMNS, row))},
+                                   ensure_ascii=False, default=str) + "\n")
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🔌 Модульный API
+# ────────────────────────────────────────────────────────────────────────────────
+
+_writer: Optional[BatchWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer(cfg: Optional[DbConfig] = None) -> BatchWriter:
+    """Ленивая инициализация: подключение к БД создаётся при первой записи."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            cfg = cfg or DbConfig()
+            _writer = BatchWriter(
+                make_backend(cfg),
+                batch_size=cfg.batch_size,
+                flush_interval=cfg.flush_interval,
+                queue_size=cfg.queue_size,
+                dead_letter_path=cfg.dead_letter_path or None,
+            )
+        return _writer
+
+
+def insert_json_result(session: dict) -> None:
+    get_writer().put(session)
+
+
+def close() -> None:
+    """Дописывает очередь в БД. Безопасно вызывать несколько раз."""
+    global _writer
+    with _writer_lock:
+        writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+        if writer.dead_lettered:
+            print(f"⚠️ Не записано в БД строк: {writer.dead_lettered} (см. {writer.dead_letter_path})")
+
+
+atexit.register(close)
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""
+embeddings.py — локальный индекс эмбеддингов и поиск похожих чатов
+==================================================================
+Для каждого проанализированного чата эмбеддинг `summary` + текста чата
+считается через `POST /api/embed` Ollama (модель EMBED_MODEL) и
+дописывается в индекс — каталог с файлами:
+
+* `vectors.f32` — матрица N × dim (float32, нормированные строки);
+* `sketch.f32`  — та же матрица, спроецированная на 128 измерений
+  случайной проекцией: первый, грубый проход поиска;
+* `alive.u8`    — 0 у строк, вытесненных новой версией того же чата;
+* `offsets.u64` + `rows.jsonl` — chat_hash, id, имя и summary строки;
+* `meta.json`   — модель, размерность и число строк (точка фиксации записи).
+
+Матрицы открываются через `np.memmap`: запуск не читает их в память.
+Запрос — косинус по всей матрице скетчей (одно умножение матрицы на
+вектор), затем точный пересчёт по полным векторам для лучших кандидатов.
+Индекс пополняется инкрементально: chat_hash, который уже есть, не
+пересчитывается. Писать в индекс могут несколько процессов: дозапись идёт
+под `flock` на `write.lock`, и писатель сначала дочитывает строки, которые
+успели дописать другие. Поиск по chat_hash или id — через словари ключей
+в памяти, а не проходом по `rows.jsonl`.
+
+Нужен `numpy` (необязательная зависимость: без него индекс не строится).
+
+    python3 embeddings.py query "жалоба на трещины в PETG" [--top 10] [--exact]
+    python3 embeddings.py like <chat_hash или id> [--top 10]
+    python3 embeddings.py build data/chat.json     # дозаполнить по Parquet-датасету
+    python3 embeddings.py status
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+import requests
+
+import transport
+from backends import BackendError
+
+DEFAULT_ROOT = Path("output/embeddings")
+DEFAULT_MODEL = "nomic-embed-text"
+
+SKETCH_DIM = 128
+# Сколько кандидатов грубого прохода пересчитывается точно — на один результат
+CANDIDATES_PER_RESULT = 32
+MIN_CANDIDATES = 256
+# Сколько символов чата уходит в эмбеддинг вместе с summary
+EMBED_MAX_CHARS = 4000
+SUMMARY_CHARS = 300
+
+
+def _np():
+    import numpy as np
+    return np
+
+
+def embed_text(summary: str, text: str, max_chars: int = EMBED_MAX_CHARS) -> str:
+    return f"{summary}\n\n{text}"[:max_chars]
+
+
+def ollama_embed(url: str, model: str, texts: list[str], api_key: Optional[str] = None,
+                 timeout: float = 120) -> list[list[float]]:
+    """Эмбеддинги пачки текстов через `/api/embed`; сбой транспорта — BackendError."""
+    headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+    try:
+        resp = transport.session().post(f"{url.rstrip('/')}/api/embed", json={"model": model, "input": texts},
+                                        headers=headers, timeout=timeout)
+        resp.raise_for_status()
+    except requests.RequestException as e:
+        if transport.is_request_error(e):
+            raise requests.HTTPError(f"Embedding request rejected: {e}; {e.response.text[:500]}",
+                                     response=e.response) from e
+        raise BackendError(f"Embedding request failed: {e}") from e
+    vectors = resp.json().get("embeddings") or []
+    if len(vectors) != len(texts):
+        raise ValueError(f"Ollama вернула {len(vectors)} эмбеддингов на {len(texts)} текстов")
+    return vectors
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🧭 Индекс
+# ────────────────────────────────────────────────────────────────────────────────
+class EmbeddingIndex:
+    """Матрица эмбеддингов на диске с поиском top-k по косинусу."""
+
+    def __init__(self, root: Path = DEFAULT_ROOT, model: str = DEFAULT_MODEL, writable: bool = True):
+        self.np = _np()  # ImportError сразу, а не при первой записи
+        self.root = root
+        self.writable = writable
+        self._lock = threading.Lock()
+        meta_path = root / "meta.json"
+        meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+        if meta.get("count") and meta.get("model") != model and writable:
+            raise ValueError(f"Индекс {root} построен моделью {meta['model']}, а не {model}")
+        self.model = meta.get("model", model)
+        self.dim: Optional[int] = meta.get("dim")
+        self.seed: int = meta.get("seed", 0)
+        self.count: int = meta.get("count", 0)
+        self._projection = None
+        self._views: Optional[tuple] = None
+        # ключи строк → номер строки; читателю загружаются при первом find()
+        self._by_hash: dict[str, int] = {}
+        self._latest: dict[str, int] = {}
+        self._loaded = 0     # сколько строк rows.jsonl разобрано в словари
+        self._rows_end = 0   # байт rows.jsonl сразу после строки _loaded - 1
+        if writable:
+            root.mkdir(parents=True, exist_ok=True)
+            with self._writer_lock():
+                self._recover()
+
+    # ── файлы ──────────────────────────────────────────────────────────────
+    def _path(self, name: str) -> Path:
+        return self.root / name
+
+    @property
+    def sketch_dim(self) -> int:
+        return min(SKETCH_DIM, self.dim or SKETCH_DIM)
+
+    @property
+    def has_sketch(self) -> bool:
+        return self.dim is not None and self.dim > SKETCH_DIM
+
+    def projection(self):
+        if self._projection is None:
+            rng = self.np.random.default_rng(self.seed)
+            # float32: с float64 умножение матрицы скетчей на запрос медленнее в разы
+            matrix = rng.standard_normal((self.dim, SKETCH_DIM)) / self.np.sqrt(SKETCH_DIM)
+            self._projection = matrix.astype(self.np.float32)
+        return self._projection
+
+    @contextmanager
+    def _writer_lock(self) -> Iterator[None]:
+        """Межпроцессная блокировка писателя (`flock`); на Windows её нет — писатель один."""
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+        with open(self._path("write.lock"), "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_keys(self) -> None:
+        """Дочитывает chat_hash и id строк с `_loaded` до `count`."""
+        if self._loaded >= self.count:
+            return
+        with open(self._path("rows.jsonl"), "rb") as f:
+            f.seek(self._rows_end)
+            for row_no in range(self._loaded, self.count):
+                row = json.loads(f.readline())
+                self._by_hash[row["chat_hash"]] = row_no
+                self._latest[row["id"]] = row_no
+            self._rows_end = f.tell()
+        self._loaded = self.count
+
+    def _sync(self) -> None:
+        """Под блокировкой писателя: подхватывает строки, дописанные другими процессами."""
+        meta_path = self._path("meta.json")
+        meta = json.loads(meta_path.read_text(encoding="utf-8")) if meta_path.exists() else {}
+        if meta.get("count", 0) <= self.count:
+            return
+        if self.dim is not None and meta["dim"] != self.dim:
+            raise ValueError(f"Индекс {self.root} перестроен с размерностью {meta['dim']}, а не {self.dim}")
+        self.dim, self.seed, self.count = meta["dim"], meta.get("seed", 0), meta["count"]
+        self._views = None
+        self._read_keys()
+
+    def _recover(self) -> None:
+        """Обрезает хвосты файлов после записи, не дошедшей до meta.json, и читает ключи строк."""
+        # meta.json в __init__ читался без блокировки: другой писатель мог с тех пор дописать строки
+        self._sync()
+        rows_path = self._path("rows.jsonl")
+        if rows_path.exists():
+            self._read_keys()
+            os.truncate(rows_path, self._rows_end)
+        dim = self.dim or 0
+        sizes = {
+            "offsets.u64": 8,
+            "alive.u8": 1,
+            "vectors.f32": 4 * dim,
+            "sketch.f32": 4 * self.sketch_dim if self.has_sketch else 0,
+        }
+        for name, row_bytes in sizes.items():
+            path = self._path(name)
+            if path.exists() and path.stat().st_size > self.count * row_bytes:
+                os.truncate(path, self.count * row_bytes)
+
+    def _write_meta(self) -> None:
+        meta = {"model": self.model, "dim": self.dim, "seed": self.seed, "count": self.count,
+                "sketch_dim": self.sketch_dim if self.has_sketch else None}
+        tmp = self._path("meta.json.tmp")
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        tmp.replace(self._path("meta.json"))
+
+    def _normalize(self, matrix):
+        np = self.np
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    # ── запись ─────────────────────────────────────────────────────────────
+    def contains(self, chat_hash: str) -> bool:
+        with self._lock:
+            return chat_hash in self._by_hash
+
+    def add(self, rows: list[dict[str, Any]], vectors) -> int:
+        """Дописывает строки `{chat_hash, id, name, summary}` с их эмбеддингами.
+
+        Уже известные chat_hash пропускаются; прежняя строка того же `id`
+        помечается вытесненной. Возвращает число добавленных строк.
+        """
+        if not self.writable:
+            raise RuntimeError("Индекс открыт только для чтения")
+        np = self.np
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._writer_lock():
+            self._sync()
+            keep, seen = [], set()
+            for i, row in enumerate(rows):
+                if row["chat_hash"] not in self._by_hash and row["chat_hash"] not in seen:
+                    seen.add(row["chat_hash"])
+                    keep.append(i)
+            if not keep:
+                return 0
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Размерность эмбеддинга {vectors.shape[1]} ≠ {self.dim} в индексе")
+            matrix = self._normalize(vectors[keep])
+
+            offset = self._rows_end
+            offsets, lines = [], []
+            for i in keep:
+                row = rows[i]
+                line = json.dumps({
+                    "chat_hash": row["chat_hash"],
+                    "id": row["id"],
+                    "name": row.get("name"),
+                    "summary": (row.get("summary") or "")[:SUMMARY_CHARS],
+                }, ensure_ascii=False).encode("utf-8") + b"\n"
+                offsets.append(offset)
+                lines.append(line)
+                offset += len(line)
+            with open(self._path("rows.jsonl"), "ab") as f:
+                f.write(b"".join(lines))
+            with open(self._path("offsets.u64"), "ab") as f:
+                f.write(np.asarray(offsets, dtype=np.uint64).tobytes())
+            with open(self._path("vectors.f32"), "ab") as f:
+                f.write(matrix.tobytes())
+            if self.has_sketch:
+                with open(self._path("sketch.f32"), "ab") as f:
+                    f.write(self._normalize(matrix @ self.projection()).astype(np.float32).tobytes())
+            with open(self._path("alive.u8"), "ab") as f:
+                f.write(np.ones(len(keep), dtype=np.uint8).tobytes())
+
+            superseded = []
+            for n, i in enumerate(keep):
+                row = rows[i]
+                previous = self._latest.get(row["id"])
+                if previous is not None:
+                    superseded.append(previous)
+                self._latest[row["id"]] = self.count + n
+                self._by_hash[row["chat_hash"]] = self.count + n
+            if superseded:
+                with open(self._path("alive.u8"), "r+b") as f:
+                    for row_no in superseded:
+                        f.seek(row_no)
+                        f.write(b"\0")
+            self.count += len(keep)
+            self._loaded, self._rows_end = self.count, offset
+            self._write_meta()
+            self._views = None
+        return len(keep)
+
+    # ── поиск ──────────────────────────────────────────────────────────────
+    def _open_views(self) -> tuple:
+        """memmap-представления файлов: страницы читаются ОС по мере обращения."""
+        if self._views is None or self._views[0] != self.count:
+            np = self.np
+            n = self.count
+            vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode="r", shape=(n, self.dim))
+            sketch = (np.memmap(self._path("sketch.f32"), dtype=np.float32, mode="r", shape=(n, self.sketch_dim))
+                      if self.has_sketch else None)
+            alive = np.memmap(self._path("alive.u8"), dtype=np.uint8, mode="r", shape=(n,))
+            offsets = np.memmap(self._path("offsets.u64"), dtype=np.uint64, mode="r", shape=(n,))
+            self._views = (n, vectors, sketch, alive, offsets)
+        return self._views
+
+    def row(self, row_no: int) -> dict[str, Any]:
+        offsets = self._open_views()[4]
+        with open(self._path("rows.jsonl"), "rb") as f:
+            f.seek(int(offsets[row_no]))
+            return json.loads(f.readline())
+
+    def find(self, key: str) -> Optional[int]:
+        """Номер актуальной строки по chat_hash или id чата."""
+        if self.count == 0:
+            return None
+        with self._lock:
+            self._read_keys()
+            row_no = self._latest.get(key)
+            if row_no is None:
+                row_no = self._by_hash.get(key)
+        if row_no is None or not self._open_views()[3][row_no]:
+            return None
+        return row_no
+
+    def vector(self, row_no: int):
+        return self.np.array(self._open_views()[1][row_no])
+
+    def search(self, query, top: int = 10, exact: bool = False,
+               exclude: Optional[int] = None) -> list[tuple[float, dict[str, Any]]]:
+        """Top-k строк по косинусу к `query`; вытесненные версии чатов не возвращаются."""
+        np = self.np
+        if self.count == 0:
+            return []
+        n, vectors, sketch, alive, _ = self._open_views()
+        query = self._normalize(np.asarray(query, dtype=np.float32))
+        candidates = max(MIN_CANDIDATES, CANDIDATES_PER_RESULT * top)
+        if exact or sketch is None or n <= candidates:
+            rows = np.arange(n)
+            scores = vectors @ query
+        else:
+            approx = sketch @ self._normalize(query @ self.projection())
+            rows = np.sort(np.argpartition(-approx, candidates - 1)[:candidates])
+            scores = vectors[rows] @ query
+        valid = alive[rows].astype(bool)
+        if exclude is not None:
+            valid &= rows != exclude
+        rows, scores = rows[valid], scores[valid]
+        best = np.argsort(-scores)[:top] if len(scores) <= top else np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), self.row(int(rows[i]))) for i in best]
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 📥 Пополнение пачками
+# ────────────────────────────────────────────────────────────────────────────────
+class IndexBuffer:
+    """Копит чаты и считает эмбеддинги пачками по `batch_size`. Потокобезопасен.
+
+    `embed(texts)` возвращает эмбеддинги текстов по порядку. Ошибка
+    эмбеддинга не роняет обработку: пачка пропускается с предупреждением
+    (дозаполнить можно командой `build`).
+    """
+
+    def __init__(self, index: EmbeddingIndex, embed: Callable[[list[str]], list[list[float]]],
+                 batch_size: int = 32):
+        self.index = index
+        self.embed = embed
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending: list[tuple[dict[str, Any], str]] = []
+        self.added = 0
+        self.failed = 0
+
+    def add(self, chat_hash: str, record_id: str, name: str, summary: str, text: str) -> None:
+        if self.index.contains(chat_hash):
+            return
+        row = {"chat_hash": chat_hash, "id": record_id, "name": name, "summary": summary}
+        with self._lock:
+            self._pending.append((row, embed_text(summary, text)))
+            batch = self._take_locked() if len(self._pending) >= self.batch_size else None
+        if batch:
+            self._flush(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch = self._take_locked()
+        if batch:
+            self._flush(batch)
+
+    def close(self) -> None:
+        self.flush()
+
+    def _take_locked(self) -> list[tuple[dict[str, Any], str]]:
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _flush(self, batch: list[tuple[dict[str, Any], str]]) -> None:
+        try:
+            vectors = self.embed([text for _, text in batch])
+            added = self.index.add([row for row, _ in batch], vectors)
+        except Exception as e:  # pylint: disable=broad-except
+            with self._lock:
+                self.failed += len(batch)
+            print(f"⚠️ Эмбеддинги для {len(batch)} чатов не посчитаны: {e}")
+            return
+        with self._lock:
+            self.added += added
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🖥️ CLI
+# ────────────────────────────────────────────────────────────────────────────────
+def build(index: EmbeddingIndex, chat_spec: Path, dataset_root: Path,
+          embed: Callable[[list[str]], list[list[float]]], batch_size: int = 32) -> int:
+    """Дозаполняет индекс чатами экспорта, у которых есть результат в Parquet-датасете."""
+    import pyarrow.compute as pc
+
+    from client_chat_processor import chat_files, compute_text_hash, iter_unique_chats
+    from dataset import latest_versions, read_table
+
+    chats = read_table(dataset_root, "chats")
+    if chats is None:
+        return 0
+    chats, _ = latest_versions(chats)
+    chats = chats.filter(pc.invert(pc.equal(chats["model"], "prefilter")))
+    analyzed = {
+        row["chat_hash"]: row
+        for row in chats.select(["chat_hash", "id", "summary"]).to_pylist()
+        if row["chat_hash"]
+    }
+    buffer = IndexBuffer(index, embed, batch_size)
+    for chat in iter_unique_chats(chat_files(chat_spec), os.cpu_count() or 1):
+        text = "\n".join(chat.messages)
+        found = analyzed.get(compute_text_hash(text))
+        if found is not None:
+            buffer.add(found["chat_hash"], found["id"], chat.name, found["summary"] or "", text)
+    buffer.close()
+    return buffer.added
+
+
+def print_hits(hits: list[tuple[float, dict[str, Any]]]) -> None:
+    if not hits:
+        print("⚠️ Ничего не найдено")
+    for score, row in hits:
+        summary = (row.get("summary") or "").replace("\n", " ")
+        print(f"{score:.3f}  {row.get('name') or '—'}  [{row['id']}]\n       {summary[:160]}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Поиск похожих чатов по эмбеддингам")
+    parser.add_argument("--index", type=Path, default=Path(os.getenv("EMBED_INDEX") or DEFAULT_ROOT))
+    parser.add_argument("--model", default=os.getenv("EMBED_MODEL", DEFAULT_MODEL))
+    parser.add_argument("--host", default=os.getenv("LLM_HOST", "http://localhost:11434"),
+                        help="Ollama для эмбеддинга запроса")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_query = sub.add_parser("query", help="чаты, похожие на текст")
+    p_query.add_argument("text")
+    p_like = sub.add_parser("like", help="чаты, похожие на чат из индекса")
+    p_like.add_argument("key", help="chat_hash или id чата")
+    for p in (p_query, p_like):
+        p.add_argument("--top", type=int, default=10)
+        p.add_argument("--exact", action="store_true", help="точный проход по всей матрице без скетча")
+    p_build = sub.add_parser("build", help="дозаполнить индекс по экспорту и Parquet-датасету")
+    p_build.add_argument("chat_file", type=Path, help="файл экспорта, каталог или glob-маска")
+    p_build.add_argument("--dataset", type=Path, default=Path(os.getenv("RESULTS_DATASET") or "output/dataset"))
+    sub.add_parser("status", help="размер индекса")
+    args = parser.parse_args()
+
+    def embed(texts: list[str]) -> list[list[float]]:
+        return ollama_embed(args.host, args.model, texts, os.getenv("LLM_API_KEY"))
+
+    if args.cmd == "build":
+        index = EmbeddingIndex(args.index, args.model)
+        print(f"🧭 Добавлено в индекс: {build(index, args.chat_file, args.dataset, embed)}, всего {index.count}")
+        return
+
+    index = EmbeddingIndex(args.index, args.model, writable=False)
+    if args.cmd == "status":
+        print(f"🧭 {args.index}: {index.count} строк, модель {index.model}, размерность {index.dim}")
+        return
+    if args.cmd == "query":
+        query = embed([args.text])[0]
+        started = time.perf_counter()
+        hits = index.search(query, args.top, args.exact)
+    else:
+        row_no = index.find(args.key)
+        if row_no is None:
+            print(f"⚠️ Чат {args.key} не найден в индексе")
+            return
+        started = time.perf_counter()
+        hits = index.search(index.vector(row_no), args.top, args.exact, exclude=row_no)
+    elapsed = time.perf_counter() - started
+    print_hits(hits)
+    print(f"⏱️  Поиск по {index.count} строкам: {elapsed * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
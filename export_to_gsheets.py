@@ -1,65 +1,271 @@
 #!/usr/bin/env python3
 """
 Экспорт результатов анализа чатов в Google Sheets.
+
+Выгрузка инкрементальная: локальный манифест (`output/gsheets_manifest.json`)
+помнит, в какой строке листа лежит каждый результат, отпечаток строки и
+mtime/размер файла. При повторном запуске:
+
+* неизменённые файлы не перечитываются;
+* новые результаты дописываются в конец листа;
+* изменившиеся строки обновляются одним `batch_update` по своим диапазонам;
+* большие выгрузки режутся на куски по числу строк и объёму.
+
+Если манифест не совпадает с листом (другая таблица, лист очистили вручную)
+или передан `--full`, лист переписывается целиком.
+
+    python3 export_to_gsheets.py
+    python3 export_to_gsheets.py --full
+    python3 export_to_gsheets.py --fake output/fake_sheet.json   # без сети, см. gsheets_fake.py
 """
 
+import argparse
+import hashlib
 import json
+import os
 from pathlib import Path
-from typing import Any
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from typing import Any, Iterator
 
 SPREADSHEET_ID = "1_cyDMKgax9SRi__VehFUr16p_XSBmO4gEC2Ut04FXY8"
 SHEET_NAME = "Чаты"
 OUTPUT_DIR = Path("output")
+MANIFEST_NAME = "gsheets_manifest.json"
+
+HEADERS = ["chat_name", "created_at", "has_order", "total_sum", "complaint", "summary", "model", "chat_hash"]
+
+# Ограничения одного запроса: Sheets API принимает до ~10 МБ, держимся с запасом
+CHUNK_ROWS = 500
+CHUNK_BYTES = 2_000_000
+
+
+def build_row(file: Path, data: dict) -> list[Any]:
+    result = data.get("result", data)  # fallback если нет поля .result
+    return [
+        Path(data.get("source_file", file.name)).stem,
+        data.get("created_at"),
+        result.get("has_order"),
+        result.get("total_sum"),
+        result.get("complaint"),
+        result.get("summary"),
+        data.get("model", ""),
+        data.get("chat_hash", ""),
+    ]
 
 
 def build_rows_from_results(folder: Path) -> list[list[Any]]:
     rows = []
-    for file in folder.glob("*_analysis.json"):
+    for file in sorted(folder.glob("*_analysis.json")):
         try:
-            data = json.loads(file.read_text(encoding="utf-8"))
-            result = data.get("result", data)  # fallback если нет поля .result
-
-            row = [
-                Path(data.get("source_file", file.name)).stem,
-                data.get("created_at"),
-                result.get("has_order"),
-                result.get("total_sum"),
-                result.get("complaint"),
-                result.get("summary"),
-                data.get("model", ""),
-                data.get("chat_hash", ""),
-            ]
-            rows.append(row)
+            rows.append(build_row(file, json.loads(file.read_text(encoding="utf-8"))))
         except Exception as e:
             print(f"❌ Ошибка чтения {file.name}: {e}")
     return rows
 
 
-def upload_to_google_sheets(rows: list[list[Any]], sheet_name: str, spreadsheet_id: str):
+def row_digest(row: list[Any]) -> str:
+    return hashlib.sha1(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🗂️ Манифест
+class Manifest:
+    """Соответствие «файл результата → строка листа», хранится в JSON."""
+
+    def __init__(self, path: Path, spreadsheet_id: str, sheet_name: str):
+        self.path = path
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.entries: dict[str, dict[str, Any]] = {}
+        self.valid = False
+        if path.exists():
+            state = json.loads(path.read_text(encoding="utf-8"))
+            if (state.get("spreadsheet_id"), state.get("sheet_name"), state.get("headers")) == (
+                spreadsheet_id, sheet_name, HEADERS
+            ):
+                self.entries = state.get("rows", {})
+                self.valid = True
+
+    @property
+    def next_row(self) -> int:
+        return max((e["row"] for e in self.entries.values()), default=1) + 1
+
+    def reset(self) -> None:
+        self.entries = {}
+        self.valid = False
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({
+            "spreadsheet_id": self.spreadsheet_id,
+            "sheet_name": self.sheet_name,
+            "headers": HEADERS,
+            "rows": self.entries,
+        }, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+
+Pending = tuple[str, dict, list[Any]]  # (имя файла, запись манифеста, строка листа)
+
+
+def plan_changes(folder: Path, manifest: Manifest) -> tuple[list[Pending], list[Pending], int]:
+    """Сравнивает файлы результатов с манифестом.
+
+    Возвращает (новые, изменённые, число неизменённых).
+    """
+    new, changed, unchanged = [], [], 0
+    for file in sorted(folder.glob("*_analysis.json")):
+        st = file.stat()
+        entry = manifest.entries.get(file.name)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            unchanged += 1
+            continue
+        try:
+            data = json.loads(file.read_text(encoding="utf-8"))
+            row = build_row(file, data)
+        except Exception as e:
+            print(f"❌ Ошибка чтения {file.name}: {e}")
+            continue
+        digest = row_digest(row)
+        fresh = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "digest": digest}
+        if entry is None:
+            new.append((file.name, fresh, row))
+        elif entry["digest"] != digest:
+            changed.append((file.name, {**fresh, "row": entry["row"]}, row))
+        else:
+            entry.update(mtime_ns=st.st_mtime_ns, size=st.st_size)  # файл переписан тем же содержимым
+            unchanged += 1
+    return new, changed, unchanged
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 📤 Выгрузка
+def chunked(items: list, max_rows: int = CHUNK_ROWS, max_bytes: int = CHUNK_BYTES,
+            size=lambda item: len(json.dumps(item, ensure_ascii=False, default=str))) -> Iterator[list]:
+    """Режет список на куски не длиннее max_rows и не тяжелее max_bytes."""
+    chunk: list = []
+    chunk_bytes = 0
+    for item in items:
+        item_bytes = size(item)
+        if chunk and (len(chunk) >= max_rows or chunk_bytes + item_bytes > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        chunk.append(item)
+        chunk_bytes += item_bytes
+    if chunk:
+        yield chunk
+
+
+def _last_col() -> str:
+    return chr(ord("A") + len(HEADERS) - 1)
+
+
+def _rows_range(start: int, count: int) -> str:
+    return f"A{start}:{_last_col()}{start + count - 1}"
+
+
+def _cell(value: Any) -> Any:
+    return "" if value is None else value
+
+
+def ensure_rows(sheet, last_row: int) -> None:
+    if last_row > sheet.row_count:
+        sheet.add_rows(last_row - sheet.row_count)
+
+
+def open_sheet(spreadsheet_id: str, sheet_name: str):
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+
     print(f"📡 Подключение к Google Sheets...")
     scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
     creds = ServiceAccountCredentials.from_json_keyfile_name("credentials.json", scope)
     client = gspread.authorize(creds)
+    return client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+
 
-    sheet = client.open_by_key(spreadsheet_id).worksheet(sheet_name)
+def upload_to_google_sheets(rows: list[list[Any]], sheet_name: str, spreadsheet_id: str, sheet=None,
+                            max_rows: int = CHUNK_ROWS, max_bytes: int = CHUNK_BYTES):
+    """Полная перезапись листа: заголовок и строки кусками."""
+    sheet = sheet or open_sheet(spreadsheet_id, sheet_name)
     sheet.clear()
+    all_data = [HEADERS] + [[_cell(v) for v in row] for row in rows]
+    ensure_rows(sheet, len(all_data))
+    start = 1
+    for chunk in chunked(all_data, max_rows, max_bytes):
+        # чтобы убрать предупреждение DeprecationWarning
+        sheet.update(values=chunk, range_name=_rows_range(start, len(chunk)))
+        start += len(chunk)
+    print(f"✅ Загружено строк: {len(rows)}")
 
-    headers = ["chat_name", "created_at", "has_order", "total_sum", "complaint", "summary", "model", "chat_hash"]
-    all_data = [headers] + rows
 
-    # чтобы убрать предупреждение DeprecationWarning
-    sheet.update(values=all_data, range_name="A1")
-    print(f"✅ Загружено строк: {len(rows)}")
+def sync_sheet(folder: Path, sheet, manifest: Manifest, full: bool = False,
+               max_rows: int = CHUNK_ROWS, max_bytes: int = CHUNK_BYTES) -> dict[str, int]:
+    """Дописывает новые и обновляет изменённые строки. Манифест сохраняется по ходу."""
+    if manifest.valid and not full:
+        # лист могли очистить или поправить руками — сверяем число строк по первой колонке
+        if len(sheet.col_values(1)) != manifest.next_row - 1:
+            print("⚠️ Лист не совпадает с манифестом — перезаписываем целиком")
+            full = True
+    if full or not manifest.valid:
+        manifest.reset()
+        sheet.clear()
+        ensure_rows(sheet, 1)
+        sheet.update(values=[HEADERS], range_name=_rows_range(1, 1))
+        manifest.valid = True
+        manifest.save()
+
+    new, changed, unchanged = plan_changes(folder, manifest)
+
+    for chunk in chunked(changed, max_rows, max_bytes, size=lambda item: len(json.dumps(item[2], default=str))):
+        sheet.batch_update([
+            {"range": _rows_range(entry["row"], 1), "values": [[_cell(v) for v in row]]}
+            for _, entry, row in chunk
+        ])
+        for name, entry, _ in chunk:
+            manifest.entries[name] = entry
+        manifest.save()
+
+    start = manifest.next_row
+    ensure_rows(sheet, start + len(new) - 1)
+    for chunk in chunked(new, max_rows, max_bytes, size=lambda item: len(json.dumps(item[2], default=str))):
+        sheet.update(values=[[_cell(v) for v in row] for _, _, row in chunk],
+                     range_name=_rows_range(start, len(chunk)))
+        for offset, (name, entry, _) in enumerate(chunk):
+            manifest.entries[name] = {**entry, "row": start + offset}
+        start += len(chunk)
+        manifest.save()
+
+    manifest.save()
+    return {"appended": len(new), "updated": len(changed), "unchanged": unchanged}
 
 
 def main():
-    rows = build_rows_from_results(OUTPUT_DIR)
-    if not rows:
+    parser = argparse.ArgumentParser(description="Инкрементальный экспорт результатов в Google Sheets")
+    parser.add_argument("--output-dir", type=Path, default=OUTPUT_DIR)
+    parser.add_argument("--spreadsheet-id", default=SPREADSHEET_ID)
+    parser.add_argument("--sheet", default=SHEET_NAME)
+    parser.add_argument("--manifest", type=Path, help=f"по умолчанию <output-dir>/{MANIFEST_NAME}")
+    parser.add_argument("--full", action="store_true", help="переписать лист целиком")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--chunk-bytes", type=int, default=CHUNK_BYTES)
+    parser.add_argument("--fake", type=Path, help="писать в JSON-заглушку листа вместо Google Sheets")
+    args = parser.parse_args()
+
+    if not any(args.output_dir.glob("*_analysis.json")):
         print("⚠️ Нет данных для выгрузки.")
         return
-    upload_to_google_sheets(rows, SHEET_NAME, SPREADSHEET_ID)
+
+    if args.fake:
+        from gsheets_fake import FakeWorksheet
+        sheet = FakeWorksheet(args.fake)
+        args.spreadsheet_id = f"fake:{args.fake}"
+    else:
+        sheet = open_sheet(args.spreadsheet_id, args.sheet)
+    manifest = Manifest(args.manifest or args.output_dir / MANIFEST_NAME, args.spreadsheet_id, args.sheet)
+    stats = sync_sheet(args.output_dir, sheet, manifest, full=args.full,
+                       max_rows=args.chunk_rows, max_bytes=args.chunk_bytes)
+    print(f"✅ Добавлено строк: {stats['appended']}, обновлено: {stats['updated']}, без изменений: {stats['unchanged']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+"""
+gsheets_fake.py — заглушка листа gspread для офлайн-прогонов экспорта
+=====================================================================
+Повторяет ту часть API листа, которой пользуется `export_to_gsheets`:
+`update`, `batch_update`, `clear`, `add_rows`, `col_values`, `row_count`.
+Лист хранится в JSON-файле, поэтому повторные прогоны видят прежнее
+содержимое — как с настоящей таблицей. Все вызовы записываются в `calls`.
+
+    python3 export_to_gsheets.py --fake output/fake_sheet.json
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from pathlib import Path
+from typing import Any, Optional
+
+_CELL = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+def _parse_cell(cell: str) -> tuple[int, int]:
+    """'C12' → (строка 12, колонка 3), нумерация с единицы."""
+    m = _CELL.match(cell)
+    if not m:
+        raise ValueError(f"Неподдерживаемый адрес ячейки: {cell}")
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - ord("A") + 1
+    return int(m.group(2)), col
+
+
+class FakeWorksheet:
+    def __init__(self, path: Optional[Path] = None, rows: int = 1000, cols: int = 26):
+        self.path = path
+        self.calls: list[tuple[str, int]] = []
+        self.cells: list[list[Any]] = []
+        self.row_count = rows
+        self.col_count = cols
+        if path is not None and path.exists():
+            state = json.loads(path.read_text(encoding="utf-8"))
+            self.cells = state["cells"]
+            self.row_count = state["row_count"]
+
+    # ── API gspread ────────────────────────────────────────────────────────
+    def update(self, values: list[list[Any]], range_name: str = "A1") -> None:
+        self.calls.append(("update", len(values)))
+        self._write(range_name, values)
+        self._save()
+
+    def batch_update(self, data: list[dict[str, Any]]) -> None:
+        self.calls.append(("batch_update", len(data)))
+        for item in data:
+            self._write(item["range"], item["values"])
+        self._save()
+
+    def clear(self) -> None:
+        self.calls.append(("clear", 0))
+        self.cells = []
+        self._save()
+
+    def add_rows(self, rows: int) -> None:
+        self.calls.append(("add_rows", rows))
+        self.row_count += rows
+        self._save()
+
+    def col_values(self, col: int) -> list[Any]:
+        self.calls.append(("col_values", col))
+        values = [row[col - 1] if len(row) >= col else "" for row in self.cells]
+        while values and values[-1] in ("", None):
+            values.pop()
+        return values
+
+    # ── внутреннее ─────────────────────────────────────────────────────────
+    def _write(self, range_name: str, values: list[list[Any]]) -> None:
+        row, col = _parse_cell(range_name.split(":", 1)[0])
+        if row + len(values) - 1 > self.row_count:
+            raise ValueError(f"Диапазон {range_name} выходит за пределы листа ({self.row_count} строк)")
+        for i, values_row in enumerate(values):
+            r = row - 1 + i
+            while len(self.cells) <= r:
+                self.cells.append([])
+            target = self.cells[r]
+            while len(target) < col - 1 + len(values_row):
+                target.append("")
+            target[col - 1:col - 1 + len(values_row)] = ["" if v is None else v for v in values_row]
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps({"row_count": self.row_count, "cells": self.cells}, ensure_ascii=False),
+                       encoding="utf-8")
+        os.replace(tmp, self.path)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+history_store.py — индексированная история обработанных чатов
+=============================================================
+Вместо перечитывания `history.jsonl` при каждом старте история лежит в
+SQLite с индексом по ключу `(chat_hash, model, prompt_version)`:
+
+* проверка «чат уже обработан» — один запрос по индексу;
+* записи копятся в памяти и пишутся пачками в одной транзакции;
+* `compact()` выкидывает дубликаты и неудачные попытки, перекрытые успехом;
+* существующий `history.jsonl` импортируется один раз при первом открытии;
+* для каждого чата хранится «водяной знак» — последнее проанализированное
+  сообщение и результат, чтобы при следующем прогоне отправлять только новое.
+
+    python3 history_store.py compact [output/history.sqlite]
+    python3 history_store.py import output/history.jsonl [output/history.sqlite]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+DEFAULT_PATH = Path("output/history.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_hash      TEXT NOT NULL,
+    model          TEXT NOT NULL DEFAULT '',
+    prompt_version TEXT NOT NULL DEFAULT '',
+    success        INTEGER NOT NULL,
+    timestamp      TEXT,
+    chat_file      TEXT,
+    output         TEXT,
+    host           TEXT,
+    error          TEXT
+);
+CREATE INDEX IF NOT EXISTS history_key
+    ON history (chat_hash, model, prompt_version, success);
+CREATE TABLE IF NOT EXISTS watermarks (
+    chat_key        TEXT PRIMARY KEY,
+    last_message_id INTEGER,
+    last_date       TEXT,
+    record_id       TEXT,
+    output          TEXT,
+    result_json     TEXT,
+    model           TEXT,
+    prompt_version  TEXT,
+    updated_at      TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLUMNS = ("chat_hash", "model", "prompt_version", "success", "timestamp", "chat_file", "output", "host", "error")
+
+
+class HistoryStore:
+    """История обработки с пакетной записью. Потокобезопасна."""
+
+    def __init__(self, path: Path = DEFAULT_PATH, batch_size: int = 50):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending: list[tuple] = []
+        self._pending_keys: set[tuple[str, str, str]] = set()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    # ── чтение ─────────────────────────────────────────────────────────────
+    def contains(self, chat_hash: str, model: str, prompt_version: str) -> bool:
+        """Есть ли успешная запись для этого чата, модели и версии промпта."""
+        key = (chat_hash, model, prompt_version)
+        with self._lock:
+            if key in self._pending_keys:
+                return True
+            row = self._conn.execute(
+                "SELECT 1 FROM history WHERE chat_hash=? AND model=? AND prompt_version=? AND success=1 LIMIT 1",
+                key,
+            ).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM history").fetchone()
+            return count + len(self._pending)
+
+    # ── запись ─────────────────────────────────────────────────────────────
+    def append(self, entry: dict, prompt_version: str = "") -> None:
+        """Добавляет запись (формат как в history.jsonl). Пишется пачкой."""
+        row = _entry_to_row(entry, prompt_version)
+        if row is None:
+            return
+        with self._lock:
+            self._pending.append(row)
+            if row[3]:
+                self._pending_keys.add(row[:3])
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self._pending:
+            return
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT INTO history ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                self._pending,
+            )
+        self._pending.clear()
+        self._pending_keys.clear()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "HistoryStore":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    # ── водяные знаки ──────────────────────────────────────────────────────
+    def get_watermark(self, chat_key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_message_id, last_date, record_id, output, result_json, model, prompt_version "
+                "FROM watermarks WHERE chat_key=?",
+                (chat_key,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            "last_message_id": row[0],
+            "last_date": row[1],
+            "record_id": row[2],
+            "output": row[3],
+            "result": json.loads(row[4]) if row[4] else {},
+            "model": row[5],
+            "prompt_version": row[6],
+        }
+
+    def set_watermark(self, chat_key: str, *, last_message_id: Optional[int], last_date: Optional[str],
+                      record_id: str, output: str, result: dict, model: str, prompt_version: str,
+                      updated_at: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO watermarks (chat_key, last_message_id, last_date, record_id, output, "
+                "result_json, model, prompt_version, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat_key, last_message_id, last_date, record_id, output,
+                 json.dumps(result, ensure_ascii=False), model, prompt_version, updated_at),
+            )
+
+    # ── обслуживание ───────────────────────────────────────────────────────
+    def compact(self) -> int:
+        """Удаляет дубликаты успешных записей и неудачи, перекрытые успехом.
+
+        Для каждого ключа остаётся последняя успешная запись; если успеха не
+        было — последняя неудачная. Возвращает число удалённых строк.
+        """
+        self.flush()
+        with self._lock:
+            with self._conn:
+                cur = self._conn.execute(
+                    """
+                    DELETE FROM history WHERE id NOT IN (
+                        SELECT COALESCE(
+                            MAX(CASE WHEN success=1 THEN id END),
+                            MAX(id)
+                        )
+                        FROM history
+                        GROUP BY chat_hash, model, prompt_version
+                    )
+                    """
+                )
+                removed = cur.rowcount
+            self._conn.execute("VACUUM")
+        return removed
+
+    def import_jsonl(self, path: Path, default_prompt_version: str = "") -> int:
+        """Импортирует старый history.jsonl. Записи без `chat_hash` пропускаются."""
+        rows = []
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                row = _entry_to_row(entry, entry.get("prompt_version", default_prompt_version))
+                if row is not None:
+                    rows.append(row)
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO history ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                rows,
+            )
+        return len(rows)
+
+    def import_legacy_once(self, path: Path, default_prompt_version: str = "") -> Optional[int]:
+        """Одноразовый импорт history.jsonl; повторные вызовы ничего не делают."""
+        marker = f"imported:{path.resolve()}"
+        with self._lock:
+            done = self._conn.execute("SELECT 1 FROM meta WHERE key=?", (marker,)).fetchone()
+        if done or not path.exists():
+            return None
+        count = self.import_jsonl(path, default_prompt_version)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (marker, str(count)))
+        return count
+
+
+def _entry_to_row(entry: dict, prompt_version: str) -> Optional[tuple]:
+    chat_hash = entry.get("chat_hash")
+    if not chat_hash:
+        return None
+    return (
+        chat_hash,
+        entry.get("model") or "",
+        prompt_version or "",
+        1 if entry.get("success") else 0,
+        entry.get("timestamp"),
+        entry.get("chat_file"),
+        entry.get("output"),
+        entry.get("host"),
+        entry.get("error"),
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Обслуживание истории обработанных чатов")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_compact = sub.add_parser("compact", help="удалить дубликаты и перекрытые ошибки")
+    p_compact.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    p_import = sub.add_parser("import", help="импортировать history.jsonl")
+    p_import.add_argument("jsonl", type=Path)
+    p_import.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    p_import.add_argument("--prompt-version", default="")
+    args = parser.parse_args()
+
+    with HistoryStore(args.db) as store:
+        if args.cmd == "compact":
+            print(f"🧹 Удалено записей: {store.compact()}")
+        else:
+            print(f"📥 Импортировано записей: {store.import_jsonl(args.jsonl, args.prompt_version)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+job_queue.py — персистентная очередь чатов с арендой
+=====================================================
+Чаты из экспорта кладутся в SQLite-очередь, а один или несколько
+процессов-обработчиков забирают их с арендой (lease):
+
+* `claim()` атомарно (BEGIN IMMEDIATE) берёт готовую задачу и помечает её
+  арендованной на `lease_seconds`; фоновый heartbeat продлевает аренду,
+  пока чат обрабатывается;
+* аренда упавшего или убитого процесса истекает, и задачу забирает другой;
+  такой перехват тоже считается попыткой;
+* при ошибке задача возвращается с экспоненциальной задержкой, после
+  `max_attempts` попыток получает статус `dead`;
+* при Ctrl-C свои задачи отпускаются сразу, без штрафа;
+* повторный `enqueue` того же экспорта ничего не меняет, а изменившийся
+  чат (другой `chat_hash`) снова становится в очередь.
+
+Задача хранит чат целиком, поэтому обработчикам не нужен файл экспорта.
+Файл очереди можно делить между процессами одной машины; для нескольких
+машин — общий диск с рабочими блокировками файлов (не NFS).
+
+    python3 job_queue.py enqueue data/chat.json [output/jobs.sqlite]   # или каталог/маска экспортов
+    python3 job_queue.py status [output/jobs.sqlite]
+    python3 job_queue.py retry-dead [output/jobs.sqlite]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterable, Iterator, Optional
+
+DEFAULT_PATH = Path("output/jobs.sqlite")
+
+PENDING, LEASED, DONE, DEAD = "pending", "leased", "done", "dead"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    chat_key     TEXT PRIMARY KEY,
+    idx          INTEGER NOT NULL,
+    chat_hash    TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    status       TEXT NOT NULL DEFAULT 'pending',
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner  TEXT,
+    lease_until  REAL,
+    last_error   TEXT,
+    updated_at   REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at, idx);
+"""
+
+
+def make_owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class JobQueue:
+    """Очередь задач в SQLite. Потокобезопасна; несколько процессов — через блокировки SQLite."""
+
+    def __init__(self, path: Path = DEFAULT_PATH, lease_seconds: float = 600.0, max_attempts: int = 5,
+                 backoff_base: float = 30.0, backoff_max: float = 3600.0):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+        # isolation_level=None — транзакции открываем сами (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Пишущая транзакция: BEGIN IMMEDIATE сразу берёт блокировку файла у других процессов."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                # COMMIT мог пройти до прерывания (Ctrl-C) — откатывать уже нечего
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _write(self, sql: str, params: Iterable[Any] = ()) -> sqlite3.Cursor:
+        with self._transaction() as conn:
+            return conn.execute(sql, tuple(params))
+
+    # ── постановка ─────────────────────────────────────────────────────────
+    def enqueue(self, jobs: Iterable[tuple[str, int, str, dict]], batch_size: int = 500) -> int:
+        """Ставит задачи `(chat_key, idx, chat_hash, payload)`. Возвращает число новых/обновлённых."""
+        changed = 0
+        batch: list[tuple] = []
+
+        def flush() -> None:
+            nonlocal changed
+            with self._transaction() as conn:
+                before = conn.total_changes
+                conn.executemany(
+                    """
+                    INSERT INTO jobs (chat_key, idx, chat_hash, payload, updated_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (chat_key) DO UPDATE SET
+                        idx=excluded.idx, chat_hash=excluded.chat_hash, payload=excluded.payload,
+                        status='pending', attempts=0, available_at=0, last_error=NULL,
+                        updated_at=excluded.updated_at
+                    WHERE jobs.chat_hash != excluded.chat_hash AND jobs.status != 'leased'
+                    """,
+                    batch,
+                )
+                changed += conn.total_changes - before
+            batch.clear()
+
+        for chat_key, idx, chat_hash, payload in jobs:
+            batch.append((chat_key, idx, chat_hash, json.dumps(payload, ensure_ascii=False), time.time()))
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return changed
+
+    # ── обработка ──────────────────────────────────────────────────────────
+    def claim(self, owner: str) -> Optional[tuple[str, int, dict]]:
+        """Берёт готовую задачу в аренду: `(chat_key, idx, payload)` или None.
+
+        Перехват истёкшей аренды считается попыткой: чат, на котором раз за
+        разом падает обработчик, после `max_attempts` получает статус `dead`.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            while True:
+                row = conn.execute(
+                    """
+                    SELECT chat_key, idx, payload, status, attempts, lease_owner FROM jobs
+                    WHERE (status='pending' AND available_at<=?) OR (status='leased' AND lease_until<?)
+                    ORDER BY idx LIMIT 1
+                    """,
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                chat_key, idx, payload, status, attempts, previous_owner = row
+                if status == LEASED:
+                    attempts += 1
+                    if attempts >= self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET status='dead', attempts=?, last_error=?, lease_owner=NULL, "
+                            "lease_until=NULL, updated_at=? WHERE chat_key=?",
+                            (attempts, f"аренда истекла: обработчик {previous_owner} не завершил задачу",
+                             now, chat_key),
+                        )
+                        continue
+                conn.execute(
+                    "UPDATE jobs SET status='leased', attempts=?, lease_owner=?, lease_until=?, updated_at=? "
+                    "WHERE chat_key=?",
+                    (attempts, owner, now + self.lease_seconds, now, chat_key),
+                )
+                return chat_key, idx, json.loads(payload)
+
+    def complete(self, chat_key: str, owner: str) -> None:
+        self._write(
+            "UPDATE jobs SET status='done', lease_owner=NULL, lease_until=NULL, last_error=NULL, updated_at=? "
+            "WHERE chat_key=? AND lease_owner=?",
+            (time.time(), chat_key, owner),
+        )
+
+    def fail(self, chat_key: str, owner: str, error: str) -> str:
+        """Отмечает неудачу: задача вернётся после задержки или станет `dead`. Возвращает новый статус."""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE chat_key=?", (chat_key,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        status = DEAD if attempts >= self.max_attempts else PENDING
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (attempts - 1)) * random.uniform(0.8, 1.2)
+        self._write(
+            "UPDATE jobs SET status=?, attempts=?, available_at=?, last_error=?, lease_owner=NULL, "
+            "lease_until=NULL, updated_at=? WHERE chat_key=? AND lease_owner=?",
+            (status, attempts, time.time() + delay, error[:2000], time.time(), chat_key, owner),
+        )
+        return status
+
+    def release(self, owner: str) -> int:
+        """Отпускает все задачи владельца без штрафа (остановка процесса)."""
+        cur = self._write(
+            "UPDATE jobs SET status='pending', lease_owner=NULL, lease_until=NULL, updated_at=? "
+            "WHERE status='leased' AND lease_owner=?",
+            (time.time(), owner),
+        )
+        return cur.rowcount
+
+    def next_wakeup(self) -> Optional[float]:
+        """Через сколько секунд может появиться задача; None — ждать нечего, очередь пройдена."""
+        now = time.time()
+        with self._lock:
+            (nearest,) = self._conn.execute(
+                "SELECT MIN(CASE status WHEN 'pending' THEN available_at ELSE lease_until END) "
+                "FROM jobs WHERE status IN ('pending', 'leased')"
+            ).fetchone()
+        return None if nearest is None else max(0.0, nearest - now)
+
+    # ── аренда ─────────────────────────────────────────────────────────────
+    def start_heartbeat(self, owner: str) -> None:
+        """Фоном продлевает аренду задач владельца каждые lease_seconds / 3."""
+        if self._heartbeat is not None:
+            return
+
+        def loop() -> None:
+            while not self._stop.wait(self.lease_seconds / 3):
+                try:
+                    self._write(
+                        "UPDATE jobs SET lease_until=? WHERE status='leased' AND lease_owner=?",
+                        (time.time() + self.lease_seconds, owner),
+                    )
+                except sqlite3.Error as e:
+                    print(f"⚠️ Не удалось продлить аренду задач: {e}")
+
+        self._heartbeat = threading.Thread(target=loop, name="job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    # ── обслуживание ───────────────────────────────────────────────────────
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {PENDING: 0, LEASED: 0, DONE: 0, DEAD: 0, **dict(rows)}
+
+    def retry_dead(self) -> int:
+        cur = self._write(
+            "UPDATE jobs SET status='pending', attempts=0, available_at=0, updated_at=? WHERE status='dead'",
+            (time.time(),),
+        )
+        return cur.rowcount
+
+    def dead(self, limit: int = 20) -> list[tuple[str, int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT chat_key, attempts, last_error FROM jobs WHERE status='dead' ORDER BY updated_at DESC LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "JobQueue":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+def main() -> None:
+    from client_chat_processor import chat_files, chat_job, iter_unique_chats
+
+    parser = argparse.ArgumentParser(description="Очередь чатов для обработчиков")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_enqueue = sub.add_parser("enqueue", help="поставить чаты экспорта в очередь")
+    p_enqueue.add_argument("chat_file", type=Path, help="файл экспорта, каталог или glob-маска")
+    p_enqueue.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    p_status = sub.add_parser("status", help="сколько задач в каждом статусе")
+    p_status.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    p_retry = sub.add_parser("retry-dead", help="вернуть в очередь задачи со статусом dead")
+    p_retry.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    with JobQueue(args.db) as queue:
+        if args.cmd == "enqueue":
+            chats = iter_unique_chats(chat_files(args.chat_file), os.cpu_count() or 1)
+            jobs = (chat_job(idx, chat) for idx, chat in enumerate(chats, 1))
+            print(f"📥 Поставлено в очередь: {queue.enqueue(jobs)}")
+        elif args.cmd == "retry-dead":
+            print(f"🔁 Возвращено в очередь: {queue.retry_dead()}")
+        else:
+            counts = queue.counts()
+            print("📋 " + ", ".join(f"{status}: {count}" for status, count in counts.items()))
+            for chat_key, attempts, error in queue.dead():
+                print(f"   💀 {chat_key} ({attempts} попыток): {error}")
+
+
+if __name__ == "__main__":
+    main()
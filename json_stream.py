@@ -0,0 +1,65 @@
+"""
+json_stream.py — поиск JSON-объекта в потоке токенов
+====================================================
+Модель отдаёт ответ кусками по несколько символов. `JsonObjectScanner`
+следит за балансом скобок (с учётом строк и экранирования) и сообщает,
+когда верхнеуровневый объект закрылся и разбирается как JSON, — после
+этого поток можно закрывать, не дожидаясь пояснений модели.
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Optional
+
+
+class JsonObjectScanner:
+    """Инкрементальный сканер первого корректного JSON-объекта в тексте."""
+
+    def __init__(self) -> None:
+        self.text = ""
+        self.result: Optional[dict[str, Any]] = None
+        self._pos = 0
+        self._start: Optional[int] = None
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> Optional[dict[str, Any]]:
+        """Добавляет кусок ответа. Возвращает объект, как только он завершён."""
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._start is None:
+                if ch == "{":
+                    self._start, self._depth = i, 1
+                continue
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = text[self._start:i + 1]
+                    self._start = None
+                    try:
+                        parsed = json.loads(candidate)
+                    except json.JSONDecodeError:
+                        continue  # скобки в прозе — ищем следующий объект
+                    if isinstance(parsed, dict):
+                        self._pos = i + 1
+                        self.result = parsed
+                        return parsed
+        self._pos = len(text)
+        return None
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+llm_cache.py — кэш ответов LLM по содержимому запроса
+=====================================================
+Ключ — sha256 от (модель, полный промпт, параметры генерации), поэтому
+повторный прогон после падения, правки `fix_keys` или экспорта не платит
+за уже полученные ответы. Хранится сырой ответ и разобранный JSON.
+
+Вытеснение LRU: по числу записей (`LLM_CACHE_MAX_ENTRIES`) и возрасту
+(`LLM_CACHE_MAX_AGE_DAYS`). Режимы `LLM_CACHE`: `on` — читать и писать,
+`refresh` — не читать, но записывать свежие ответы, `off` — не трогать кэш.
+
+    python3 llm_cache.py stats [output/llm_cache.sqlite]
+    python3 llm_cache.py evict [output/llm_cache.sqlite]
+    python3 llm_cache.py clear [output/llm_cache.sqlite]
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+DEFAULT_PATH = Path("output/llm_cache.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key         TEXT PRIMARY KEY,
+    model       TEXT,
+    response    TEXT NOT NULL,
+    parsed      TEXT,
+    created_at  REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS llm_cache_lru ON llm_cache (last_access);
+"""
+
+
+def cache_key(model: str, prompt: str, options: Optional[dict] = None) -> str:
+    payload = json.dumps({"model": model, "prompt": prompt, "options": options or {}},
+                         ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Потокобезопасный LRU-кэш в SQLite."""
+
+    def __init__(self, path: Path = DEFAULT_PATH, mode: str = "on",
+                 max_entries: int = 200_000, max_age_days: float = 90, evict_every: int = 500):
+        if mode not in ("on", "off", "refresh"):
+            raise ValueError(f"Неизвестный режим LLM_CACHE: {mode}")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if mode != "off":
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def get(self, key: str) -> Optional[dict[str, Any]]:
+        """`{"response", "parsed"}` или None. В режимах off/refresh всегда промах."""
+        with self._lock:
+            if self.mode != "on" or self._conn is None:
+                self.misses += 1
+                return None
+            row = self._conn.execute("SELECT response, parsed FROM llm_cache WHERE key=?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self._conn:
+                self._conn.execute("UPDATE llm_cache SET last_access=? WHERE key=?", (time.time(), key))
+        response, parsed = row
+        return {"response": response, "parsed": json.loads(parsed) if parsed else None}
+
+    def put(self, key: str, model: str, response: str, parsed: Any = None) -> None:
+        if self._conn is None:
+            return
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO llm_cache (key, model, response, parsed, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, response, json.dumps(parsed, ensure_ascii=False) if parsed is not None else None,
+                     now, now),
+                )
+            self._puts += 1
+            if self._puts % self.evict_every == 0:
+                self._evict_locked()
+
+    def evict(self) -> int:
+        """Удаляет записи старше max_age_days и самые давно использованные сверх max_entries."""
+        if self._conn is None:
+            return 0
+        with self._lock:
+            return self._evict_locked()
+
+    def _evict_locked(self) -> int:
+        removed = 0
+        with self._conn:
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM llm_cache WHERE last_access < ?", (cutoff,)).rowcount
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+            if self.max_entries and count > self.max_entries:
+                removed += self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                ).rowcount
+        return removed
+
+    def clear(self) -> None:
+        if self._conn is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict[str, Any]:
+        entries = 0
+        if self._conn is not None:
+            with self._lock:
+                (entries,) = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "entries": entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Кэш ответов LLM")
+    parser.add_argument("cmd", choices=["stats", "clear", "evict"])
+    parser.add_argument("db", nargs="?", type=Path, default=DEFAULT_PATH)
+    args = parser.parse_args()
+
+    cache = LLMCache(args.db)
+    if args.cmd == "clear":
+        cache.clear()
+        print("🧹 Кэш очищен")
+    elif args.cmd == "evict":
+        print(f"🧹 Удалено записей: {cache.evict()}")
+    else:
+        print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+metrics.py — замеры этапов конвейера
+====================================
+Лёгкая инструментовка без внешних зависимостей:
+
+* `metrics.span("stage")` — замер этапа; событие пишется в JSONL вместе
+  с ключом текущего чата (`metrics.bind(chat_key)` действует в потоке);
+* `metrics.observe_llm(stats, prompt_chars)` — счётчики Ollama
+  (`prompt_eval_duration`, `eval_duration`, `eval_count`) и размер промпта;
+* в конце прогона — Prometheus textfile и сводная таблица по этапам.
+
+По умолчанию замеры копятся только в памяти; файлы включаются `configure()`.
+Память ограничена: на этап хранятся счётчики и выборка из `RESERVOIR_SIZE`
+длительностей, сколько бы чатов ни было в экспорте.
+"""
+from __future__ import annotations
+
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+from chunking import CHARS_PER_TOKEN
+
+PROM_PREFIX = "chat_pipeline"
+
+# Сколько длительностей этапа храним для p50/p95: память не растёт с числом чатов
+RESERVOIR_SIZE = 2048
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round((len(ordered) - 1) * q)))]
+
+
+class StageStats:
+    """Длительности одного этапа: точные count/total/max и равномерная выборка для перцентилей.
+
+    Выборка — reservoir sampling (алгоритм R): пока замеров не больше
+    `size`, хранятся все; дальше каждый новый замер заменяет случайный
+    с вероятностью size / count, так что выборка остаётся равномерной.
+    """
+
+    __slots__ = ("count", "total", "max", "sample", "size", "_rng")
+
+    def __init__(self, size: int = RESERVOIR_SIZE, seed: int = 0):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample: list[float] = []
+        self.size = size
+        self._rng = random.Random(seed)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.sample) < self.size:
+            self.sample.append(seconds)
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < self.size:
+                self.sample[slot] = seconds
+
+
+class Metrics:
+    """Потокобезопасный сборщик длительностей этапов и счётчиков."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stages: dict[str, StageStats] = defaultdict(StageStats)
+        self._counters: dict[str, float] = defaultdict(float)
+        self._jsonl = None
+        self._prom_path: Optional[Path] = None
+        self._prom_interval = 15.0
+        self._prom_written = 0.0
+        self._prom_lock = threading.Lock()
+
+    def configure(self, jsonl_path: Optional[Path] = None, prom_path: Optional[Path] = None,
+                  prom_interval: float = 15.0) -> None:
+        with self._lock:
+            if jsonl_path is not None:
+                jsonl_path.parent.mkdir(parents=True, exist_ok=True)
+                self._jsonl = jsonl_path.open("a", encoding="utf-8")
+            self._prom_path = prom_path
+            self._prom_interval = prom_interval
+
+    # ── контекст чата ──────────────────────────────────────────────────────
+    @property
+    def current_chat(self) -> Optional[str]:
+        return getattr(self._local, "chat", None)
+
+    @contextmanager
+    def bind(self, chat: Optional[str]) -> Iterator[None]:
+        previous = self.current_chat
+        self._local.chat = chat
+        try:
+            yield
+        finally:
+            self._local.chat = previous
+
+    # ── запись ─────────────────────────────────────────────────────────────
+    @contextmanager
+    def span(self, stage: str, **extra: Any) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started, **extra)
+
+    def observe(self, stage: str, seconds: float, **extra: Any) -> None:
+        event = {"ts": round(time.time(), 3), "stage": stage, "chat": self.current_chat,
+                 "seconds": round(seconds, 6), **extra}
+        with self._lock:
+            self._stages[stage].add(seconds)
+            self._emit(event)
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def observe_llm(self, stats: dict[str, Any], prompt_chars: int) -> None:
+        """Счётчики одного запроса к Ollama и размер промпта."""
+        prompt_tokens = stats.get("prompt_eval_count")
+        event: dict[str, Any] = {
+            "ts": round(time.time(), 3),
+            "stage": "ollama",
+            "chat": self.current_chat,
+            "prompt_chars": prompt_chars,
+            # без prompt_eval_count (ответ из кэша, ранняя остановка) — оценка по символам
+            "prompt_tokens": prompt_tokens if prompt_tokens is not None else prompt_chars // CHARS_PER_TOKEN,
+            "prompt_tokens_estimated": prompt_tokens is None,
+        }
+        for key in ("prompt_eval_duration", "eval_duration", "eval_count", "load_duration", "total_duration"):
+            if key in stats:
+                event[key] = stats[key]
+        with self._lock:
+            self._counters["llm_requests"] += 1
+            self._counters["prompt_chars"] += prompt_chars
+            self._counters["prompt_tokens"] += event["prompt_tokens"]
+            self._counters["eval_tokens"] += stats.get("eval_count") or 0
+            for key, stage in (("prompt_eval_duration", "ollama_prompt_eval"), ("eval_duration", "ollama_eval")):
+                if stats.get(key):
+                    self._stages[stage].add(stats[key] / 1e9)
+            self._emit(event)
+
+    def _emit(self, event: dict[str, Any]) -> None:
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+    # ── вывод ──────────────────────────────────────────────────────────────
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            stages = {
+                stage: {
+                    "count": st.count,
+                    "total": st.total,
+                    "p50": _percentile(st.sample, 0.50),
+                    "p95": _percentile(st.sample, 0.95),
+                    "max": st.max,
+                }
+                for stage, st in self._stages.items()
+            }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def prometheus_text(self) -> str:
+        snap = self.snapshot()
+        lines = [
+            f"# HELP {PROM_PREFIX}_stage_seconds Время этапов конвейера анализа чатов",
+            f"# TYPE {PROM_PREFIX}_stage_seconds summary",
+        ]
+        for stage, row in sorted(snap["stages"].items()):
+            lines.append(f'{PROM_PREFIX}_stage_seconds{{stage="{stage}",quantile="0.5"}} {row["p50"]:.6f}')
+            lines.append(f'{PROM_PREFIX}_stage_seconds{{stage="{stage}",quantile="0.95"}} {row["p95"]:.6f}')
+            lines.append(f'{PROM_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {row["total"]:.6f}')
+            lines.append(f'{PROM_PREFIX}_stage_seconds_count{{stage="{stage}"}} {row["count"]}')
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"# TYPE {PROM_PREFIX}_{name}_total counter")
+            lines.append(f"{PROM_PREFIX}_{name}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, force: bool = True) -> None:
+        """Атомарно переписывает textfile (не чаще prom_interval, если не force)."""
+        if self._prom_path is None:
+            return
+        with self._prom_lock:
+            now = time.monotonic()
+            if not force and now - self._prom_written < self._prom_interval:
+                return
+            self._prom_written = now
+            self._prom_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self._prom_path.with_suffix(self._prom_path.suffix + ".tmp")
+            tmp.write_text(self.prometheus_text(), encoding="utf-8")
+            os.replace(tmp, self._prom_path)
+
+    def summary_table(self) -> str:
+        snap = self.snapshot()
+        rows = sorted(snap["stages"].items(), key=lambda item: -item[1]["total"])
+        header = f"{'этап':<22}{'раз':>8}{'всего, с':>12}{'p50, с':>10}{'p95, с':>10}{'max, с':>10}"
+        lines = [header, "─" * len(header)]
+        for stage, row in rows:
+            lines.append(
+                f"{stage:<22}{row['count']:>8}{row['total']:>12.2f}"
+                f"{row['p50']:>10.3f}{row['p95']:>10.3f}{row['max']:>10.3f}"
+            )
+        counters = snap["counters"]
+        if counters.get("llm_requests"):
+            lines.append("─" * len(header))
+            lines.append(
+                f"запросов к LLM: {counters['llm_requests']:g}, символов промпта: {counters['prompt_chars']:g}, "
+                f"токенов промпта: {counters['prompt_tokens']:g}, токенов ответа: {counters['eval_tokens']:g}"
+            )
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        self.write_prometheus()
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+
+metrics = Metrics()
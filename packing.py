@@ -0,0 +1,112 @@
+"""
+packing.py — упаковка коротких чатов в один запрос к LLM
+========================================================
+У короткого чата большая часть промпта — системная инструкция, а время
+уходит на накладные расходы запроса. `ChatPacker` собирает несколько
+коротких чатов из разных рабочих потоков в одну «пачку» до бюджета
+символов и отправляет её одним запросом:
+
+* поток, заполнивший пачку (по бюджету или числу чатов), сам её отправляет;
+* если пачка не набралась за `linger` секунд, её отправляет самый долго
+  ждущий поток — чаты не зависают в ожидании соседей;
+* каждый поток получает результат своего чата или None, если модель его
+  не вернула (тогда чат обрабатывается отдельным запросом).
+"""
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+# (разобранный результат, бэкенд) или None — результата для чата нет
+PackResult = Optional[tuple[dict[str, Any], str]]
+
+
+@dataclass
+class PackItem:
+    text: str
+    cost: int
+    done: threading.Event = field(default_factory=threading.Event)
+    result: PackResult = None
+
+
+@dataclass
+class Pack:
+    items: list[PackItem] = field(default_factory=list)
+    cost: int = 0
+    closed: bool = False
+
+
+class ChatPacker:
+    """Собирает тексты чатов в пачки и раздаёт ответы обратно.
+
+    `send(texts)` получает тексты пачки по порядку и возвращает
+    `(результаты по номеру чата в пачке, бэкенд)`; номера — с 1.
+    """
+
+    def __init__(self, send: Callable[[list[str]], tuple[dict[int, dict[str, Any]], str]],
+                 max_chars: int, max_chats: int, linger: float = 0.5, result_chars: int = 0):
+        self.send = send
+        self.max_chars = max_chars
+        self.max_chats = max_chats
+        self.linger = linger
+        # место под ответ одного чата: выход пачки растёт вместе с ней
+        self.result_chars = result_chars
+        self._lock = threading.Lock()
+        self._open = Pack()
+        self.packs_sent = 0
+        self.chats_sent = 0
+
+    def fits(self, text: str) -> bool:
+        return len(text) + self.result_chars <= self.max_chars
+
+    def analyze(self, text: str) -> PackResult:
+        """Ставит чат в пачку и ждёт его результат."""
+        item = PackItem(text, len(text) + self.result_chars)
+        ready: list[Pack] = []
+        with self._lock:
+            pack = self._open
+            if pack.items and pack.cost + item.cost > self.max_chars:
+                ready.append(self._close_locked())
+                pack = self._open
+            pack.items.append(item)
+            pack.cost += item.cost
+            if len(pack.items) >= self.max_chats:
+                ready.append(self._close_locked())
+        for full in ready:
+            self._send(full)
+
+        if not item.done.wait(self.linger):
+            with self._lock:
+                stale = self._close_locked() if pack is self._open and not pack.closed else None
+            if stale is not None:
+                self._send(stale)
+        item.done.wait()
+        return item.result
+
+    def flush(self) -> None:
+        with self._lock:
+            pack = self._close_locked() if self._open.items else None
+        if pack is not None:
+            self._send(pack)
+
+    def _close_locked(self) -> Pack:
+        pack = self._open
+        pack.closed = True
+        self._open = Pack()
+        return pack
+
+    def _send(self, pack: Pack) -> None:
+        try:
+            results, host = self.send([item.text for item in pack.items])
+            for n, item in enumerate(pack.items, 1):
+                parsed = results.get(n)
+                item.result = (parsed, host) if parsed is not None else None
+        except Exception as e:  # pylint: disable=broad-except
+            print(f"⚠️ Пачка из {len(pack.items)} чатов не обработана, чаты уйдут по одному: {e}")
+        finally:
+            with self._lock:
+                self.packs_sent += 1
+                self.chats_sent += len(pack.items)
+            for item in pack.items:
+                item.done.set()
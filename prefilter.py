@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+prefilter.py — дешёвый отсев некоммерческих чатов до LLM
+========================================================
+Перед `prepare_prompt` чат оценивается скомпилированными регулярками:
+цены, размеры («160мм», «20×30»), материалы (PLA, PETG, смола…), слова
+заказа/оплаты/доставки и жалоб. Плюс минимальное число сообщений и баланс
+собеседников: чат, где пишет только одна сторона (рассылка, спам,
+оставшийся без ответа вопрос), получает половину баллов.
+
+Чаты ниже порога получают детерминированный результат `has_order: false`
+без вызова модели. Отключается `PREFILTER=0`.
+
+    python3 prefilter.py data/chat.json [--min-score 2] [--show-skipped 20]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+
+# Меняется при изменении правил: прежние решения предфильтра пересматриваются
+PREFILTER_VERSION = "1"
+PREFILTER_MODEL = "prefilter"
+
+_FLAGS = re.IGNORECASE | re.UNICODE
+
+# (признак, вес, регулярка)
+FEATURES: list[tuple[str, float, re.Pattern]] = [
+    ("price", 2.0, re.compile(
+        r"\d[\d\s  .,]*\s*(?:₽|руб|р\.|р\b|rub|\$|usd|€|eur|грн|тыс)"
+        r"|\b(?:цен[аыу]|стоимост|сколько стоит|прайс|бюджет)", _FLAGS)),
+    ("size", 1.5, re.compile(
+        r"\d+(?:[.,]\d+)?\s*(?:мм|см|mm|cm)\b|\d+\s*[xх×*]\s*\d+|\b(?:размер|диаметр|высот[аы])", _FLAGS)),
+    ("material", 1.5, re.compile(
+        r"\b(?:pla|petg|abs|tpu|asa|nylon|нейлон|смол[аыу]|пластик|фотополимер|карбон)\b", _FLAGS)),
+    ("order", 2.0, re.compile(
+        r"\b(?:заказ|закаж|оплат|предоплат|доставк|оформ|купить|куплю|счёт|счет|реквизит|"
+        r"отправ|трек|сдэк|почт[аой]|макет|напечата|печать)", _FLAGS)),
+    ("complaint", 2.0, re.compile(
+        r"\b(?:брак|жалоб|возврат|вернит|претензи|сломал|треснул|трещин|не работает|не пришл|"
+        r"обман|верните деньги|недоволен|недовольн)", _FLAGS)),
+]
+
+# Повторные совпадения того же признака в других сообщениях добавляют понемногу
+REPEAT_WEIGHT = 0.25
+REPEAT_CAP = 4
+
+
+@dataclass
+class ChatScore:
+    score: float
+    passed: bool
+    reason: str
+    features: dict[str, int] = field(default_factory=dict)
+    speakers: int = 0
+
+
+def score_chat(messages: list[str], senders: Optional[list[Optional[str]]] = None,
+               min_score: float = 2.0, min_messages: int = 2) -> ChatScore:
+    """Оценивает, стоит ли отправлять чат в LLM."""
+    hits: dict[str, int] = {}
+    score = 0.0
+    for name, weight, pattern in FEATURES:
+        count = sum(1 for m in messages if pattern.search(m))
+        if count:
+            hits[name] = count
+            score += weight + REPEAT_WEIGHT * min(count - 1, REPEAT_CAP)
+
+    speakers = len({s for s in senders or [] if s})
+    if speakers == 1:
+        score *= 0.5
+
+    if len(messages) < min_messages:
+        return ChatScore(score, False, f"сообщений {len(messages)} < {min_messages}", hits, speakers)
+    if score < min_score:
+        return ChatScore(score, False, f"балл {score:.1f} < {min_score:g}", hits, speakers)
+    return ChatScore(score, True, "", hits, speakers)
+
+
+def skipped_result(verdict: ChatScore) -> dict[str, Any]:
+    """Результат для отсеянного чата — в формате ответа модели."""
+    return {
+        "has_order": False,
+        "parameters": [],
+        "complaint": False,
+        "total_sum": None,
+        "summary": f"Пропущен предфильтром без анализа моделью: {verdict.reason}.",
+    }
+
+
+def main() -> None:
+    from client_chat_processor import chat_files, iter_unique_chats
+
+    parser = argparse.ArgumentParser(description="Оценка предфильтра на экспорте без вызова LLM")
+    parser.add_argument("chat_file", type=Path, help="файл экспорта, каталог или glob-маска")
+    parser.add_argument("--min-score", type=float, default=2.0)
+    parser.add_argument("--min-messages", type=int, default=2)
+    parser.add_argument("--show-skipped", type=int, default=10, help="сколько отсеянных чатов показать")
+    args = parser.parse_args()
+
+    total = skipped = 0
+    features: Counter = Counter()
+    examples: list[tuple[str, ChatScore]] = []
+    for chat in iter_unique_chats(chat_files(args.chat_file), os.cpu_count() or 1):
+        total += 1
+        verdict = score_chat(chat.messages, chat.message_senders, args.min_score, args.min_messages)
+        features.update(verdict.features.keys())
+        if not verdict.passed:
+            skipped += 1
+            if len(examples) < args.show_skipped:
+                examples.append((chat.name, verdict))
+    print(f"🧹 Отсеяно {skipped} из {total} чатов ({skipped / total:.1%})" if total else "⚠️ Чатов нет")
+    for name, count in features.most_common():
+        print(f"   {name}: {count} чатов")
+    for name, verdict in examples:
+        print(f"   ⏭️  {name}: {verdict.reason}")
+
+
+if __name__ == "__main__":
+    main()
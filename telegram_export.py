@@ -0,0 +1,231 @@
+"""
+telegram_export.py — потоковое чтение Telegram-экспорта
+=======================================================
+`result.json` из Telegram Desktop может весить несколько гигабайт, поэтому
+файл не загружается целиком: читатель идёт по нему кусками и отдаёт чаты по
+одному. В памяти одновременно находится только текущий чат и буфер чтения.
+
+Поддерживаются две формы файла:
+* полный архив `{"chats": {"list": [ {...}, ... ]}, ...}`;
+* просто список чатов `[ {...}, ... ]`.
+
+Владелец архива (`personal_information.user_id`) читается отдельно
+(`export_owner`): по нему различаются одинаковые id чатов из экспортов
+разных аккаунтов.
+"""
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Iterator, Optional, TextIO
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+
+_WS = re.compile(r"\s*")
+_STRUCT = re.compile(r'[\[\]{}"]')
+_STR_END = re.compile(r'["\\]')
+_SCALAR_END = re.compile(r"[,\]}\s]")
+
+
+class _StreamReader:
+    """Минимальный сканер JSON поверх текстового потока.
+
+    Умеет пропускать значения без декодирования и вырезать сырой текст
+    значения, чтобы декодировать его одним `json.loads`.
+    """
+
+    def __init__(self, f: TextIO, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    # ── буфер ──────────────────────────────────────────────────────────────
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf += chunk
+        return True
+
+    def _compact(self) -> None:
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+
+    def peek(self) -> str:
+        """Пропускает пробелы и возвращает следующий символ ('' в конце файла)."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self._compact()
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Некорректный JSON: ожидался {ch!r}, получено {got!r}")
+        self.pos += 1
+
+    # ── значения ───────────────────────────────────────────────────────────
+    def read_value(self, keep: bool = True) -> str | None:
+        """Сканирует одно JSON-значение. При keep=False текст не сохраняется."""
+        first = self.peek()
+        if not first:
+            raise ValueError("Некорректный JSON: неожиданный конец файла")
+        self._compact()
+        if first in "[{":
+            end = self._scan(0, depth=0, in_str=False, keep=keep)
+        elif first == '"':
+            end = self._scan(1, depth=0, in_str=True, keep=keep)
+        else:
+            while True:
+                m = _SCALAR_END.search(self.buf, 1)
+                if m:
+                    end = m.start()
+                    break
+                if not self._fill():
+                    end = len(self.buf)
+                    break
+        text = self.buf[:end] if keep else None
+        self.pos = end
+        return text
+
+    def _scan(self, i: int, depth: int, in_str: bool, keep: bool) -> int:
+        while True:
+            if in_str:
+                m = _STR_END.search(self.buf, i)
+                if m and m.group() == "\\" and m.end() < len(self.buf):
+                    i = m.end() + 1
+                    continue
+                if m and m.group() == '"':
+                    in_str = False
+                    i = m.end()
+                    if depth == 0:
+                        return i
+                    continue
+                # строка не закончилась в буфере — нужен следующий кусок
+                i = m.start() if m else len(self.buf)
+            else:
+                m = _STRUCT.search(self.buf, i)
+                if m:
+                    ch = m.group()
+                    i = m.end()
+                    if ch == '"':
+                        in_str = True
+                    elif ch in "[{":
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if depth == 0:
+                            return i
+                    continue
+                i = len(self.buf)
+
+            if not keep:
+                # пропускаемое значение не держим в памяти
+                self.buf = self.buf[i:]
+                i = 0
+            if not self._fill():
+                raise ValueError("Некорректный JSON: неожиданный конец файла")
+
+    def skip_value(self) -> None:
+        self.read_value(keep=False)
+
+    # ── контейнеры ─────────────────────────────────────────────────────────
+    def iter_object_keys(self) -> Iterator[str]:
+        """Идёт по ключам объекта; значение каждого ключа обязан прочитать вызывающий."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = json.loads(self.read_value())
+            self.expect(":")
+            yield key
+            nxt = self.peek()
+            self.pos += 1
+            if nxt == "}":
+                return
+            if nxt != ",":
+                raise ValueError(f"Некорректный JSON: ожидалась ',' или '}}', получено {nxt!r}")
+
+    def iter_array(self) -> Iterator[object]:
+        """Декодирует элементы массива по одному."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield json.loads(self.read_value())
+            nxt = self.peek()
+            self.pos += 1
+            if nxt == "]":
+                return
+            if nxt != ",":
+                raise ValueError(f"Некорректный JSON: ожидалась ',' или ']', получено {nxt!r}")
+
+
+def _iter_chat_list(reader: _StreamReader) -> Iterator[dict]:
+    for entry in reader.iter_array():
+        if not (isinstance(entry, dict) and "messages" in entry):
+            raise ValueError("Файл не содержит список чатов с ключом 'messages'")
+        yield entry
+
+
+def iter_chat_entries(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """Отдаёт сырые объекты чатов (`{"name", "messages", ...}`) по одному."""
+    with path.open("r", encoding="utf-8") as f:
+        reader = _StreamReader(f, chunk_size)
+        first = reader.peek()
+
+        if first == "[":
+            yield from _iter_chat_list(reader)
+            return
+
+        if first != "{":
+            raise ValueError("Файл не содержит список чатов с ключом 'messages'")
+
+        found = False
+        for key in reader.iter_object_keys():
+            if key != "chats" or reader.peek() != "{":
+                reader.skip_value()
+                continue
+            for sub_key in reader.iter_object_keys():
+                if sub_key == "list" and reader.peek() == "[":
+                    found = True
+                    yield from _iter_chat_list(reader)
+                else:
+                    reader.skip_value()
+
+        if not found:
+            raise ValueError("Файл не содержит список чатов с ключом 'messages'")
+
+
+def export_owner(path: Path, chunk_size: int = CHUNK_SIZE) -> Optional[str]:
+    """`user_id` владельца полного архива; None — у списка чатов или без `personal_information`.
+
+    Telegram Desktop пишет `personal_information` до `chats`, поэтому читается
+    только начало файла; если ключ встретился после `chats`, владелец не определяется.
+    """
+    with path.open("r", encoding="utf-8") as f:
+        reader = _StreamReader(f, chunk_size)
+        if reader.peek() != "{":
+            return None
+        for key in reader.iter_object_keys():
+            if key == "chats":
+                return None
+            if key != "personal_information":
+                reader.skip_value()
+                continue
+            info = json.loads(reader.read_value())
+            user_id = info.get("user_id") if isinstance(info, dict) else None
+            return None if user_id is None else str(user_id)
+    return None
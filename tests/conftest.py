@@ -0,0 +1,58 @@
+"""Модули проекта лежат в корне репозитория — добавляем его в sys.path."""
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    """`_process_chat` без Ollama и БД: call_llm и insert_json_result подменены.
+
+    `prompts` — промпты, ушедшие в «модель», `rows` — строки для БД.
+    """
+    import client_chat_processor as ccp
+    from backends import BackendPool
+    from history_store import HistoryStore
+    from llm_cache import LLMCache
+
+    prompts, rows = [], []
+
+    def fake_call_llm(prompt, host, model, api_key=None, **kwargs):
+        prompts.append(prompt)
+        result = {"has_order": False, "parameters": [], "complaint": False, "total_sum": None,
+                  "summary": f"{len(prompts)}-й ответ"}
+        return {"response": json.dumps(result, ensure_ascii=False), "parsed": result, "stats": {}}
+
+    monkeypatch.setattr(ccp, "call_llm", fake_call_llm)
+    monkeypatch.setattr(ccp, "insert_json_result", rows.append)
+    monkeypatch.setattr(ccp, "_dataset", None)
+    monkeypatch.setattr(ccp, "_packer", None)
+    monkeypatch.setattr(ccp, "_embeddings", None)
+
+    cfg = ccp.EnvConfig()
+    cfg.output_dir = tmp_path / "output"
+    cfg.output_dir.mkdir()
+    cfg.llm_models, cfg.llm_model = [], "test-model"
+    cfg.prefilter = False
+    cfg.prompt_compact = False
+    cfg.incremental = True
+    cfg.llm_concurrency = 1
+
+    history = HistoryStore(tmp_path / "history.sqlite")
+    cache = LLMCache(tmp_path / "cache.sqlite", mode="off")
+    backends = BackendPool(["http://fake:11434"])
+
+    def run(chat, idx=1):
+        return ccp._process_chat(idx, chat, cfg, backends, history, cache)
+
+    yield SimpleNamespace(cfg=cfg, history=history, prompts=prompts, rows=rows, run=run)
+    history.close()
+    cache.close()
+    backends.close()
@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import backends as backends_module
+from backends import BackendError, BackendPool
+
+
+@pytest.fixture
+def pool():
+    p = BackendPool(["http://a", "http://b", "http://c"], eject_seconds=60, health_interval=0.01)
+    yield p
+    p.close()
+
+
+def test_least_outstanding_backend_is_chosen(pool):
+    first = pool.acquire()
+    second = pool.acquire()
+    third = pool.acquire()
+    assert {first.url, second.url, third.url} == {"http://a", "http://b", "http://c"}
+
+    pool.release(second, 0.1)
+    assert pool.acquire().url == second.url
+
+
+def test_failed_backend_is_ejected_and_request_retried(pool):
+    calls = []
+
+    def fn(url):
+        calls.append(url)
+        if url == "http://a":
+            raise BackendError("обрыв")
+        return {"ok": url}
+
+    result, url = pool.call(fn)
+    assert calls[0] == "http://a" and url != "http://a" and result == {"ok": url}
+    assert "http://a" not in pool.healthy_urls()
+    # исключённый бэкенд не получает новых запросов
+    assert all(pool.call(lambda u: u)[1] != "http://a" for _ in range(5))
+    report = {row["url"]: row for row in pool.report()}
+    assert report["http://a"]["failures"] == 1
+
+
+def test_all_backends_failing_raises(pool):
+    def fn(url):
+        raise BackendError(f"{url} недоступен")
+
+    with pytest.raises(BackendError):
+        pool.call(fn)
+
+
+def test_other_errors_do_not_eject(pool):
+    def fn(url):
+        raise ValueError("плохой ответ")
+
+    with pytest.raises(ValueError):
+        pool.call(fn)
+    assert len(pool.healthy_urls()) == 3
+
+
+def test_recovered_backend_is_not_ejected():
+    attempts = []
+
+    def fn(url):
+        attempts.append(url)
+        if len(attempts) == 1:
+            raise BackendError("туннель упал")
+        return "ok"
+
+    pool = BackendPool(["http://a", "http://b"], recover=lambda url, started: True)
+    assert pool.call(fn)[0] == "ok"
+    assert len(attempts) == 2
+    assert pool.healthy_urls() == ["http://a", "http://b"]
+
+
+def test_health_loop_readmits_ejected_backend(pool, monkeypatch):
+    alive = threading.Event()
+    monkeypatch.setattr(backends_module, "check_health", lambda url: alive.is_set())
+    pool.release(pool.acquire(), 0.0, error=BackendError("обрыв"))
+    assert len(pool.healthy_urls()) == 2
+
+    pool.start_health_checks()
+    alive.set()
+    for _ in range(200):
+        if len(pool.healthy_urls()) == 3:
+            break
+        threading.Event().wait(0.01)
+    assert len(pool.healthy_urls()) == 3
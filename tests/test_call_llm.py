@@ -0,0 +1,134 @@
+import json
+
+import pytest
+import requests
+
+import client_chat_processor as ccp
+import transport
+from backends import BackendError, BackendPool
+from client_chat_processor import RESULT_SCHEMA, build_payload, call_llm, parse_llm_json
+
+
+class FakeResponse:
+    def __init__(self, lines, status_code=200, text=""):
+        self.lines = lines
+        self.status_code = status_code
+        self.text = text
+        self.closed = False
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error", response=self)
+
+    def iter_lines(self, decode_unicode=True):
+        yield from self.lines
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+        self.payloads = []
+
+    def post(self, url, json=None, headers=None, stream=False, timeout=None):
+        self.payloads.append(json)
+        if isinstance(self.response, Exception):
+            raise self.response
+        return self.response
+
+
+def _stream(text, **done):
+    return [json.dumps({"response": ch, "done": False}) for ch in text] + [
+        json.dumps({"response": "", "done": True, **done})
+    ]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    def install(response):
+        fake = FakeSession(response)
+        monkeypatch.setattr(transport, "_session", fake)
+        return fake
+    return install
+
+
+def test_payload_sends_only_given_parameters():
+    assert build_payload("m", "p") == {"model": "m", "prompt": "p"}
+    payload = build_payload("m", "p", schema=RESULT_SCHEMA, options={"num_ctx": 8192, "temperature": 0},
+                            keep_alive="30m")
+    assert payload["format"] is RESULT_SCHEMA
+    assert payload["options"] == {"num_ctx": 8192, "temperature": 0}
+    assert payload["keep_alive"] == "30m"
+
+
+def test_call_llm_posts_schema_options_and_keep_alive(session):
+    fake = session(FakeResponse(_stream('{"has_order": false}', eval_count=5, eval_duration=10)))
+
+    out = call_llm("p", "http://h", "m", schema=RESULT_SCHEMA, options={"temperature": 0}, keep_alive="1h")
+
+    assert fake.payloads == [build_payload("m", "p", schema=RESULT_SCHEMA, options={"temperature": 0},
+                                           keep_alive="1h")]
+    assert out["parsed"] == {"has_order": False}
+
+
+@pytest.mark.parametrize("text", [
+    '{"a": 1}',
+    '```json\n{"a": 1}\n```',
+    'Вот ответ: {"a": 1} — готово',
+])
+def test_parse_llm_json_fallbacks(text):
+    assert parse_llm_json(text) == {"a": 1}
+
+
+@pytest.mark.parametrize("text", ["нет json", "[1, 2]"])
+def test_parse_llm_json_rejects_non_objects(text):
+    with pytest.raises(ValueError):
+        parse_llm_json(text)
+
+
+def test_llm_options_come_from_config():
+    cfg = ccp.EnvConfig()
+    cfg.llm_num_ctx, cfg.llm_temperature, cfg.llm_num_predict = 4096, 0.2, 512
+    assert ccp.llm_options(cfg) == {"num_ctx": 4096, "temperature": 0.2, "num_predict": 512}
+
+
+def test_bad_request_is_not_a_backend_failure(session):
+    session(FakeResponse([], status_code=404, text='{"error": "model \'nope\' not found"}'))
+    pool = BackendPool(["http://a", "http://b"])
+
+    with pytest.raises(requests.HTTPError, match="not found") as info:
+        pool.call(lambda url: call_llm("p", url, "nope"))
+    assert not isinstance(info.value, BackendError)
+    # неверная модель не исключает бэкенды и не повторяется на соседнем
+    assert pool.healthy_urls() == ["http://a", "http://b"]
+    assert sum(row["requests"] for row in pool.report()) == 1
+
+
+@pytest.mark.parametrize("response", [
+    FakeResponse([], status_code=500),
+    FakeResponse([], status_code=429),
+    FakeResponse([], status_code=408),
+    requests.ConnectionError("connection refused"),
+    requests.Timeout("read timed out"),
+])
+def test_server_and_transport_errors_are_backend_errors(session, response):
+    session(response)
+    with pytest.raises(BackendError):
+        call_llm("p", "http://h", "m")
+
+
+def test_done_without_counters_is_a_complete_response(session):
+    # старая Ollama или прокси: финальный кусок без eval_count и прочих счётчиков
+    session(FakeResponse(_stream('{"has_order": true}')))
+
+    out = call_llm("p", "http://h", "m")
+    assert out["parsed"] == {"has_order": True}
+    assert out["stats"] == {}
+
+
+def test_stream_cut_before_done_is_a_backend_error(session):
+    session(FakeResponse(_stream('{"has_order": tr')[:-1]))
+    with pytest.raises(BackendError, match="before done"):
+        call_llm("p", "http://h", "m")
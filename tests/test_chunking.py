@@ -0,0 +1,100 @@
+from chunking import merge_partials, split_windows, window_chars_for_ctx
+from validation import validate_result
+
+
+def _length(window):
+    return sum(len(m) for m in window) + len(window) - 1
+
+
+def test_short_chat_is_one_window():
+    assert split_windows(["a", "b", "c"], 100) == [["a", "b", "c"]]
+
+
+def test_windows_fit_budget_and_overlap():
+    messages = [f"сообщение {n:03d}" for n in range(60)]
+
+    windows = split_windows(messages, 80, overlap=2)
+
+    assert len(windows) > 1
+    assert all(_length(w) <= 80 for w in windows)
+    for prev, nxt in zip(windows, windows[1:]):
+        assert prev[-2:] == nxt[:2]
+    # каждое сообщение попало хотя бы в одно окно, порядок сохранён
+    seen = [m for w in windows for m in w]
+    assert sorted(set(seen)) == messages
+
+
+def test_overlong_message_is_cut():
+    windows = split_windows(["x" * 250], 100, overlap=0)
+
+    assert ["".join(m for w in windows for m in w)] == ["x" * 250]
+    assert all(_length(w) <= 100 for w in windows)
+
+
+def test_window_chars_has_floor():
+    assert window_chars_for_ctx(512) == 1_000
+    assert window_chars_for_ctx(8192) > 1_000
+
+
+def test_merge_partials_combines_windows():
+    merged = merge_partials([
+        {"has_order": False, "parameters": [], "complaint": False, "total_sum": None, "summary": "Приветствие."},
+        {"has_order": True, "parameters": [{"item": "ваза", "price": 100}], "complaint": "трещина",
+         "total_sum": 100, "summary": "Заказ вазы."},
+        {"has_order": True, "parameters": [{"item": "ваза", "price": 100}], "complaint": "трещина",
+         "total_sum": 100, "summary": "Заказ вазы.", "extra": 1},
+    ])
+
+    assert merged["has_order"] is True
+    assert merged["parameters"] == [{"item": "ваза", "price": 100}]
+    assert merged["complaint"] == "трещина"
+    assert merged["total_sum"] == 100
+    assert merged["summary"] == "Приветствие. Заказ вазы."
+    assert merged["extra"] == 1
+
+
+def test_merge_partials_without_orders():
+    merged = merge_partials([{"has_order": False, "parameters": {}, "complaint": False, "summary": ""}])
+
+    assert merged == {"has_order": False, "parameters": [], "complaint": False, "total_sum": None, "summary": ""}
+
+
+def _window(items, total):
+    return {"has_order": True, "parameters": items, "complaint": False, "total_sum": total, "summary": ""}
+
+
+def test_merge_total_covers_items_from_every_window():
+    merged = merge_partials([
+        _window([{"item": "ваза", "price": 100}], 100),
+        _window([{"item": "кружка", "price": 50}], 50),
+    ])
+
+    assert merged["total_sum"] == 150
+    assert validate_result({**merged, "summary": "Заказ."}) == []
+
+
+def test_merge_keeps_grand_total_named_in_chat():
+    merged = merge_partials([
+        _window([{"item": "ваза", "price": 100}], 100),
+        _window([{"item": "кружка", "price": 50}], "итого 150 ₽"),
+    ])
+
+    assert merged["total_sum"] == "итого 150 ₽"
+
+
+def test_merge_total_with_line_prices():
+    merged = merge_partials([
+        _window([{"item": "ваза", "quantity": 3, "price": 300}], 300),
+        _window([{"item": "кружка", "quantity": 1, "price": 50}], 50),
+    ])
+
+    assert merged["total_sum"] == 350
+
+
+def test_merge_total_without_prices_takes_largest():
+    merged = merge_partials([
+        _window([{"item": "ваза"}], 500),
+        _window([{"item": "кружка"}], 200),
+    ])
+
+    assert merged["total_sum"] == 500
@@ -0,0 +1,59 @@
+import json
+
+from client_chat_processor import LEGACY_PROMPT_VERSION, PROMPT_VERSION
+from history_store import HistoryStore
+
+
+def test_legacy_history_is_not_current(tmp_path):
+    legacy = tmp_path / "history.jsonl"
+    legacy.write_text(json.dumps({"chat_hash": "h1", "model": "m", "success": True}) + "\n", encoding="utf-8")
+
+    with HistoryStore(tmp_path / "history.sqlite") as history:
+        assert history.import_legacy_once(legacy, LEGACY_PROMPT_VERSION) == 1
+        # результат прежнего промпта не мешает заново разобрать чат сжатым промптом
+        assert not history.contains("h1", "m", PROMPT_VERSION)
+        assert history.contains("h1", "m", LEGACY_PROMPT_VERSION)
+
+
+def test_speakers_are_tagged_and_runs_merged():
+    from compact import compact_messages
+
+    lines, stats = compact_messages(
+        ["Здравствуйте!", "Нужна ваза", "из PETG", "Сделаем за 1500 ₽", "👍"],
+        ["user7", "user7", "user7", "mgr", "user7"],
+        {"user7"},
+    )
+
+    assert lines == ["К: Нужна ваза / из PETG", "М: Сделаем за 1500 ₽"]
+    assert stats.messages_before == 5 and stats.lines_after == 2
+    assert stats.chars_before == len("\n".join(["Здравствуйте!", "Нужна ваза", "из PETG", "Сделаем за 1500 ₽", "👍"]))
+    assert stats.chars_after == len("\n".join(lines))
+    assert stats.chars_saved > 0
+
+
+def test_repeats_and_links_are_shortened():
+    from compact import compact_messages
+
+    template = "Спасибо за обращение, менеджер скоро ответит"
+    lines, _ = compact_messages(
+        [template, "Смотрите https://www.avito.ru/item/123?x=1", template, "да", "да"],
+        ["mgr", "user1", "mgr", "user1", "user1"],
+        {"user1"},
+    )
+    # повтор шаблона выброшен, поэтому реплики клиента склеились; второе «да» подряд — тоже повтор
+    assert lines == [f"М: {template}", "К: Смотрите [ссылка avito.ru] / да"]
+
+
+def test_messages_without_senders_are_untagged():
+    from compact import compact_messages
+
+    lines, _ = compact_messages(["Нужна ваза", "Цена?"], [], set())
+    assert lines == ["Нужна ваза / Цена?"]
+
+
+def test_client_is_found_by_chat_id_name_or_first_speaker():
+    from compact import client_senders
+
+    assert client_senders(["mgr", "user7"], "7", "Иван") == {"user7"}
+    assert client_senders(["mgr", "Иван"], None, "Иван") == {"Иван"}
+    assert client_senders(["mgr", "user9"], "7", "Иван", manager_ids=["mgr"]) == {"user9"}
@@ -0,0 +1,114 @@
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import pyarrow as pa  # noqa: E402
+import pyarrow.parquet as pq  # noqa: E402
+
+from dataset import ResultDataset, build_report, flatten_result, latest_versions, read_table  # noqa: E402
+
+
+def _record(record_id, total, last_message_at="2023-11-28T19:02:11", created_at="2024-06-01 10:00:00"):
+    return {
+        "id": record_id,
+        "chat_hash": record_id,
+        "created_at": created_at,
+        "last_message_at": last_message_at,
+        "source_file": "exports/a.json",
+        "model": "test-model",
+        "result": {"has_order": True, "total_sum": total, "complaint": False, "summary": "",
+                   "parameters": [{"item": "ваза", "price": total}]},
+    }
+
+
+def test_backlog_revenue_lands_in_message_month(tmp_path):
+    dataset = ResultDataset(tmp_path)
+    dataset.append(_record("old", 1500))
+    dataset.append(_record("fresh", 700, last_message_at="2024-05-30T08:00:00"))
+    dataset.close()
+
+    assert sorted(p.name for p in (tmp_path / "chats").iterdir()) == ["month=2023-11", "month=2024-05"]
+    by_month = {row["month"]: row["total_sum_sum"] for row in build_report(tmp_path)["total_sum_by_month"]}
+    assert by_month == {"2023-11": 1500.0, "2024-05": 700.0}
+
+
+def test_without_message_dates_month_is_analysis_month():
+    chat, params = flatten_result(_record("x", 100, last_message_at=None))
+    assert chat["last_message_at"] is None
+    assert params[0]["last_message_at"] is None
+    chat, _ = flatten_result(_record("x", 100, last_message_at="2024-01-02T03:04:05+03:00"))
+    assert chat["last_message_at"].isoformat() == "2024-01-02T03:04:05"
+
+
+def test_parts_written_before_the_column_still_read(tmp_path):
+    directory = tmp_path / "chats" / "month=2024-06"
+    directory.mkdir(parents=True)
+    pq.write_table(pa.table({"id": ["legacy"], "total_sum": [10.0]}), directory / "part-old.parquet")
+    dataset = ResultDataset(tmp_path)
+    dataset.append(_record("new", 20))
+    dataset.close()
+
+    table = read_table(tmp_path, "chats")
+    rows = {row["id"]: row for row in table.to_pylist()}
+    assert rows["legacy"]["last_message_at"] is None
+    assert rows["legacy"]["month"] == "2024-06"
+    assert rows["new"]["month"] == "2023-11"
+
+
+def test_pipeline_passes_last_message_date(pipeline):
+    from client_chat_processor import ChatRecord
+
+    chat = ChatRecord(name="Иван", messages=["Хочу вазу", "Жду"], chat_id="1", message_ids=[1, 2],
+                      message_dates=["2023-11-28T19:02:11", None], source_files=["exports/a.json"])
+    pipeline.run(chat)
+
+    assert pipeline.rows[0]["last_message_at"] == "2023-11-28T19:02:11"
+    assert flatten_result(pipeline.rows[0])[0]["last_message_at"].strftime("%Y-%m") == "2023-11"
+
+
+def test_versions_written_in_same_second_keep_only_latest_items(tmp_path):
+    dataset = ResultDataset(tmp_path)
+    first = _record("x", 100)
+    first["result"]["parameters"] = [{"item": "ваза"}, {"item": "кружка"}]
+    dataset.append(first)
+    dataset.append(_record("x", 200))
+    dataset.close()
+
+    chats, params = latest_versions(read_table(tmp_path, "chats"), read_table(tmp_path, "parameters"))
+
+    assert chats["total_sum"].to_pylist() == [200.0]
+    assert params["item"].to_pylist() == ["ваза"]
+    assert params["price"].to_pylist() == [200.0]
+
+
+def test_parts_without_version_join_on_created_at(tmp_path):
+    directory = tmp_path / "parameters" / "month=2024-06"
+    directory.mkdir(parents=True)
+    created_at = pa.array([datetime(2024, 6, 1, 10)], pa.timestamp("s"))
+    pq.write_table(pa.table({"id": ["legacy"], "created_at": created_at, "item": ["ваза"]}),
+                   directory / "part-old.parquet")
+    directory = tmp_path / "chats" / "month=2024-06"
+    directory.mkdir(parents=True)
+    pq.write_table(pa.table({"id": ["legacy"], "created_at": created_at}), directory / "part-old.parquet")
+
+    _, params = latest_versions(read_table(tmp_path, "chats"), read_table(tmp_path, "parameters"))
+
+    assert params["item"].to_pylist() == ["ваза"]
+
+
+def test_prefiltered_chats_are_reported_separately(tmp_path):
+    dataset = ResultDataset(tmp_path)
+    dataset.append({**_record("a", 100), "result": {**_record("a", 100)["result"], "complaint": True}})
+    dataset.append(_record("b", 200))
+    skipped = _record("c", None)
+    skipped["model"] = "prefilter"
+    skipped["result"] = {"has_order": False, "complaint": False, "total_sum": None, "parameters": []}
+    dataset.append(skipped)
+    dataset.close()
+
+    report = build_report(tmp_path)
+
+    assert (report["chats"], report["prefiltered"]) == (2, 1)
+    assert report["complaint_rate_by_model"] == [{"model": "test-model", "complaint_i_mean": 0.5, "id_count": 2}]
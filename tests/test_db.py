@@ -0,0 +1,154 @@
+
+import json
+
+import pytest
+
+from db import BatchWriter, DbConfig, make_backend
+
+
+def test_mysql_requires_password(monkeypatch):
+    monkeypatch.setenv("DB_BACKEND", "mysql")
+    monkeypatch.delenv("DB_PASSWORD", raising=False)
+
+    cfg = DbConfig()
+    assert cfg.password == ""
+    with pytest.raises(ValueError, match="DB_PASSWORD"):
+        make_backend(cfg)
+
+    monkeypatch.setenv("DB_PASSWORD", "secret")
+    DbConfig().validate()
+
+
+def test_sqlite_needs_no_password(monkeypatch):
+    monkeypatch.setenv("DB_BACKEND", "sqlite")
+    monkeypatch.delenv("DB_PASSWORD", raising=False)
+
+    DbConfig().validate()
+
+
+def test_unknown_backend(monkeypatch):
+    monkeypatch.setenv("DB_BACKEND", "oracle")
+
+    with pytest.raises(ValueError, match="oracle"):
+        DbConfig().validate()
+
+
+class FlakyBackend:
+    """Отклоняет строки с id «bad*» как ошибку данных; `down` раз подряд — «нет соединения»."""
+
+    def __init__(self, down: int = 0):
+        self.down = down
+        self.rows = []
+        self.calls = 0
+
+    @staticmethod
+    def is_row_error(exc):
+        return isinstance(exc, ValueError)
+
+    def write_many(self, rows):
+        self.calls += 1
+        if self.down:
+            self.down -= 1
+            raise ConnectionError("сервер недоступен")
+        if any(row[0].startswith("bad") for row in rows):
+            raise ValueError("Data too long for column 'result_json'")
+        self.rows.extend(rows)
+
+
+def _session(record_id):
+    return {"id": record_id, "source_file": "a.json", "created_at": "2024-01-01 00:00:00", "host": "h",
+            "model": "m", "result": {}, "success": True, "error": None}
+
+
+def _writer(backend, tmp_path, **kwargs):
+    return BatchWriter(backend, batch_size=8, flush_interval=0.01, max_retry_delay=0.01,
+                       dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+
+def test_bad_row_goes_to_dead_letter_and_rest_is_written(tmp_path):
+    backend = FlakyBackend()
+    writer = _writer(backend, tmp_path)
+    ids = [f"ok{n}" for n in range(7)]
+    ids.insert(3, "bad-1")
+    for record_id in ids:
+        writer.put(_session(record_id))
+    writer.close()
+
+    assert sorted(row[0] for row in backend.rows) == sorted(i for i in ids if not i.startswith("bad"))
+    dead = [json.loads(line) for line in (tmp_path / "dead.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert [d["row"]["id"] for d in dead] == ["bad-1"]
+    assert "Data too long" in dead[0]["error"]
+    assert (writer.written, writer.dead_lettered) == (7, 1)
+
+
+def test_outage_is_retried_without_losing_rows(tmp_path):
+    backend = FlakyBackend(down=3)
+    writer = _writer(backend, tmp_path)
+    for n in range(5):
+        writer.put(_session(f"ok{n}"))
+    writer.close()
+
+    assert len(backend.rows) == 5
+    assert not (tmp_path / "dead.jsonl").exists()
+
+
+def test_rows_unwritten_at_shutdown_are_kept(tmp_path):
+    backend = FlakyBackend(down=1000)
+    writer = _writer(backend, tmp_path, stop_attempts=2)
+    writer.put(_session("ok0"))
+    writer.close()
+
+    dead = (tmp_path / "dead.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["row"]["id"] for line in dead] == ["ok0"]
+
+
+def test_sqlite_backend_rejects_row_not_batch(tmp_path, monkeypatch):
+    monkeypatch.setenv("DB_BACKEND", "sqlite")
+    monkeypatch.setenv("DB_SQLITE_PATH", str(tmp_path / "results.sqlite"))
+    backend = make_backend(DbConfig())
+    writer = _writer(backend, tmp_path)
+    writer.put(_session("ok0"))
+    bad = _session("bad")
+    bad["created_at"] = object()  # такой тип sqlite3 не свяжет — ошибка данных, а не соединения
+    writer.put(bad)
+    writer.put(_session("ok1"))
+    writer.close()
+
+    ids = [r[0] for r in backend.conn.execute("SELECT id FROM chat_sessions_json ORDER BY id")]
+    assert ids == ["ok0", "ok1"]
+    assert writer.dead_lettered == 1
+
+
+class _BrokenConnection:
+    """Соединение MySQL, оборвавшееся посреди пачки: падает и запрос, и откат."""
+
+    def __init__(self):
+        self.sql = None
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def executemany(self, sql, rows):
+        self.sql = sql
+        raise ConnectionError("Lost connection to MySQL server during query")
+
+    def rollback(self):
+        raise RuntimeError("MySQL Connection not available")
+
+    def close(self):
+        self.closed = True
+
+
+def test_mysql_rollback_failure_keeps_original_error():
+    from db import MySQLBackend
+
+    conn = _BrokenConnection()
+    backend = MySQLBackend.__new__(MySQLBackend)
+    backend.get_connection = lambda: conn
+
+    with pytest.raises(ConnectionError):
+        backend.write_many([("id",) * 8])
+
+    assert conn.closed
+    assert ") AS new" in conn.sql and "model=new.model" in conn.sql and "VALUES(" not in conn.sql
@@ -0,0 +1,97 @@
+import multiprocessing
+import sys
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from embeddings import EmbeddingIndex  # noqa: E402
+
+DIM = 8
+
+
+def _rows(prefix, n, start=0):
+    rows = [{"chat_hash": f"{prefix}-h{i}", "id": f"{prefix}-{i}", "name": f"чат {i}", "summary": f"итог {i}"}
+            for i in range(start, start + n)]
+    vectors = np.random.default_rng(start).standard_normal((n, DIM)).astype(np.float32)
+    return rows, vectors
+
+
+def test_find_by_id_and_hash_returns_latest_version(tmp_path):
+    index = EmbeddingIndex(tmp_path, "m")
+    index.add(*_rows("a", 3))
+    rows, vectors = _rows("a", 1)
+    rows[0]["chat_hash"] = "a-h0-v2"
+    index.add(rows, vectors)
+
+    assert index.find("a-1") == 1
+    assert index.find("a-h2") == 2
+    assert index.find("a-0") == 3
+    assert index.find("a-h0") is None  # вытесненная версия
+    assert index.find("нет такого") is None
+
+    reader = EmbeddingIndex(tmp_path, "m", writable=False)
+    assert reader.find("a-0") == 3 and reader.row(3)["chat_hash"] == "a-h0-v2"
+
+
+def test_second_writer_picks_up_rows_of_the_first(tmp_path):
+    first = EmbeddingIndex(tmp_path, "m")
+    second = EmbeddingIndex(tmp_path, "m")
+    first.add(*_rows("a", 2))
+    # второй писатель не знает о строках первого, пока не возьмёт блокировку
+    assert second.add(*_rows("a", 3)) == 1
+    assert second.count == 3
+
+    rows, vectors = _rows("a", 1)
+    rows[0]["chat_hash"] = "a-h0-v2"
+    first.add(rows, vectors)
+
+    reopened = EmbeddingIndex(tmp_path, "m")
+    assert reopened.count == 4
+    assert [reopened.row(i)["id"] for i in range(4)] == ["a-0", "a-1", "a-2", "a-0"]
+    assert reopened.find("a-0") == 3 and reopened.find("a-h0") is None
+
+
+def _writer(root, prefix):
+    index = EmbeddingIndex(root, "m")
+    for start in range(0, 40, 4):
+        index.add(*_rows(prefix, 4, start))
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="fork и flock")
+def test_concurrent_processes_do_not_interleave_rows(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_writer, args=(tmp_path, prefix)) for prefix in ("a", "b", "c")]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+        assert proc.exitcode == 0
+
+    index = EmbeddingIndex(tmp_path, "m", writable=False)
+    assert index.count == 120
+    ids = [index.row(i)["id"] for i in range(index.count)]
+    assert sorted(ids) == sorted(f"{p}-{i}" for p in "abc" for i in range(40))
+    assert all(index.find(row_id) == n for n, row_id in enumerate(ids))
+
+
+def test_embeddings_share_llm_slots(monkeypatch):
+    import client_chat_processor as ccp
+    from backends import BackendPool
+
+    slots = threading.BoundedSemaphore(1)
+    seen = []
+
+    def fake_embed(url, model, texts, api_key=None):
+        seen.append(slots.acquire(blocking=False))
+        return [[1.0] * DIM for _ in texts]
+
+    monkeypatch.setattr(ccp, "_llm_slots", slots)
+    monkeypatch.setattr(ccp, "ollama_embed", fake_embed)
+    backends = BackendPool(["http://fake:11434"])
+    try:
+        assert len(ccp.embed_texts(["a", "b"], ccp.EnvConfig(), backends)) == 2
+    finally:
+        backends.close()
+    assert seen == [False]  # слот уже занят самим запросом эмбеддингов
@@ -0,0 +1,100 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from export_to_gsheets import HEADERS, Manifest, sync_sheet
+from gsheets_fake import FakeWorksheet
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _write_result(folder, name, summary, chat_hash=None):
+    data = {
+        "source_file": f"{name}.json",
+        "created_at": "2024-05-01 10:00:00",
+        "model": "gemma3n",
+        "chat_hash": chat_hash or name,
+        "result": {"has_order": True, "total_sum": 100, "complaint": False, "summary": summary},
+    }
+    (folder / f"{name}_analysis.json").write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _sync(tmp_path, **kwargs):
+    sheet = FakeWorksheet(tmp_path / "sheet.json")
+    manifest = Manifest(tmp_path / "manifest.json", "fake", "Чаты")
+    return sheet, sync_sheet(tmp_path / "out", sheet, manifest, **kwargs)
+
+
+def test_first_sync_writes_header_and_rows(tmp_path):
+    (tmp_path / "out").mkdir()
+    for n in range(3):
+        _write_result(tmp_path / "out", f"chat{n}", f"резюме {n}")
+
+    sheet, stats = _sync(tmp_path)
+
+    assert stats == {"appended": 3, "updated": 0, "unchanged": 0}
+    assert sheet.cells[0] == HEADERS
+    assert [row[5] for row in sheet.cells[1:]] == ["резюме 0", "резюме 1", "резюме 2"]
+
+
+def test_second_sync_updates_changed_row_in_place(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    _write_result(out, "chat0", "старое")
+    _write_result(out, "chat1", "без изменений")
+    _sync(tmp_path)
+
+    _write_result(out, "chat0", "новое")
+    _write_result(out, "chat2", "добавлен")
+    sheet, stats = _sync(tmp_path)
+
+    assert stats == {"appended": 1, "updated": 1, "unchanged": 1}
+    assert [row[5] for row in sheet.cells[1:]] == ["новое", "без изменений", "добавлен"]
+    assert ("clear", 0) not in sheet.calls
+    assert ("batch_update", 1) in sheet.calls
+
+
+def test_cleared_sheet_is_rewritten(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    _write_result(out, "chat0", "резюме")
+    sheet, _ = _sync(tmp_path)
+    sheet.clear()
+
+    sheet, stats = _sync(tmp_path)
+
+    assert stats["appended"] == 1
+    assert len(sheet.cells) == 2
+
+
+def test_large_upload_is_chunked(tmp_path):
+    out = tmp_path / "out"
+    out.mkdir()
+    for n in range(7):
+        _write_result(out, f"chat{n}", "x" * 50)
+
+    sheet, stats = _sync(tmp_path, max_rows=3)
+
+    assert stats["appended"] == 7
+    assert [n for call, n in sheet.calls if call == "update"] == [1, 3, 3, 1]
+
+
+def test_export_does_not_import_fake_sheet():
+    code = "import sys, export_to_gsheets; assert 'gsheets_fake' not in sys.modules; assert 'bench' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+
+def test_bare_result_file_as_written_by_processor(tmp_path):
+    # save_result пишет только разобранный ответ модели — без source_file, model и chat_hash
+    out = tmp_path / "out"
+    out.mkdir()
+    result = {"has_order": True, "total_sum": 100, "complaint": False, "summary": "резюме"}
+    (out / "1_ivan_analysis.json").write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+
+    sheet, stats = _sync(tmp_path)
+
+    assert stats["appended"] == 1
+    assert sheet.cells[1][0] == "1_ivan_analysis" and sheet.cells[1][5] == "резюме"
+    rows = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))["rows"]
+    assert set(rows["1_ivan_analysis.json"]) == {"mtime_ns", "size", "digest", "row"}
@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+from history_store import HistoryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = HistoryStore(tmp_path / "history.sqlite", batch_size=2)
+    yield s
+    s.close()
+
+
+def _entry(chat_hash, success, output, model="m"):
+    return {"chat_hash": chat_hash, "model": model, "success": success, "output": output}
+
+
+def _outputs(store):
+    store.flush()
+    return sorted(store._conn.execute("SELECT chat_hash, output FROM history").fetchall())
+
+
+def test_contains_sees_pending_and_flushed_successes(store):
+    store.append(_entry("h1", True, "a.json"), "2")
+    assert store.contains("h1", "m", "2")  # ещё в буфере
+    store.append(_entry("h2", False, None), "2")  # пачка из двух — записана
+    assert store.contains("h1", "m", "2")
+    assert not store.contains("h2", "m", "2")
+    assert not store.contains("h1", "other", "2")
+    assert not store.contains("h1", "m", "1")
+    assert len(store) == 2
+
+
+def test_compact_keeps_last_success_else_last_failure(store):
+    for entry in (
+        _entry("ok", False, "fail-1"), _entry("ok", True, "ok-1"), _entry("ok", True, "ok-2"),
+        _entry("ok", False, "fail-2"),
+        _entry("bad", False, "fail-1"), _entry("bad", False, "fail-2"),
+    ):
+        store.append(entry, "2")
+
+    assert store.compact() == 4
+    assert _outputs(store) == [("bad", "fail-2"), ("ok", "ok-2")]
+
+
+def test_compact_keys_include_model_and_prompt_version(store):
+    store.append(_entry("h", True, "m-v1"), "1")
+    store.append(_entry("h", True, "m-v2"), "2")
+    store.append(_entry("h", True, "n-v2", model="n"), "2")
+
+    assert store.compact() == 0
+    assert len(_outputs(store)) == 3
+
+
+def test_import_legacy_once_runs_only_once(tmp_path, store):
+    legacy = tmp_path / "history.jsonl"
+    lines = [json.dumps(_entry("h1", True, "a.json")), "не json", json.dumps({"success": True})]
+    legacy.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+    assert store.import_legacy_once(legacy, "1") == 1
+    assert store.import_legacy_once(legacy, "1") is None
+    assert len(store) == 1
+    assert store.contains("h1", "m", "1")
+
+
+def test_import_legacy_once_without_file(tmp_path, store):
+    assert store.import_legacy_once(tmp_path / "missing.jsonl") is None
+
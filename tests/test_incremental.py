@@ -0,0 +1,69 @@
+from client_chat_processor import ChatRecord, prepare_update_prompt
+
+
+def _chat(texts, chat_id="777", first_id=1, source="exports/a.json"):
+    ids = list(range(first_id, first_id + len(texts)))
+    return ChatRecord(
+        name="Иван",
+        messages=list(texts),
+        chat_id=chat_id,
+        message_ids=ids,
+        message_dates=[f"2024-01-01T00:00:{i:02d}" for i in ids],
+        message_senders=["user1"] * len(texts),
+        source_files=[source],
+    )
+
+
+def test_new_indices_by_id_then_by_date():
+    chat = _chat(["a", "b", "c"])
+
+    assert chat.new_indices(1, None) == [1, 2]
+    assert chat.new_indices(3, None) == []
+    chat.message_ids = [1, None, 3]
+    assert chat.new_indices(1, "2024-01-01T00:00:02") == [2]
+    chat.message_dates = [None, None, None]
+    assert chat.new_indices(1, "2024-01-01T00:00:02") is None
+
+
+def test_unchanged_chat_is_skipped(pipeline):
+    chat = _chat(["Здравствуйте", "Хочу вазу"])
+
+    assert pipeline.run(chat) is not None
+    assert pipeline.run(chat) is None
+    assert len(pipeline.prompts) == 1
+
+
+def test_only_new_messages_are_sent(pipeline):
+    first = _chat(["Здравствуйте", "Хочу вазу"])
+    out = pipeline.run(first)
+    watermark = pipeline.history.get_watermark(first.key)
+    assert watermark["last_message_id"] == 2
+
+    grown = _chat(["Здравствуйте", "Хочу вазу", "Ваза пришла с трещиной"])
+    assert pipeline.run(grown, idx=5) == out
+
+    update = pipeline.prompts[-1]
+    assert update == prepare_update_prompt(watermark["result"], "Ваза пришла с трещиной",
+                                           max_chars=pipeline.cfg.llm_num_ctx * 3)
+    assert "Хочу вазу" not in update.split("<chat>")[1]
+    # тот же id строки в БД: дообработка заменяет прежний результат
+    assert pipeline.rows[0]["id"] == pipeline.rows[1]["id"]
+    assert pipeline.history.get_watermark(grown.key)["last_message_id"] == 3
+
+
+def test_edited_history_without_new_messages_is_skipped(pipeline):
+    pipeline.run(_chat(["Здравствуйте", "Хочу вазу"]))
+
+    assert pipeline.run(_chat(["Здравствуйте", "Хочу две вазы"])) is None
+    assert len(pipeline.prompts) == 1
+
+
+def test_other_model_watermark_means_full_analysis(pipeline):
+    pipeline.run(_chat(["Здравствуйте", "Хочу вазу"]))
+    pipeline.cfg.llm_model = "other-model"
+
+    pipeline.run(_chat(["Здравствуйте", "Хочу вазу", "И кружку"]))
+
+    assert "<previous>" not in pipeline.prompts[-1]
+    assert "Хочу вазу" in pipeline.prompts[-1]
+
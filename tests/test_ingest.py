@@ -0,0 +1,82 @@
+import json
+
+from client_chat_processor import ChatRecord, _hash_export, chat_job, iter_unique_chats
+from job_queue import JobQueue
+
+
+def _write(path, chats):
+    entries = [{"id": chat_id, "name": f"Чат {chat_id}",
+                "messages": [{"id": n, "type": "message", "text": t} for n, t in enumerate(texts, 1)]}
+               for chat_id, texts in chats]
+    path.write_text(json.dumps(entries, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_duplicates_across_files_are_yielded_once_with_every_source(tmp_path):
+    a = _write(tmp_path / "a.json", [(1, ["Хочу вазу"]), (2, ["Где заказ?"])])
+    b = _write(tmp_path / "b.json", [(3, ["Новый клиент"]), (1, ["Хочу вазу"])])
+    c = _write(tmp_path / "c.json", [(1, ["Хочу вазу"]), (1, ["Хочу вазу"])])
+
+    chats = list(iter_unique_chats([a, b, c], workers=2))
+
+    assert [(chat.chat_id, chat.messages) for chat in chats] == [
+        ("1", ["Хочу вазу"]), ("2", ["Где заказ?"]), ("3", ["Новый клиент"]),
+    ]
+    assert chats[0].source_files == [str(a), str(b), str(c)]
+    assert chats[1].source_files == [str(a)]
+    assert chats[2].source_files == [str(b)]
+
+
+def test_stray_json_in_export_dir_is_skipped(tmp_path, capsys):
+    a = _write(tmp_path / "a.json", [(1, ["Хочу вазу"])])
+    settings = tmp_path / "settings.json"
+    settings.write_text('{"theme": "dark"}', encoding="utf-8")
+    b = _write(tmp_path / "b.json", [(2, ["Где заказ?"])])
+
+    chats = list(iter_unique_chats([a, settings, b], workers=2))
+
+    assert [chat.chat_id for chat in chats] == ["1", "2"]
+    assert f"⚠️ {settings} пропущен" in capsys.readouterr().out
+
+
+def test_first_pass_returns_only_hashes(tmp_path):
+    path = _write(tmp_path / "a.json", [(1, ["Хочу вазу"]), (2, ["Хочу вазу"])])
+
+    hashes, error = _hash_export(str(path))
+    assert error is None
+    assert len(hashes) == 2 and hashes[0] == hashes[1]
+    assert all(isinstance(h, str) for h in hashes)
+
+
+def _export(path, owner, texts, chat_id=777):
+    messages = [{"id": n, "type": "message", "date": f"2024-01-01T00:00:{n:02d}", "text": t}
+                for n, t in enumerate(texts, 1)]
+    archive = {"personal_information": {"user_id": owner},
+               "chats": {"list": [{"id": chat_id, "name": "Клиент", "messages": messages}]}}
+    path.write_text(json.dumps(archive, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def test_same_chat_id_in_two_exports_keeps_separate_state(tmp_path, pipeline):
+    # id 777 — это собеседник: в аккаунтах двух менеджеров разные переписки с одним клиентом
+    files = [_export(tmp_path / "a.json", 1, ["Хочу вазу"]), _export(tmp_path / "b.json", 2, ["Хочу кружку"])]
+    chats = list(iter_unique_chats(files, workers=1))
+    assert [c.key for c in chats] == ["user:1#id:777", "user:2#id:777"]
+
+    for idx, chat in enumerate(chats, 1):
+        pipeline.run(chat, idx)
+    assert pipeline.history.get_watermark(chats[0].key)["last_message_id"] == 1
+    assert pipeline.history.get_watermark(chats[1].key)["last_message_id"] == 1
+
+    with JobQueue(tmp_path / "jobs.sqlite") as queue:
+        assert queue.enqueue(chat_job(idx, chat) for idx, chat in enumerate(chats, 1)) == 2
+        assert queue.counts()["pending"] == 2
+
+
+def test_key_without_owner_does_not_depend_on_the_file(tmp_path):
+    before = _write(tmp_path / "a.json", [(777, ["Хочу вазу"])])
+    after = before.rename(tmp_path / "renamed.json")
+    assert next(iter_unique_chats([after])).key == "id:777"
+    chat = ChatRecord(name="Иван", messages=["a"], chat_id="777", source_files=[str(before)])
+    assert chat.key == "id:777"
+    assert ChatRecord(name="Иван", messages=[]).key == "name:Иван"
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from job_queue import DEAD, DONE, LEASED, PENDING, JobQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = JobQueue(tmp_path / "jobs.sqlite", lease_seconds=60, max_attempts=3, backoff_base=0.01, backoff_max=0.01)
+    yield q
+    q.close()
+
+
+def _jobs(*keys, chat_hash="h"):
+    return [(key, n, f"{chat_hash}-{key}", {"name": key}) for n, key in enumerate(keys, 1)]
+
+
+def test_enqueue_is_idempotent_and_requeues_changed_chats(queue):
+    assert queue.enqueue(_jobs("a", "b")) == 2
+    assert queue.enqueue(_jobs("a", "b")) == 0
+    assert queue.claim("w1")[0] == "a"
+    queue.complete("a", "w1")
+
+    assert queue.enqueue(_jobs("a", chat_hash="new")) == 1
+    assert queue.counts()[PENDING] == 2
+
+
+def test_claim_in_order_and_complete(queue):
+    queue.enqueue(_jobs("a", "b"))
+
+    assert queue.claim("w1") == ("a", 1, {"name": "a"})
+    assert queue.claim("w2") == ("b", 2, {"name": "b"})
+    assert queue.claim("w3") is None
+
+    queue.complete("a", "w1")
+    queue.complete("b", "other")  # чужая аренда не завершается
+    assert queue.counts() == {PENDING: 0, LEASED: 1, DONE: 1, DEAD: 0}
+
+
+def test_fail_backs_off_then_goes_dead(queue):
+    queue.enqueue(_jobs("a"))
+    for expected in (PENDING, PENDING, DEAD):
+        while (job := queue.claim("w")) is None:
+            time.sleep(0.005)
+        assert queue.fail(job[0], "w", "boom") == expected
+
+    assert queue.counts()[DEAD] == 1
+    assert queue.dead() == [("a", 3, "boom")]
+    assert queue.next_wakeup() is None
+
+    assert queue.retry_dead() == 1
+    assert queue.claim("w")[0] == "a"
+
+
+def test_expired_lease_is_taken_over(queue):
+    queue.lease_seconds = 0.05
+    queue.enqueue(_jobs("a"))
+    assert queue.claim("crashed") is not None
+    assert queue.claim("w2") is None
+
+    time.sleep(0.06)
+    assert queue.claim("w2")[0] == "a"
+    queue.complete("a", "crashed")  # старый владелец уже не может завершить задачу
+    assert queue.counts()[LEASED] == 1
+
+
+def test_repeatedly_expired_lease_becomes_dead(queue):
+    queue.lease_seconds = 0.01
+    queue.enqueue(_jobs("poison", "b"))
+    queue.claim("w1")
+    time.sleep(0.02)
+    assert queue.claim("w2")[0] == "poison"
+    time.sleep(0.02)
+    assert queue.claim("w3")[0] == "poison"
+    time.sleep(0.02)
+
+    # третий перехват при max_attempts=3 — задача мертва, берётся следующая
+    assert queue.claim("w4")[0] == "b"
+    assert queue.counts()[DEAD] == 1
+    (chat_key, attempts, error), = queue.dead()
+    assert (chat_key, attempts) == ("poison", 3)
+    assert "w3" in error
+
+
+def test_release_returns_own_jobs_without_penalty(queue):
+    queue.enqueue(_jobs("a", "b"))
+    queue.claim("w1")
+    queue.claim("w2")
+
+    assert queue.release("w1") == 1
+    assert queue.claim("w3") == ("a", 1, {"name": "a"})
+    assert queue.next_wakeup() is not None
@@ -0,0 +1,50 @@
+import json
+
+from json_stream import JsonObjectScanner
+
+
+def _feed(chunks):
+    scanner = JsonObjectScanner()
+    for n, chunk in enumerate(chunks, 1):
+        if scanner.feed(chunk) is not None:
+            return scanner.result, n
+    return scanner.result, None
+
+
+def test_object_completes_on_closing_brace():
+    obj = {"has_order": True, "summary": 'кавычка \\" и скобка } в строке', "parameters": [{"item": "кружка"}]}
+    text = json.dumps(obj, ensure_ascii=False) + "\n\nПояснение модели..."
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+
+    result, at = _feed(chunks)
+
+    assert result == obj
+    # объект распознан на куске с закрывающей скобкой, а не в конце пояснения
+    assert at == (len(json.dumps(obj, ensure_ascii=False)) + 2) // 3
+
+
+def test_code_fence_and_prose_before_object():
+    result, _ = _feed(["Вот ответ:\n```json\n", '{"a": 1', ', "b": [1, 2]}', "\n```"])
+
+    assert result == {"a": 1, "b": [1, 2]}
+
+
+def test_braces_in_prose_are_skipped():
+    result, _ = _feed(["Формат {ответа} такой: ", '{"ok": true}'])
+
+    assert result == {"ok": True}
+
+
+def test_incomplete_object_returns_none():
+    result, at = _feed(['{"a": 1, "b": "не закрыт'])
+
+    assert result is None and at is None
+
+
+def test_top_level_array_is_not_an_object():
+    scanner = JsonObjectScanner()
+
+    assert scanner.feed("[1, 2, 3]") is None
+    assert scanner.feed(' {"x": 1}') == {"x": 1}
+    # после результата новые куски ничего не меняют
+    assert scanner.feed('{"y": 2}') == {"x": 1}
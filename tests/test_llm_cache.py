@@ -0,0 +1,80 @@
+import time
+
+import pytest
+
+from llm_cache import LLMCache, cache_key
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return tmp_path / "cache.sqlite"
+
+
+def test_key_depends_on_model_prompt_and_options():
+    base = cache_key("m", "prompt", {"temperature": 0})
+    assert base == cache_key("m", "prompt", {"temperature": 0})
+    assert len({base, cache_key("n", "prompt", {"temperature": 0}), cache_key("m", "prompt 2", {"temperature": 0}),
+                cache_key("m", "prompt", {"temperature": 0.5})}) == 4
+
+
+def test_on_mode_hits_after_put(cache_path):
+    with_cache = LLMCache(cache_path)
+    assert with_cache.get("k") is None
+    with_cache.put("k", "m", '{"a": 1}', {"a": 1})
+
+    assert with_cache.get("k") == {"response": '{"a": 1}', "parsed": {"a": 1}}
+    assert with_cache.stats()["hits"] == 1 and with_cache.stats()["misses"] == 1
+    with_cache.close()
+
+
+def test_refresh_mode_misses_but_rewrites(cache_path):
+    LLMCache(cache_path).put("k", "m", "old")
+    refresh = LLMCache(cache_path, mode="refresh")
+    assert refresh.get("k") is None
+    refresh.put("k", "m", "new")
+    refresh.close()
+
+    assert LLMCache(cache_path).get("k")["response"] == "new"
+
+
+def test_off_mode_touches_nothing(cache_path):
+    off = LLMCache(cache_path, mode="off")
+    off.put("k", "m", "x")
+    assert off.get("k") is None
+    assert off.stats()["entries"] == 0
+    assert not cache_path.exists()
+
+
+def test_unknown_mode_is_rejected(cache_path):
+    with pytest.raises(ValueError):
+        LLMCache(cache_path, mode="sometimes")
+
+
+def test_lru_eviction_keeps_recently_used(cache_path):
+    cache = LLMCache(cache_path, max_entries=2, max_age_days=0, evict_every=10_000)
+    for key in ("a", "b", "c"):
+        cache.put(key, "m", key)
+        time.sleep(0.01)
+    cache.get("a")  # «a» использовался позже «b»
+
+    assert cache.evict() == 1
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_age_eviction_drops_stale_entries(cache_path):
+    cache = LLMCache(cache_path, max_age_days=1, evict_every=10_000)
+    cache.put("old", "m", "x")
+    cache.put("fresh", "m", "y")
+    with cache._conn:
+        cache._conn.execute("UPDATE llm_cache SET last_access=? WHERE key='old'", (time.time() - 2 * 86400,))
+
+    assert cache.evict() == 1
+    assert cache.get("old") is None and cache.get("fresh") is not None
+
+
+def test_eviction_runs_every_n_puts(cache_path):
+    cache = LLMCache(cache_path, max_entries=3, max_age_days=0, evict_every=5)
+    for i in range(5):
+        cache.put(str(i), "m", "x")
+    assert cache.stats()["entries"] == 3
@@ -0,0 +1,47 @@
+from metrics import Metrics, StageStats
+
+
+def test_stage_stats_memory_is_bounded():
+    stats = StageStats(size=100)
+    for n in range(100_000):
+        stats.add(n / 100_000)
+
+    assert len(stats.sample) == 100
+    assert stats.count == 100_000
+    assert abs(stats.total - sum(n / 100_000 for n in range(100_000))) < 1e-6
+    assert stats.max == 99_999 / 100_000
+    # выборка равномерная: медиана выборки близка к медиане всех замеров
+    assert 0.35 < sorted(stats.sample)[50] < 0.65
+
+
+def test_snapshot_and_prometheus():
+    metrics = Metrics()
+    for seconds in (0.1, 0.2, 0.3, 0.4):
+        metrics.observe("call_llm", seconds)
+    metrics.count("pack_requests", 2)
+    metrics.observe_llm({"prompt_eval_count": 10, "eval_count": 5, "eval_duration": 2_000_000_000}, 30)
+
+    snap = metrics.snapshot()
+    row = snap["stages"]["call_llm"]
+    assert (row["count"], round(row["total"], 6), row["max"]) == (4, 1.0, 0.4)
+    assert row["p50"] in (0.2, 0.3) and row["p95"] == 0.4
+    assert snap["stages"]["ollama_eval"]["total"] == 2.0
+    assert snap["counters"]["pack_requests"] == 2
+    assert snap["counters"]["prompt_tokens"] == 10
+
+    text = metrics.prometheus_text()
+    assert 'chat_pipeline_stage_seconds_count{stage="call_llm"} 4' in text
+    assert "chat_pipeline_pack_requests_total 2" in text
+
+
+def test_bind_tags_events_per_thread(tmp_path):
+    metrics = Metrics()
+    metrics.configure(tmp_path / "m.jsonl")
+    with metrics.bind("id:1"):
+        with metrics.span("load_chat"):
+            pass
+    metrics.observe("load_chat", 0.1)
+    metrics.close()
+
+    chats = [line.split('"chat": ')[1].split(",")[0] for line in (tmp_path / "m.jsonl").read_text().splitlines()]
+    assert chats == ['"id:1"', "null"]
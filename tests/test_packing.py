@@ -0,0 +1,110 @@
+import json
+import threading
+
+from packing import ChatPacker
+
+
+class Recorder:
+    """`send` для ChatPacker: запоминает пачки и отвечает результатом на каждый чат."""
+
+    def __init__(self, drop=()):
+        self.packs = []
+        self.drop = set(drop)
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.packs.append(list(texts))
+        return {n: {"text": t} for n, t in enumerate(texts, 1) if t not in self.drop}, "http://gpu"
+
+
+def _analyze_all(packer, texts):
+    results = {}
+
+    def run(text):
+        results[text] = packer.analyze(text)
+
+    threads = [threading.Thread(target=run, args=(t,)) for t in texts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results
+
+
+def test_full_pack_is_sent_by_chat_count():
+    send = Recorder()
+    packer = ChatPacker(send, max_chars=10_000, max_chats=4, linger=5)
+
+    results = _analyze_all(packer, [f"чат {n}" for n in range(4)])
+
+    assert len(send.packs) == 1 and sorted(send.packs[0]) == sorted(results)
+    assert all(results[t] == ({"text": t}, "http://gpu") for t in results)
+    assert (packer.packs_sent, packer.chats_sent) == (1, 4)
+
+
+def test_char_budget_splits_packs():
+    send = Recorder()
+    packer = ChatPacker(send, max_chars=25, max_chats=10, linger=0.05)
+
+    results = _analyze_all(packer, ["a" * 10, "b" * 10, "c" * 10])
+
+    assert all(sum(len(t) for t in pack) <= 25 for pack in send.packs)
+    assert sorted(t for pack in send.packs for t in pack) == sorted(results)
+    assert all(r is not None for r in results.values())
+
+
+def test_lingering_pack_is_sent_without_neighbours():
+    send = Recorder()
+    packer = ChatPacker(send, max_chars=10_000, max_chats=8, linger=0.05)
+
+    assert packer.analyze("одинокий чат") == ({"text": "одинокий чат"}, "http://gpu")
+    assert send.packs == [["одинокий чат"]]
+
+
+def test_missing_result_and_failed_pack_return_none():
+    send = Recorder(drop={"потерян"})
+    packer = ChatPacker(send, max_chars=10_000, max_chats=2, linger=5)
+
+    results = _analyze_all(packer, ["потерян", "найден"])
+
+    assert results["потерян"] is None
+    assert results["найден"] == ({"text": "найден"}, "http://gpu")
+
+    def broken(texts):
+        raise RuntimeError("LLM недоступна")
+
+    assert ChatPacker(broken, max_chars=100, max_chats=1).analyze("x") is None
+
+
+def test_fits_reserves_room_for_result():
+    packer = ChatPacker(Recorder(), max_chars=100, max_chats=4, result_chars=40)
+
+    assert packer.fits("x" * 60)
+    assert not packer.fits("x" * 61)
+
+
+def test_packed_results_are_cached_per_chat(tmp_path, monkeypatch):
+    import client_chat_processor as ccp
+    from llm_cache import LLMCache
+
+    def fake_call_llm(prompt, host, model, api_key=None, **kwargs):
+        results = [{"id": n, "has_order": True, "parameters": [], "complaint": False,
+                    "total_sum": n, "summary": ""} for n in (1, 2)]
+        response = json.dumps({"results": results})
+        return {"response": response, "parsed": json.loads(response), "stats": {}}
+
+    monkeypatch.setattr(ccp, "call_llm", fake_call_llm)
+    cfg = ccp.EnvConfig()
+    cfg.llm_models, cfg.llm_model = [], "test-model"
+    cache = LLMCache(tmp_path / "cache.sqlite")
+    backends = ccp.BackendPool(["http://fake:11434"])
+    try:
+        results, _ = ccp.analyze_pack(["чат 1", "чат 2"], cfg, backends, cache)
+        # в следующем прогоне «чат 2» попадёт в другую пачку — его результат всё равно в кэше
+        hit = cache.get(ccp.pack_cache_key("чат 2", cfg))
+        assert hit["parsed"] == results[2] and hit["parsed"]["total_sum"] == 2
+        assert cache.get(ccp.pack_cache_key("чат 3", cfg)) is None
+    finally:
+        cache.close()
+        backends.close()
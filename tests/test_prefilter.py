@@ -0,0 +1,57 @@
+import pytest
+
+from prefilter import PREFILTER_MODEL, score_chat, skipped_result
+
+ORDER = ["Здравствуйте, хочу заказать вазу из PETG", "Высота 160мм, цена 1500 ₽, доставка СДЭК"]
+
+
+def test_commercial_chat_passes():
+    verdict = score_chat(ORDER, ["client", "manager"])
+    assert verdict.passed
+    assert set(verdict.features) == {"price", "size", "material", "order"}
+    assert verdict.speakers == 2
+
+
+def test_small_talk_is_skipped():
+    verdict = score_chat(["Привет!", "С днём рождения 🎉"], ["a", "b"])
+    assert not verdict.passed and verdict.score == 0
+    assert "балл" in verdict.reason
+
+
+@pytest.mark.parametrize("min_score, passed", [(2.0, True), (2.5, False)])
+def test_score_threshold(min_score, passed):
+    # одна жалоба — ровно 2 балла
+    assert score_chat(["Ваза пришла с трещиной", "Разберёмся"], ["a", "b"], min_score).passed is passed
+
+
+def test_too_few_messages_is_skipped():
+    verdict = score_chat(ORDER[:1], ["client"], min_messages=2)
+    assert not verdict.passed and "сообщений 1 < 2" in verdict.reason
+
+
+def test_one_sided_chat_gets_half_score():
+    both = score_chat(ORDER, ["client", "manager"])
+    one = score_chat(ORDER, ["spam", "spam"])
+    assert one.score == both.score / 2
+
+
+def test_repeats_add_a_little_and_are_capped():
+    once = score_chat(["брак", "ок"], ["a", "b"]).score
+    twice = score_chat(["брак", "брак"], ["a", "b"]).score
+    many = score_chat(["брак"] * 20, ["a", "b"] * 10).score
+    assert twice == once + 0.25
+    assert many == once + 0.25 * 4
+
+
+def test_skipped_chat_bypasses_the_model(pipeline):
+    from client_chat_processor import ChatRecord
+
+    pipeline.cfg.prefilter = True
+    chat = ChatRecord(name="Друг", messages=["Привет!", "Как дела?"], chat_id="5", message_ids=[1, 2],
+                      message_senders=["a", "b"], source_files=["exports/a.json"])
+    pipeline.run(chat)
+
+    assert pipeline.prompts == []
+    assert pipeline.rows[0]["model"] == PREFILTER_MODEL
+    assert pipeline.rows[0]["result"]["has_order"] is False
+    assert skipped_result(score_chat(chat.messages, chat.message_senders))["summary"].startswith("Пропущен")
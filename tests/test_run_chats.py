@@ -0,0 +1,64 @@
+import threading
+import time
+
+import pytest
+
+from client_chat_processor import run_chats
+
+
+def test_workers_are_bounded_and_every_chat_runs():
+    lock = threading.Lock()
+    active, peak, done = 0, 0, []
+
+    def worker(idx, chat):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+            done.append(idx)
+
+    run_chats(((i, f"chat {i}") for i in range(20)), worker, concurrency=3)
+
+    assert sorted(done) == list(range(20))
+    assert peak == 3
+
+
+def test_source_is_not_read_far_ahead():
+    started = threading.Event()
+    release = threading.Event()
+    taken = []
+
+    def source():
+        for i in range(50):
+            taken.append(i)
+            yield i, None
+
+    def worker(idx, chat):
+        started.set()
+        release.wait(5)
+
+    runner = threading.Thread(target=run_chats, args=(source(), worker, 2))
+    runner.start()
+    started.wait(5)
+    time.sleep(0.05)
+    # в очереди не больше 2 * concurrency задач, плюс одна, ждущая места
+    assert len(taken) <= 2 * 2 + 1
+    release.set()
+    runner.join(5)
+    assert len(taken) == 50
+
+
+def test_worker_error_stops_the_run():
+    seen = []
+
+    def worker(idx, chat):
+        seen.append(idx)
+        if idx == 0:
+            raise RuntimeError("сбой")
+
+    with pytest.raises(RuntimeError):
+        run_chats(((i, None) for i in range(100)), worker, concurrency=1)
+    assert len(seen) < 100
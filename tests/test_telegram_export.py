@@ -0,0 +1,63 @@
+import json
+
+import pytest
+
+from telegram_export import export_owner, iter_chat_entries
+
+
+def _chat(chat_id, texts):
+    return {
+        "id": chat_id,
+        "name": f"Чат {chat_id}",
+        "messages": [{"id": n, "type": "message", "text": t} for n, t in enumerate(texts, 1)],
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 20])
+def test_full_archive_streams_every_chat(tmp_path, chunk_size):
+    chats = [
+        _chat(1, ['строка с "кавычками" и \\ слэшем', "скобки {[ ]} внутри строки"]),
+        _chat(2, ["ещё", "сообщения"]),
+    ]
+    archive = {
+        "about": "Telegram export",
+        "personal_information": {"user_id": 42, "first_name": "Менеджер"},
+        "contacts": {"list": [{"first_name": "x", "messages": "не чат"}]},
+        "chats": {"about": "список", "list": chats},
+        "left_chats": {"list": []},
+    }
+    path = tmp_path / "result.json"
+    path.write_text(json.dumps(archive, ensure_ascii=False, indent=1), encoding="utf-8")
+
+    assert list(iter_chat_entries(path, chunk_size=chunk_size)) == chats
+    assert export_owner(path, chunk_size=chunk_size) == "42"
+
+
+def test_plain_list_of_chats(tmp_path):
+    chats = [_chat(7, ["a"]), _chat(8, ["b", "c"])]
+    path = tmp_path / "chats.json"
+    path.write_text(json.dumps(chats), encoding="utf-8")
+
+    assert list(iter_chat_entries(path, chunk_size=3)) == chats
+    assert export_owner(path) is None
+
+
+def test_empty_list(tmp_path):
+    path = tmp_path / "chats.json"
+    path.write_text('{"chats": {"list": []}}', encoding="utf-8")
+
+    assert list(iter_chat_entries(path)) == []
+
+
+@pytest.mark.parametrize("content", [
+    '{"about": "no chats here"}',
+    '[{"name": "без messages"}]',
+    '"строка"',
+    '{"chats": {"list": [{"messages": []}',
+])
+def test_malformed_export_raises(tmp_path, content):
+    path = tmp_path / "bad.json"
+    path.write_text(content, encoding="utf-8")
+
+    with pytest.raises(ValueError):
+        list(iter_chat_entries(path, chunk_size=4))
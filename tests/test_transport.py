@@ -0,0 +1,59 @@
+import os
+import socket
+import sys
+
+import pytest
+
+import transport
+from transport import SshTunnel, listening_pids
+
+
+@pytest.fixture
+def listener():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        yield sock.getsockname()[1]
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    ports = []
+    monkeypatch.setattr(SshTunnel, "_spawn", lambda self: ports.append(self.local_port))
+    return ports
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="нужен /proc")
+def test_listening_pids_finds_own_socket(listener):
+    assert os.getpid() in listening_pids(listener)
+
+
+def test_foreign_listener_is_not_reused(listener, spawned, capsys):
+    # порт слушает не ssh (здесь — сам pytest, в жизни — локальная Ollama)
+    tunnel = SshTunnel("gpu1", "user", local_port=listener)
+    tunnel.start()
+
+    assert not tunnel.reused
+    assert spawned == [tunnel.local_port] and tunnel.local_port != listener
+    assert f"поднимаем на порту {tunnel.local_port}" in capsys.readouterr().out
+
+
+def test_own_ssh_tunnel_is_reused(listener, spawned, monkeypatch, capsys):
+    tunnel = SshTunnel("gpu1", "user", local_port=listener)
+    monkeypatch.setattr(transport, "listening_pids", lambda port: {4242} if port == listener else set())
+    monkeypatch.setattr(transport, "process_cmdline", lambda pid: ["/usr/bin/ssh"] + tunnel.command()[1:])
+    tunnel.start()
+
+    assert tunnel.reused and spawned == []
+    assert tunnel.url == f"http://localhost:{listener}"
+    assert "pid 4242" in capsys.readouterr().out
+
+
+def test_ssh_to_another_host_is_not_reused(listener, spawned, monkeypatch):
+    other = SshTunnel("gpu2", "user", local_port=listener)
+    monkeypatch.setattr(transport, "listening_pids", lambda port: {4242})
+    monkeypatch.setattr(transport, "process_cmdline", lambda pid: other.command())
+    tunnel = SshTunnel("gpu1", "user", local_port=listener)
+    tunnel.start()
+
+    assert not tunnel.reused and tunnel.local_port != listener
@@ -0,0 +1,59 @@
+import pytest
+
+from coerce import items_total, to_bool, to_number
+from validation import validate_result
+
+
+def _result(**overrides):
+    result = {
+        "has_order": True,
+        "parameters": [{"item": "ваза", "quantity": 2, "price": 100}, {"item": "кружка", "price": 50}],
+        "complaint": False,
+        "total_sum": 250,
+        "summary": "Заказ вазы и кружки.",
+    }
+    result.update(overrides)
+    return result
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1500, 1500.0), ("1 500 ₽", 1500.0), ("1 500", 1500.0), ("2,5", 2.5), ("нет", None), (True, None), (None, None),
+])
+def test_to_number(value, expected):
+    assert to_number(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("трещина на вазе", True), ("нет", False), ("", False), (0, False), (None, None), (True, True),
+])
+def test_to_bool(value, expected):
+    assert to_bool(value) is expected
+
+
+def test_items_total_needs_every_price():
+    assert items_total([{"price": 100, "quantity": 2}, {"price": "50"}]) == (250.0, 150.0)
+    assert items_total([{"price": 100}, {"item": "без цены"}]) is None
+
+
+def test_valid_result_has_no_problems():
+    assert validate_result(_result()) == []
+    # price как стоимость строки тоже сходится
+    assert validate_result(_result(total_sum=150)) == []
+
+
+@pytest.mark.parametrize("overrides, problem", [
+    ({"total_sum": 50}, "total_sum 50 не сходится с позициями (250)"),
+    ({"summary": " ", "complaint": "сломано"}, "жалоба без описания"),
+    ({"has_order": False}, "total_sum без заказа"),
+    ({"has_order": True, "parameters": [], "total_sum": None}, "заказ без позиций и суммы"),
+    ({"total_sum": "250"}, "total_sum не число"),
+])
+def test_problems(overrides, problem):
+    assert problem in validate_result(_result(**overrides))
+
+
+def test_missing_keys():
+    assert validate_result({"summary": "x"}) == [
+        "нет поля has_order", "нет поля parameters", "нет поля complaint", "нет поля total_sum",
+    ]
+    assert validate_result([]) == ["ответ не JSON-объект"]
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+transport.py — HTTP-транспорт и SSH-туннели к Ollama
+====================================================
+* все запросы к бэкендам идут через один `requests.Session` с пулом
+  keep-alive соединений — TCP (и SSH-канал туннеля) не открывается
+  заново на каждый чат;
+* туннель считается готовым, когда локальный порт принимает соединения,
+  а не через фиксированную паузу;
+* если локальный порт уже слушает наш ssh-туннель к тому же хосту
+  (туннель-демон или туннель другого запуска), он переиспользуется, и ssh
+  не запускается; порт, занятый чем-то другим (например, локальной
+  Ollama), не используется — туннель поднимается на свободном порту;
+* упавший туннель поднимается заново (`SshTunnel.ensure`), а запрос,
+  на котором это выяснилось, повторяется.
+
+Долгоживущий туннель, который переиспользуют последующие запуски
+(пароль — из SSH_PASS):
+
+    python3 transport.py tunnel user@host[:22] [--local-port 11434] [--remote-port 11434]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🌐 Пул соединений
+# ────────────────────────────────────────────────────────────────────────────────
+def configure(pool_size: int) -> requests.Session:
+    """Создаёт общий Session с пулом на `pool_size` соединений к каждому хосту."""
+    global _session
+    sess = requests.Session()
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max(1, pool_size), pool_block=False)
+    sess.mount("http://", adapter)
+    sess.mount("https://", adapter)
+    with _session_lock:
+        old, _session = _session, sess
+    if old is not None:
+        old.close()
+    return sess
+
+
+def session() -> requests.Session:
+    """Общий Session; без `configure` — пул по умолчанию (10 соединений)."""
+    sess = _session
+    return sess if sess is not None else configure(10)
+
+
+def check_health(url: str, timeout: float = 5.0) -> bool:
+    try:
+        resp = session().get(f"{url.rstrip('/')}/api/tags", timeout=timeout)
+        return resp.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+# 4xx, после которых повтор на другом бэкенде может помочь: таймаут запроса и перегрузка
+RETRYABLE_CLIENT_ERRORS = (408, 429)
+
+
+def is_request_error(error: requests.RequestException) -> bool:
+    """Ошибка самого запроса (неверная модель, тело), а не бэкенда: 4xx, кроме 408/429.
+
+    Такой запрос не повторяют на других бэкендах и не исключают из-за него бэкенд.
+    """
+    response = getattr(error, "response", None)
+    if not isinstance(error, requests.HTTPError) or response is None:
+        return False
+    return 400 <= response.status_code < 500 and response.status_code not in RETRYABLE_CLIENT_ERRORS
+
+
+def port_open(host: str, port: int, timeout: float = 0.5) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def free_port() -> int:
+    """Свободный локальный TCP-порт (выбирает ОС)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def listening_pids(port: int) -> Optional[set[int]]:
+    """PID процессов, слушающих локальный TCP-порт (по /proc).
+
+    None — узнать нельзя (не Linux); пустое множество — слушает процесс,
+    чьи дескрипторы нам не видны (другой пользователь).
+    """
+    inodes = set()
+    found = False
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            with open(table, encoding="ascii") as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    # local_address = IP:PORT в hex, st 0A = LISTEN
+                    if fields[3] == "0A" and int(fields[1].rsplit(":", 1)[1], 16) == port:
+                        inodes.add(fields[9])
+            found = True
+        except OSError:
+            continue
+    if not found:
+        return None
+    targets = {f"socket:[{inode}]" for inode in inodes}
+    pids = set()
+    for entry in os.scandir("/proc") if targets else ():
+        if not entry.name.isdigit():
+            continue
+        try:
+            fds = os.scandir(f"/proc/{entry.name}/fd")
+            if any(os.readlink(fd.path) in targets for fd in fds):
+                pids.add(int(entry.name))
+        except OSError:
+            continue
+    return pids
+
+
+def process_cmdline(pid: int) -> list[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return [arg.decode(errors="replace") for arg in f.read().split(b"\0") if arg]
+    except OSError:
+        return []
+
+
+def wait_for_port(host: str, port: int, timeout: float = 15.0,
+                  proc: Optional[subprocess.Popen] = None) -> bool:
+    """Ждёт, пока порт начнёт принимать соединения; False — не дождались или процесс умер."""
+    deadline = time.monotonic() + timeout
+    delay = 0.02
+    while time.monotonic() < deadline:
+        if port_open(host, port):
+            return True
+        if proc is not None and proc.poll() is not None:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
+    return False
+
+
+# ────────────────────────────────────────────────────────────────────────────────
+# 🔌 SSH‑туннель
+# ────────────────────────────────────────────────────────────────────────────────
+class SshTunnel:
+    """Проброс `localhost:local_port` → `remote_port` на SSH-хосте.
+
+    Контекстный менеджер возвращает URL бэкенда. Открытый ранее ssh-туннель
+    к тому же хосту переиспользуется и при выходе не закрывается; если порт
+    занят чем-то другим, туннель поднимается на свободном порту.
+    """
+
+    def __init__(self, host: str, user: str, ssh_port: int = 22, local_port: int = 11434,
+                 remote_port: int = 11434, password: Optional[str] = None, ready_timeout: float = 15.0):
+        self.host = host
+        self.user = user
+        self.ssh_port = ssh_port
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.password = password
+        self.ready_timeout = ready_timeout
+        self.proc: subprocess.Popen | None = None
+        self.reused = False
+        self.restarts = 0
+        self.restarted_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://localhost:{self.local_port}"
+
+    def command(self) -> list[str]:
+        cmd = [
+            "ssh",
+            "-o", "StrictHostKeyChecking=no",
+            # порт занят или проброс не удался — ssh завершается, а не висит без туннеля
+            "-o", "ExitOnForwardFailure=yes",
+            # оборванное соединение замечается за ~45 с, ssh выходит и туннель поднимается заново
+            "-o", "ServerAliveInterval=15",
+            "-o", "ServerAliveCountMax=3",
+            "-p", str(self.ssh_port),
+            "-L", f"{self.local_port}:localhost:{self.remote_port}",
+            f"{self.user}@{self.host}",
+            "-N",
+        ]
+        if self.password:
+            cmd = ["sshpass", "-p", self.password] + cmd
+        return cmd
+
+    def owns_listener(self) -> Optional[int]:
+        """PID ssh, который слушает local_port и пробрасывает его на наш хост; иначе None."""
+        forward = f"{self.local_port}:localhost:{self.remote_port}"
+        for pid in sorted(listening_pids(self.local_port) or ()):
+            argv = process_cmdline(pid)
+            is_ssh = bool(argv) and os.path.basename(argv[0]) in ("ssh", "sshpass")
+            forwards = forward in argv or f"-L{forward}" in argv
+            if is_ssh and forwards and f"{self.user}@{self.host}" in argv:
+                return pid
+        return None
+
+    def start(self) -> None:
+        if port_open("localhost", self.local_port):
+            pid = self.owns_listener()
+            if pid is not None:
+                self.reused = True
+                print(f"♻️ Порт {self.local_port} уже проброшен на {self.user}@{self.host} (ssh, pid {pid}) — "
+                      f"используем открытый туннель: {self.url}")
+                return
+            busy = self.local_port
+            self.local_port = free_port()
+            print(f"⚠️ Порт {busy} занят не нашим туннелем (например, локальной Ollama) — "
+                  f"туннель к {self.user}@{self.host} поднимаем на порту {self.local_port}")
+        self._spawn()
+
+    def _spawn(self) -> None:
+        started = time.monotonic()
+        self.proc = subprocess.Popen(
+            self.command(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            preexec_fn=os.setsid if os.name != "nt" else None,
+            creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0,
+        )
+        if not wait_for_port("localhost", self.local_port, self.ready_timeout, self.proc):
+            code = self.proc.poll()
+            self.stop()
+            reason = f"ssh завершился с кодом {code}" if code is not None else f"нет ответа за {self.ready_timeout:.0f} с"
+            raise RuntimeError(f"Туннель {self.user}@{self.host} → :{self.local_port} не поднялся: {reason}")
+        print(f"🔌 Туннель {self.user}@{self.host} → {self.url} готов за {time.monotonic() - started:.2f} с")
+
+    def alive(self) -> bool:
+        if self.proc is not None and self.proc.poll() is not None:
+            return False
+        return check_health(self.url)
+
+    def ensure(self) -> bool:
+        """Проверяет туннель и при необходимости поднимает его заново. True — туннель работает.
+
+        Вызывается из рабочих потоков после сбоя запроса; под блокировкой,
+        чтобы одновременные сбои перезапускали туннель один раз.
+        """
+        with self._lock:
+            if self.alive():
+                return True
+            if self.reused:
+                # чужой туннель (демон) перезапускает его владелец — ждём порт
+                if (wait_for_port("localhost", self.local_port, self.ready_timeout)
+                        and self.owns_listener() is not None and check_health(self.url)):
+                    self.restarted_at = time.monotonic()
+                    return True
+                return False
+            print(f"🔁 Туннель {self.user}@{self.host} → :{self.local_port} упал, поднимаем заново")
+            self.stop()
+            try:
+                self._spawn()
+            except RuntimeError as e:
+                print(f"⚠️ {e}")
+                return False
+            self.restarts += 1
+            self.restarted_at = time.monotonic()
+            return True
+
+    def recover(self, since: float) -> bool:
+        """Восстановление после сбоя запроса, начатого в `since` (monotonic).
+
+        True — туннель с тех пор поднят заново и запрос стоит повторить;
+        False — туннель ни при чём (или не поднялся), бэкенд исключается как обычно.
+        """
+        return self.ensure() and self.restarted_at >= since
+
+    def stop(self) -> None:
+        if self.proc and self.proc.poll() is None:
+            try:
+                if os.name == "nt":
+                    self.proc.send_signal(signal.CTRL_BREAK_EVENT)
+                else:
+                    os.killpg(self.proc.pid, signal.SIGTERM)
+            except Exception:  # pylint: disable=broad-except
+                pass
+            self.proc.wait(timeout=5)
+        self.proc = None
+
+    def __enter__(self) -> str:  # noqa: D401
+        self.start()
+        return self.url
+
+    def __exit__(self, exc_type, exc, tb):  # noqa: D401
+        self.stop()
+
+
+def run_daemon(tunnel: SshTunnel, interval: float = 10.0) -> None:
+    """Держит туннель открытым до Ctrl-C/SIGTERM, перезапуская его при обрыве."""
+    def on_term(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, on_term)
+    tunnel.start()
+    if tunnel.reused:
+        return
+    print(f"🛡️ Туннель-демон на {tunnel.url}; Ctrl-C — остановить")
+    try:
+        while True:
+            time.sleep(interval)
+            if not tunnel.ensure():
+                time.sleep(interval)  # не долбим ssh, пока хост недоступен
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tunnel.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SSH-туннели к Ollama")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_tunnel = sub.add_parser("tunnel", help="долгоживущий туннель для последующих запусков")
+    p_tunnel.add_argument("target", help="[user@]host[:port]")
+    p_tunnel.add_argument("--local-port", type=int, default=int(os.getenv("LOCAL_PORT", "11434")))
+    p_tunnel.add_argument("--remote-port", type=int, default=int(os.getenv("REMOTE_PORT", "11434")))
+    p_tunnel.add_argument("--interval", type=float, default=10.0, help="как часто проверять туннель, с")
+    args = parser.parse_args()
+
+    user, _, host = args.target.rpartition("@")
+    host, _, port = host.partition(":")
+    tunnel = SshTunnel(host, user or os.getenv("SSH_USER", "root"), int(port or os.getenv("SSH_PORT", "22")),
+                       args.local_port, args.remote_port, os.getenv("SSH_PASS") or None)
+    run_daemon(tunnel, args.interval)
+
+
+if __name__ == "__main__":
+    main()
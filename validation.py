@@ -0,0 +1,64 @@
+"""
+validation.py — проверка ответа модели для каскада моделей
+==========================================================
+Маленькая модель отвечает быстро, но на сложных чатах ошибается: жалоба
+без описания, `total_sum`, не сходящаяся с позициями, строка вместо
+числа. `validate_result` проверяет разобранный ответ:
+
+* обязательные поля есть и типы совпадают с `RESULT_SCHEMA`;
+* `summary` не пустой (в том числе при `complaint`);
+* без заказа нет суммы, у заказа есть позиции или сумма;
+* сумма позиций `price * quantity` (или просто `price`, если модель
+  записала в него стоимость строки) совпадает с `total_sum`.
+
+Пустой список проблем — ответ принимается, иначе чат уходит следующей
+модели каскада (`LLM_MODELS`).
+"""
+from __future__ import annotations
+
+from typing import Any
+
+from coerce import items_total, sums_match, to_bool
+
+REQUIRED_KEYS = ("has_order", "parameters", "complaint", "total_sum", "summary")
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def validate_result(result: Any) -> list[str]:
+    """Проблемы ответа модели; пустой список — ответ годится."""
+    if not isinstance(result, dict):
+        return ["ответ не JSON-объект"]
+    missing = [f"нет поля {key}" for key in REQUIRED_KEYS if key not in result]
+    if missing:
+        return missing
+
+    problems = []
+    has_order, parameters = result["has_order"], result["parameters"]
+    complaint, total, summary = result["complaint"], result["total_sum"], result["summary"]
+    if not isinstance(has_order, bool):
+        problems.append("has_order не boolean")
+    if not isinstance(parameters, list) or not all(isinstance(p, dict) for p in parameters):
+        problems.append("parameters не список объектов")
+        parameters = []
+    if not isinstance(complaint, (bool, str)):
+        problems.append("complaint не boolean/строка")
+    if total is not None and not _is_number(total):
+        problems.append("total_sum не число")
+        total = None
+    if not isinstance(summary, str) or not summary.strip():
+        problems.append("жалоба без описания" if to_bool(complaint) else "пустой summary")
+    not_numbers = {key for p in parameters for key in ("quantity", "price")
+                   if p.get(key) is not None and not _is_number(p[key])}
+    problems.extend(f"parameters[].{key} не число" for key in sorted(not_numbers))
+
+    if has_order is False and total:
+        problems.append("total_sum без заказа")
+    if has_order is True and not parameters and total is None:
+        problems.append("заказ без позиций и суммы")
+    sums = items_total(parameters) if parameters and total is not None else None
+    if sums is not None and not any(sums_match(total, s) for s in sums):
+        problems.append(f"total_sum {total:g} не сходится с позициями ({sums[0]:g})")
+    return problems